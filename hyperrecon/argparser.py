@@ -3,6 +3,7 @@ import json
 import time
 import os
 from pprint import pprint
+from hyperrecon.loss import losses
 
 
 class Parser(argparse.ArgumentParser):
@@ -17,10 +18,54 @@ class Parser(argparse.ArgumentParser):
               default=25, help='Frequency of logs')
     self.add_argument('--date', type=str, default=None,
               help='Override date')
+    self.add_argument('--ckpt_keep_last', type=int, default=5,
+              help='Number of most recent checkpoints to keep, 0 keeps all')
+    self.add_argument('--ckpt_best_metric', type=str, default='psnr:val:',
+              help='Val metric (or prefix, averaged) used to keep the best checkpoint')
+    self.add_argument('--ckpt_best_mode', type=str, default='max',
+              choices=['max', 'min'], help='Whether higher or lower metric is better')
+    self.add_bool_arg('resume', default=True)
+    self.add_argument('--metrics_flush_every', type=int, default=10,
+              help='Number of epochs of metrics to buffer before writing')
+    self.add_argument('--stage_timing', type=str, default='on',
+              choices=['off', 'on', 'sync'],
+              help='Per-stage timing, sync synchronizes CUDA around each stage')
+    self.add_argument('--profile_steps', nargs='+', type=int, default=(),
+              help='Global train steps to export a profiler trace for')
     self.add_argument('--num_train_subjects', type=int, default=50,
               help='Number of subjects to train on')
     self.add_argument('--num_val_subjects', type=int, default=5,
               help='Number of subjects to validate on')
+    self.add_argument('--train_path', type=str, default=None,
+              help='Path to train dataset')
+    self.add_argument('--test_path', type=str, default=None,
+              help='Path to test dataset')
+    self.add_argument('--dataset', type=str, default='arr',
+              choices=['arr', 'phantom'],
+              help='Arrays at train/test paths, or generated phantoms')
+    self.add_argument('--num_phantoms', nargs=2, type=int, default=(1024, 64),
+              help='Number of train and test phantoms')
+
+    # Distributed parameters
+    self.add_argument('--world_size', type=int, default=1,
+              help='Number of data-parallel processes')
+    self.add_argument('--dist_backend', type=str, default='gloo',
+              choices=['gloo', 'nccl'], help='Distributed backend')
+    self.add_argument('--dist_url', type=str, default='tcp://127.0.0.1:29500',
+              help='URL used to set up distributed training')
+
+    # Early stopping parameters
+    self.add_argument('--prune_policy', type=str, default='none',
+              choices=['none', 'successive_halving', 'median'],
+              help='Policy to stop underperforming runs of a sweep')
+    self.add_argument('--prune_dir', type=str, default=None,
+              help='Directory shared by all runs of a sweep to compare scores')
+    self.add_argument('--prune_milestones', nargs='+', type=int, default=(50, 100, 200, 400),
+              help='Epochs at which runs are compared')
+    self.add_argument('--prune_eta', type=int, default=2,
+              help='Keep top 1/eta of runs at each milestone for successive halving')
+    self.add_argument('--trial_id', type=str, default=None,
+              help='Name of the run reported to the pruner, defaults to run_dir')
 
     # Machine learning parameters
     self.add_argument('--image_dims', nargs='+', type=int, default=(256, 256),
@@ -52,24 +97,45 @@ class Parser(argparse.ArgumentParser):
     self.add_argument('--forward_type', type=str, default='csmri',
               choices=['csmri', 'inpainting', 'superresolution', 'denoising'])
     self.add_argument('--distribution', type=str, default='uniform',
-              choices=['uniform', 'uniform_oversample', 'constant'])
+              choices=['uniform', 'uniform_oversample', 'sobol', 'stratified', 'adaptive', 'constant'])
     self.add_argument('--uniform_bounds', nargs='+', type=float, default=(0., 1.),
               help='Bounds of uniform distribution')
+    self.add_argument('--adaptive_bins', type=int, default=8,
+              help='Bins per hyperparameter of adaptive distribution')
+    self.add_argument('--adaptive_smoothing', type=float, default=0.1,
+              help='Weight of newest batch in running loss estimates of adaptive distribution')
+    self.add_argument('--adaptive_floor', type=float, default=0.2,
+              help='Weight of uniform distribution in adaptive distribution')
 
     # Model parameters
     self.add_argument('--topK', type=int, default=None)
     self.add_argument('--undersampling_rate', type=str, default='4p2')
+    self.add_argument('--mask_type', type=str, default='poisson',
+              choices=['poisson', 'vds'],
+              help='Shipped Poisson-disk masks, or generated variable-density masks')
+    self.add_argument('--dc_scale', type=float, default=None)
+    self.add_argument('--num_coils', type=int, default=1,
+              help='Number of receive coils for csmri, multi-coil if > 1')
+    self.add_argument('--sens_maps', type=str, default=None,
+              help='.npy coil sensitivity maps of shape [num_coils, 2, l, w], default synthetic')
+    self.add_argument('--coil_chunk', type=int, default=None,
+              help='Coils per batched FFT, bounds memory of multi-coil forward')
     self.add_argument('--denoising_sigma', type=float, default=None)
-    self.add_argument('--loss_list', choices=['dc', 'tv', 'cap', 'wave', 'mse', 'l1', 'ssim', 'l1pen'],
-              nargs='+', type=str, help='<Required> Set flag', required=True)
+    self.add_argument('--loss_list', nargs='+', type=str, required=True,
+              help='<Required> Losses, built-in: dc, tv, wave, mse, l1, ssim, l1pen, or registered under the hyperrecon.losses entry point group')
     self.add_argument(
       '--method', choices=['base_train', 'dhs'], \
                            type=str, help='Training method', required=True)
     self.add_bool_arg('range_restrict')
+    self.add_bool_arg('topk_backward', default=False)
     self.add_bool_arg('unet_residual', default=True)
     self.add_argument('--hyperparameters', nargs='+', type=float, default=None)
     self.add_argument('--additive_gauss_std', type=float, default=0., 
                         help='Std for additive Gaussian noise')
+    self.add_argument('--noise_type', type=str, default='gaussian', choices=['gaussian', 'rician'],
+                        help='Noise on measurements, rician only for real-valued measurements')
+    self.add_argument('--rician_snr', nargs='+', type=float, default=[5.],
+                        help='Rician noise level in percent of max intensity, or range to sample per image')
 
   def add_bool_arg(self, name, default=True):
     """Add boolean argument to argparse parser"""
@@ -80,8 +146,12 @@ class Parser(argparse.ArgumentParser):
 
   def validate_args(self, args):
     assert args.batch_size > 1 and args.batch_size % 2 == 0
+    assert args.world_size >= 1
+    if args.prune_policy != 'none':
+      assert args.prune_dir is not None, 'Pruning must set prune_dir'
     if args.method == 'dhs':
       assert args.topK is not None, 'DHS sampling must set topK'
+      assert 'dc' in args.loss_list, 'DHS sampling ranks samples by dc loss'
     elif args.distribution == 'constant':
       assert args.hyperparameters is not None, 'Baseline and constant must set hyperparameters'
       assert args.arch in ['unet', 'simple_img']
@@ -91,15 +161,28 @@ class Parser(argparse.ArgumentParser):
     if args.range_restrict:
       assert len(
         args.loss_list) <= 3, 'Range restrict loss must have 3 or fewer loss functions'
+    if args.dataset == 'arr':
+      assert args.train_path is not None and args.test_path is not None, \
+        'Arr dataset must set train_path and test_path'
     if args.mask_type == 'poisson':
       assert 'p' in args.undersampling_rate, 'Invalid undersampling rate for poisson'
     elif 'epi' in args.mask_type:
       assert 'p' not in args.undersampling_rate, 'Invalid undersampling rate for epi'
     if args.forward_type == 'denoising':
       assert args.denoising_sigma is not None
+    for loss in args.loss_list:
+      assert loss in losses.available_losses(), 'Unknown loss {}'.format(loss)
+    if args.distribution == 'adaptive':
+      assert args.method != 'dhs', 'Adaptive sampling weights are not defined for DHS top-K losses'
+      assert 0 < args.adaptive_floor <= 1, 'Adaptive floor must be in (0, 1]'
+    if args.noise_type == 'rician':
+      assert args.forward_type != 'csmri', 'Rician noise applies to magnitude images, not k-space'
+      assert len(args.rician_snr) in [1, 2]
+    if args.num_coils > 1:
+      assert args.forward_type == 'csmri', 'Multi-coil is only supported for csmri'
 
-  def parse(self):
-    args = self.parse_args()
+  def parse(self, argv=None):
+    args = self.parse_args(argv)
     self.validate_args(args)
     if args.date is None:
       date = '{}'.format(time.strftime('%b_%d'))
@@ -1,11 +1,25 @@
 import numpy as np
 import torch
+from . import shared
 
 class Arr:
-  def __init__(self, batch_size, train_path, test_path):
+  def __init__(self, batch_size, train_path, test_path, num_replicas=1, rank=0):
+    '''
+    Args:
+      batch_size: Per-process batch size
+      train_path: Path to train array [N, 1, l, w]
+      test_path: Path to test array [N, 1, l, w]
+      num_replicas: Number of data-parallel processes to shard the trainset across
+      rank: Rank of this process
+    '''
     self.batch_size = batch_size
-    train_gt = np.load(train_path)
-    test_gt = np.load(test_path)
+    self.num_replicas = num_replicas
+    self.rank = rank
+    train_gt = shared.load(train_path)
+    test_gt = shared.load(test_path)
+    self.set_data(train_gt, test_gt)
+
+  def set_data(self, train_gt, test_gt):
     assert len(train_gt.shape) == 4 and len(test_gt.shape) == 4, \
       'Invalid dataset shape'
     assert train_gt.shape[1] == 1 and test_gt.shape[1] == 1, \
@@ -14,9 +28,15 @@ class Arr:
     self.valset = ArrDataset(test_gt)
 
   def load(self):
+    if self.num_replicas > 1:
+      train_sampler = torch.utils.data.distributed.DistributedSampler(
+            self.trainset, num_replicas=self.num_replicas, rank=self.rank, shuffle=True)
+    else:
+      train_sampler = None
     train_loader = torch.utils.data.DataLoader(self.trainset, 
           batch_size=self.batch_size,
-          shuffle=True,
+          shuffle=(train_sampler is None),
+          sampler=train_sampler,
           num_workers=0,
           pin_memory=True,
           drop_last=True)
@@ -36,4 +56,4 @@ class ArrDataset(torch.utils.data.Dataset):
 
   def __getitem__(self, index):
     # Load data and get label
-    return self.x[index]
\ No newline at end of file
+    return (self.x[index],)
\ No newline at end of file
@@ -1,15 +1,41 @@
+import os
 import numpy as np
 import torch
 import torch.nn as nn
+from . import shared
+from . import phantom
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+def poisson_mask_path(image_dims, undersampling_rate, mask_dir=DATA_DIR):
+  '''Path of shipped Poisson-disk mask, e.g. data/poisson_disk_4p2_256_256.npy.'''
+  return os.path.join(mask_dir, 'poisson_disk_{}_{}_{}.npy'.format(
+    undersampling_rate, image_dims[0], image_dims[1]))
 
 class BaseMask(nn.Module):
   def __init__(self, mask_path):
     super(BaseMask, self).__init__()
     print('Loading mask:', mask_path)
-    mask = np.load(mask_path)
+    self.set_mask(shared.load(mask_path))
+
+  def set_mask(self, mask):
+    '''Set mask (l, w) with k-space center in the middle of the array.'''
     mask = np.fft.fftshift(mask)
     self.mask = torch.tensor(mask, requires_grad=False).float()
 
   def forward(self, num_samples):
     mask_stack = self.mask[None, None].repeat(num_samples, 1, 1, 1)
-    return mask_stack
\ No newline at end of file
+    return mask_stack
+
+class VDSRandom(BaseMask):
+  '''Generated variable-density random mask, for any image size.'''
+  def __init__(self, image_dims, undersampling_rate, seed=0):
+    nn.Module.__init__(self)
+    self.set_mask(phantom.variable_density_mask(
+      image_dims, phantom.parse_rate(undersampling_rate), seed=seed))
+
+class VDSPoisson(BaseMask):
+  '''Variable-density Poisson-disk mask.'''
+  def __init__(self, image_dims, undersampling_rate, mask_dir=DATA_DIR):
+    super(VDSPoisson, self).__init__(
+      poisson_mask_path(image_dims, undersampling_rate, mask_dir))
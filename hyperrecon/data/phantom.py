@@ -0,0 +1,149 @@
+"""
+Synthetic phantom datasets and undersampling masks.
+
+Generates Shepp-Logan-like phantoms with randomly perturbed ellipses and smooth
+texture, and variable-density random undersampling masks, at any image size.
+Needs no data files, so it can be used for benchmarks and tests.
+"""
+import numpy as np
+from .arr import Arr
+
+# Modified Shepp-Logan: (intensity, semi-axis a, semi-axis b, x0, y0, angle in degrees)
+SHEPP_LOGAN = [
+  (1.0, .6900, .9200, 0., 0., 0.),
+  (-.80, .6624, .8740, 0., -.0184, 0.),
+  (-.20, .1100, .3100, .22, 0., -18.),
+  (-.20, .1600, .4100, -.22, 0., 18.),
+  (.10, .2100, .2500, 0., .35, 0.),
+  (.10, .0460, .0460, 0., .1, 0.),
+  (.10, .0460, .0460, 0., -.1, 0.),
+  (.10, .0460, .0230, -.08, -.605, 0.),
+  (.10, .0230, .0230, 0., -.606, 0.),
+  (.10, .0230, .0460, .06, -.605, 0.),
+]
+
+def _grid(image_dims):
+  y, x = np.meshgrid(np.linspace(-1, 1, image_dims[0]),
+                     np.linspace(-1, 1, image_dims[1]), indexing='ij')
+  return x, y
+
+def _ellipses(image_dims, ellipses):
+  x, y = _grid(image_dims)
+  img = np.zeros(image_dims, dtype=np.float32)
+  for val, a, b, x0, y0, phi in ellipses:
+    phi = np.deg2rad(phi)
+    xr = (x - x0) * np.cos(phi) + (y - y0) * np.sin(phi)
+    yr = -(x - x0) * np.sin(phi) + (y - y0) * np.cos(phi)
+    img[(xr / a) ** 2 + (yr / b) ** 2 <= 1] += val
+  return img
+
+def shepp_logan(image_dims):
+  '''Modified Shepp-Logan phantom (l, w) in [0, 1].'''
+  return np.clip(_ellipses(image_dims, SHEPP_LOGAN), 0, 1)
+
+def smooth_noise(image_dims, rng, cutoff=0.1):
+  '''Gaussian noise low-pass filtered in k-space, scaled to [-1, 1].'''
+  noise = rng.randn(*image_dims)
+  fy = np.fft.fftfreq(image_dims[0])[:, None]
+  fx = np.fft.fftfreq(image_dims[1])[None, :]
+  lowpass = np.exp(-(fx ** 2 + fy ** 2) / (2 * cutoff ** 2))
+  tex = np.real(np.fft.ifft2(np.fft.fft2(noise) * lowpass))
+  return tex / (np.abs(tex).max() + 1e-8)
+
+def random_phantom(image_dims, rng, texture=0.1):
+  '''Shepp-Logan phantom with randomly perturbed ellipses and texture.
+
+  Args:
+    image_dims: (l, w)
+    rng: np.random.RandomState
+    texture: Amplitude of smooth texture inside the phantom
+  '''
+  ellipses = []
+  for i, (val, a, b, x0, y0, phi) in enumerate(SHEPP_LOGAN):
+    if i > 1:
+      # Keep the outer skull intact, perturb inner structures
+      val = val * rng.uniform(0.5, 2.0)
+      a, b = a * rng.uniform(0.7, 1.3), b * rng.uniform(0.7, 1.3)
+      x0, y0 = x0 + rng.uniform(-.05, .05), y0 + rng.uniform(-.05, .05)
+      phi = phi + rng.uniform(-20, 20)
+    ellipses.append((val, a, b, x0, y0, phi))
+  img = _ellipses(image_dims, ellipses)
+  support = img > 0
+  img = img + texture * smooth_noise(image_dims, rng) * support
+  img = np.clip(img, 0, None)
+  return img / max(img.max(), 1e-8)
+
+def phantom_dataset(num_imgs, image_dims, seed=0, texture=0.1):
+  '''Dataset of random phantoms of shape [num_imgs, 1, l, w], float32.'''
+  rng = np.random.RandomState(seed)
+  data = np.zeros((num_imgs, 1) + tuple(image_dims), dtype=np.float32)
+  for i in range(num_imgs):
+    data[i, 0] = random_phantom(image_dims, rng, texture)
+  return data
+
+def parse_rate(undersampling_rate):
+  '''Acceleration factor from rate string, e.g. '4p2' -> 4.2, '8' -> 8.0.'''
+  return float(str(undersampling_rate).replace('p', '.'))
+
+def variable_density_mask(image_dims, acceleration, center_frac=0.04, power=2, seed=0):
+  '''Variable-density random undersampling mask with fully-sampled center.
+
+  Sampling probability decays as (1 - r)^power with normalized distance r
+  from the k-space center, scaled so that 1/acceleration of points are
+  sampled in expectation. The k-space center is in the middle of the
+  array, matching the masks in data/.
+
+  Args:
+    image_dims: (l, w)
+    acceleration: Undersampling factor
+    center_frac: Radius of the fully-sampled center, as fraction of the center-to-corner distance
+    power: Decay of sampling density
+    seed: Seed
+  '''
+  x, y = _grid(image_dims)
+  r = np.sqrt(x ** 2 + y ** 2) / np.sqrt(2)
+  density = (1 - r) ** power
+  center = r <= center_frac
+  target = np.prod(image_dims) / acceleration
+
+  # Bisect scale of density so that the expected number of samples matches
+  lo, hi = 0., 1e6
+  for _ in range(50):
+    mid = (lo + hi) / 2
+    prob = np.where(center, 1., np.clip(mid * density, 0, 1))
+    if prob.sum() > target:
+      hi = mid
+    else:
+      lo = mid
+  rng = np.random.RandomState(seed)
+  return (rng.rand(*image_dims) < prob).astype(np.float32)
+
+def sensitivity_maps(num_coils, image_dims, width=0.8, seed=0):
+  '''Synthetic coil sensitivity maps (num_coils, 2, l, w).
+
+  Coils are evenly spaced on a circle around the image, each with a Gaussian
+  magnitude profile and a random linear phase. Maps are normalized so that
+  the sum of squared magnitudes over coils is 1 everywhere.
+  '''
+  x, y = _grid(image_dims)
+  rng = np.random.RandomState(seed)
+  maps = np.zeros((num_coils,) + tuple(image_dims), dtype=np.complex64)
+  for c in range(num_coils):
+    angle = 2 * np.pi * c / num_coils
+    dist2 = (x - 1.5 * np.cos(angle)) ** 2 + (y - 1.5 * np.sin(angle)) ** 2
+    phase = rng.uniform(-np.pi, np.pi) + rng.uniform(-1, 1) * x + rng.uniform(-1, 1) * y
+    maps[c] = np.exp(-dist2 / (2 * width ** 2)) * np.exp(1j * phase)
+  maps /= np.sqrt(np.sum(np.abs(maps) ** 2, axis=0, keepdims=True))
+  return np.stack((maps.real, maps.imag), axis=1).astype(np.float32)
+
+
+class Phantom(Arr):
+  '''Drop-in replacement of Arr with generated phantoms.'''
+  def __init__(self, batch_size, image_dims, num_train, num_test, seed=0,
+               num_replicas=1, rank=0):
+    self.batch_size = batch_size
+    self.num_replicas = num_replicas
+    self.rank = rank
+    train_gt = phantom_dataset(num_train, image_dims, seed=seed)
+    test_gt = phantom_dataset(num_test, image_dims, seed=seed + 1)
+    self.set_data(train_gt, test_gt)
@@ -0,0 +1,34 @@
+"""
+Process-local registry of read-only arrays backed by shared memory.
+
+Loaders call `load(path)` instead of `np.load(path)`. If a parent process has
+placed the array in shared memory and registered it under the same path, a
+zero-copy view is returned; otherwise the file is read from disk.
+"""
+import os
+import numpy as np
+import torch
+
+_REGISTRY = {}
+
+def _key(path):
+  return os.path.abspath(path)
+
+def to_shared(path):
+  '''Load array at path into a shared-memory tensor.'''
+  return torch.from_numpy(np.load(path)).share_memory_()
+
+def register(path, tensor):
+  '''Register shared tensor as the contents of path in this process.'''
+  _REGISTRY[_key(path)] = tensor
+
+def register_all(shared):
+  '''Register a dict of {path: shared tensor}.'''
+  for path, tensor in shared.items():
+    register(path, tensor)
+
+def load(path):
+  '''Return registered array for path as a numpy view, else np.load(path).'''
+  if _key(path) in _REGISTRY:
+    return _REGISTRY[_key(path)].numpy()
+  return np.load(path)
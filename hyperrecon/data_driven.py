@@ -1,12 +1,29 @@
+import time
 import torch
 
 from hyperrecon.util.train import BaseTrain
+from hyperrecon.util import distributed
+from hyperrecon.loss import loss_ops
+
+# Steps per epoch excluded from the top-K speedup, so that top-K and full-batch
+# steps are both timed with a warm allocator and after cuDNN autotuning
+SPEEDUP_WARMUP = 3
 
 class DataDriven(BaseTrain):
   """DataDriven."""
 
   def __init__(self, args):
+    # Set before BaseTrain.__init__, which calls set_monitor
+    self.topk_backward = args.topk_backward
     super(DataDriven, self).__init__(args=args)
+    self.epoch_steps = 0
+    self.step_times = []
+    self.full_step_time = None
+
+  def set_monitor(self):
+    super(DataDriven, self).set_monitor()
+    if self.topk_backward:
+      self.list_of_monitor.append('dhs:speedup')
 
   def process_loss(self, loss, loss_dict):
     dc_losses = loss_dict['dc']
@@ -14,4 +31,96 @@ class DataDriven(BaseTrain):
     sort_losses = loss[perm] # Reorder total losses by lowest to highest DC loss
     loss = torch.mean(sort_losses[:self.topK]) # Take only the losses with lowest DC
 
-    return loss
\ No newline at end of file
+    return loss
+
+  def train_epoch(self):
+    self.epoch_steps = 0
+    self.step_times = []
+    self.full_step_time = None
+    super(DataDriven, self).train_epoch()
+    if self.topk_backward and len(self.step_times) > 0:
+      speedup = self.full_step_time / (sum(self.step_times) / len(self.step_times))
+      self.monitor['dhs:speedup'].append(speedup)
+      print('top-K backward speedup={:.2f}x'.format(speedup))
+
+  def train_step(self, batch):
+    '''Train for one step.
+
+    With topk_backward, samples are ranked by DC loss with a no-grad forward
+    pass, and forward/backward is recomputed only on the topK lowest. This
+    gives the same loss as process_loss, except that batchnorm statistics in
+    the recomputed pass come from the topK samples only.
+    '''
+    if not self.topk_backward:
+      return super(DataDriven, self).train_step(batch)
+
+    inputs, targets, batch_size = self.prepare_batch(batch)
+    hparams = self.sample_hparams(batch_size)
+    coeffs = self.generate_coefficients(hparams)
+    # Reference time is re-measured every epoch, after warmup
+    warm = self.epoch_steps >= SPEEDUP_WARMUP
+    self.epoch_steps += 1
+    if warm and self.full_step_time is None:
+      # The first full-batch pass allocates buffers of full-batch size
+      self.full_step_time = min(self.time_full_step(inputs, targets, coeffs) for _ in range(2))
+
+    self.sync()
+    start_time = time.perf_counter()
+    with self.timer('dhs:rank'):
+      idx, pred_all = self.rank_samples(inputs, targets, coeffs)
+
+    self.optimizer.zero_grad()
+    with torch.set_grad_enabled(True):
+      with self.collect_weights() as collector:
+        pred = self.inference(inputs[idx], coeffs[idx])
+      loss, _ = self.compute_loss(targets[idx], pred, coeffs[idx], scales=self.per_loss_scale_constants,
+                                  weights=collector.weights)
+      loss = loss.mean()
+      with self.timer('backward'):
+        loss.backward()
+        # Compare against the same work as the full-batch reference
+        self.sync()
+        if warm:
+          self.step_times.append(time.perf_counter() - start_time)
+        distributed.all_reduce_gradients(self.network)
+      with self.timer('optimizer'):
+        self.optimizer.step()
+
+    psnr = loss_ops.PSNR()(targets, pred_all).mean().item()
+    return loss.cpu().detach().numpy(), psnr, batch_size
+
+  def rank_samples(self, inputs, targets, coeffs):
+    '''Indices of the topK samples with lowest DC loss, and all predictions.'''
+    dc_loss = self.losses[self.loss_list.index('dc')]
+    # Running batchnorm statistics should only be updated by the training pass
+    buffers = [b.clone() for b in self.network.buffers()]
+    with torch.no_grad():
+      pred = self.inference(inputs, coeffs)
+      dc = dc_loss(targets, pred, network=self.network)
+    for b, saved in zip(self.network.buffers(), buffers):
+      b.copy_(saved)
+    _, perm = torch.sort(dc)
+    return perm[:self.topK], pred
+
+  def time_full_step(self, inputs, targets, coeffs):
+    '''Time of a full-batch forward/backward, as reference for the speedup.'''
+    buffers = [b.clone() for b in self.network.buffers()]
+    self.optimizer.zero_grad()
+    self.sync()
+    start_time = time.perf_counter()
+    with torch.set_grad_enabled(True):
+      with self.collect_weights() as collector:
+        pred = self.inference(inputs, coeffs)
+      loss, loss_dict = self.compute_loss(targets, pred, coeffs, scales=self.per_loss_scale_constants,
+                                          weights=collector.weights)
+      self.process_loss(loss, loss_dict).backward()
+    self.sync()
+    full_step_time = time.perf_counter() - start_time
+    self.optimizer.zero_grad()
+    for b, saved in zip(self.network.buffers(), buffers):
+      b.copy_(saved)
+    return full_step_time
+
+  def sync(self):
+    if self.device.type == 'cuda':
+      torch.cuda.synchronize()
@@ -0,0 +1,333 @@
+"""Batched reconstruction from a trained run, without the training machinery.
+
+Builds only the network, mask and forward model from the `args.txt` of a run
+directory and a checkpoint, then streams arrays of inputs through in batches
+for one or more hyperparameter vectors.
+"""
+import os
+import glob
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from hyperrecon.util import utils
+from hyperrecon.util import checkpoint
+from hyperrecon.util.forward import num_input_channels, CSMRIForward, MultiCoilCSMRIForward, DenoisingForward, SuperresolutionForward
+from hyperrecon.model.unet import Unet, HyperUnet
+from hyperrecon.model import quantize as quantization
+from hyperrecon.data.mask import VDSPoisson, VDSRandom
+from hyperrecon.data.phantom import sensitivity_maps
+
+
+def find_checkpoint(run_dir, which='latest'):
+  '''Path of checkpoint in run_dir.
+
+  Args:
+    run_dir: Run directory
+    which: One of [latest, best], or an epoch number
+  '''
+  ckpt_dir = os.path.join(run_dir, 'checkpoints')
+  ckpts = dict(checkpoint.list_checkpoints(ckpt_dir))
+  if len(ckpts) == 0:
+    raise FileNotFoundError('No checkpoints in {}'.format(ckpt_dir))
+  if which == 'latest':
+    return ckpts[max(ckpts)]
+  elif which == 'best':
+    best = checkpoint.read_best(ckpt_dir)
+    if best is None or best['epoch'] not in ckpts:
+      raise FileNotFoundError('No best checkpoint recorded in {}'.format(ckpt_dir))
+    return ckpts[best['epoch']]
+  return ckpts[int(which)]
+
+
+class Reconstructor(object):
+  '''Reconstructs images with a trained model.
+
+  Args:
+    run_dir: Run directory containing args.txt and checkpoints/
+    ckpt: One of [latest, best], an epoch number, or a path to a checkpoint
+    device: Torch device
+    quantize: Whether to quantize the network to INT8, CPU only
+  '''
+  def __init__(self, run_dir, ckpt='latest', device=torch.device('cpu'), quantize=False):
+    self.config = utils.get_args(run_dir)
+    self.device = device
+    c = self.config
+    self.loss_list = c['loss_list']
+    self.range_restrict = c['range_restrict']
+    self.num_hparams = len(self.loss_list) - 1 if self.range_restrict else len(self.loss_list)
+    self.forward_type = c['forward_type']
+    self.image_dims = c['image_dims']
+    self.n_ch_in = num_input_channels(self.forward_type)
+
+    self.network = self.get_model()
+    ckpt_path = ckpt if os.path.isfile(str(ckpt)) else find_checkpoint(run_dir, ckpt)
+    self.ckpt_path = os.path.abspath(ckpt_path)
+    self.quantized = quantize
+    utils.load_checkpoint(self.network, ckpt_path)
+    self.network.to(device).eval()
+    if quantize:
+      if device.type != 'cpu':
+        raise ValueError('INT8 quantization is only supported on CPU')
+      self.network = quantization.quantize(self.network)
+    self.mask_model = self.get_mask()
+    self._masks = {}
+    self.forward_model = self.get_forward_model()
+
+  def get_model(self):
+    c = self.config
+    if c['arch'] == 'unet':
+      return Unet(in_ch=self.n_ch_in, out_ch=c['n_ch_out'], h_ch=c['unet_hdim'],
+                  residual=c['unet_residual'], use_batchnorm=c['use_batchnorm'])
+    return HyperUnet(len(self.loss_list), c['hnet_hdim'], in_ch_main=self.n_ch_in,
+                     out_ch_main=c['n_ch_out'], h_ch_main=c['unet_hdim'],
+                     residual=c['unet_residual'], use_batchnorm=c['use_batchnorm'],
+                     store_weights=False)
+
+  def get_mask(self, image_dims=None):
+    '''Mask of the run, or a variable-density random mask of the same rate
+    for images of other sizes, for which no Poisson-disk mask is shipped.
+    '''
+    if self.forward_type != 'csmri':
+      return None
+    image_dims = list(image_dims or self.image_dims)
+    if self.config.get('mask_type') == 'vds' or image_dims != list(self.image_dims):
+      return VDSRandom(image_dims, self.config['undersampling_rate'], seed=self.config['seed'])
+    return VDSPoisson(image_dims, self.config['undersampling_rate'])
+
+  def get_forward_model(self):
+    c = self.config
+    if self.forward_type == 'csmri' and c.get('num_coils', 1) > 1:
+      if c.get('sens_maps') is not None:
+        sens_maps = np.load(c['sens_maps'])
+      else:
+        sens_maps = sensitivity_maps(c['num_coils'], self.image_dims, seed=c['seed'])
+      return MultiCoilCSMRIForward(sens_maps, c.get('coil_chunk'))
+    elif self.forward_type == 'csmri':
+      return CSMRIForward()
+    elif self.forward_type == 'superresolution':
+      return SuperresolutionForward(self.config['undersampling_rate'])
+    return DenoisingForward()
+
+  def check_input(self, shape, num_hparams, is_measurement=False):
+    '''Raise ValueError if a single input of shape (without batch dimension)
+    with num_hparams hyperparameters cannot be reconstructed.'''
+    if num_hparams != self.num_hparams:
+      raise ValueError('Expected {} hyperparameters, got {}'.format(self.num_hparams, num_hparams))
+    num_coils = self.config.get('num_coils', 1)
+    if not is_measurement or self.forward_type != 'csmri':
+      expected = (1,)
+    elif num_coils > 1:
+      expected = (num_coils, 2)
+    else:
+      expected = (2,)
+    if len(shape) != len(expected) + 2 or tuple(shape[:-2]) != expected:
+      raise ValueError('Expected input of shape {} + (l, w), got {}'.format(expected, tuple(shape)))
+    l, w = shape[-2:]
+    if l % 8 != 0 or w % 8 != 0:
+      raise ValueError('Image sides must be multiples of 8, got {}x{}'.format(l, w))
+    if self.forward_type == 'superresolution' and (l % self.forward_model.scale or w % self.forward_model.scale):
+      raise ValueError('Image sides must be multiples of the superresolution factor {}'.format(
+                       self.forward_model.scale))
+    if num_coils > 1 and [l, w] != list(self.image_dims):
+      raise ValueError('Multi-coil runs only reconstruct images of size {}'.format(self.image_dims))
+
+  def measure(self, x, is_measurement=False):
+    '''Measurements of ground-truth images, and their CS-MRI mask.
+
+    Args:
+      x: Images (bs, 1, l, w), or measurements as produced by the forward model
+      is_measurement: Whether x is already undersampled, in which case the
+        CS-MRI mask is where k-space is non-zero
+
+    Returns:
+      Measurements, and mask (bs, 1, l, w) or None for other forward types
+    '''
+    x = x.float().to(self.device)
+    if is_measurement:
+      mask = None
+      if self.forward_type == 'csmri':
+        mask = (x != 0).flatten(1, -3).any(dim=1, keepdim=True).float()
+      return x, mask
+    mask_model = self.mask_for(x.shape[-2:])
+    mask = mask_model(len(x)).to(self.device) if mask_model is not None else None
+    return self.forward_model(x, mask), mask
+
+  def network_input(self, y):
+    '''Zero-filled image of CS-MRI measurements, other measurements as they are.'''
+    if self.forward_type == 'csmri':
+      return self.forward_model.adjoint(y)
+    return y
+
+  def prepare_inputs(self, x, is_measurement=False):
+    '''Network inputs from ground-truth images, or from measurements.
+
+    Args:
+      x: Images (bs, 1, l, w), or measurements as produced by the forward model
+      is_measurement: Whether x is already undersampled
+    '''
+    return self.network_input(self.measure(x, is_measurement)[0])
+
+  def data_consistency(self, out, y, mask):
+    '''Restore measurements y in reconstructions out.
+
+    For CS-MRI, measured k-space replaces predicted k-space. For
+    superresolution, out is moved towards A out = y with gradient steps
+    using the adjoint of the forward model. Other outputs are unchanged.
+    '''
+    if self.forward_type == 'csmri':
+      # Keep predicted k-space only where nothing was measured
+      dc = self.forward_model.adjoint(self.forward_model(out, 1 - mask) + y)
+      return dc.norm(p=2, dim=1, keepdim=True) if self.config['n_ch_out'] == 1 else dc
+    elif self.forward_type == 'superresolution':
+      return self.forward_model.data_consistency(out, y)
+    return out
+
+  def coefficients(self, hparams, batch_size=None):
+    '''Coefficients for a single hyperparameter vector repeated batch_size
+    times, or for per-sample hyperparameters (bs, num_hparams) if batch_size
+    is None.
+    '''
+    hparams = torch.as_tensor(hparams, dtype=torch.float32).view(-1, self.num_hparams)
+    if batch_size is not None:
+      hparams = hparams.repeat(batch_size, 1)
+    coeffs = utils.generate_coefficients(hparams, len(self.loss_list), self.range_restrict)
+    return coeffs.to(self.device)
+
+  @torch.no_grad()
+  def reconstruct(self, x, hparams, is_measurement=False, data_consistency=False):
+    '''Reconstruct a batch for a single hyperparameter vector.'''
+    y, mask = self.measure(x, is_measurement)
+    out = self.network(self.network_input(y), self.coefficients(hparams, len(y)))
+    return self.data_consistency(out, y, mask) if data_consistency else out
+
+  @torch.no_grad()
+  def reconstruct_per_sample(self, x, hparams, is_measurement=False, data_consistency=False):
+    '''Reconstruct a batch with a different hyperparameter vector per sample.
+
+    Args:
+      x: Inputs (bs, n_ch, l, w)
+      hparams: Hyperparameters (bs, num_hparams)
+    '''
+    y, mask = self.measure(x, is_measurement)
+    out = self.network(self.network_input(y), self.coefficients(hparams))
+    return self.data_consistency(out, y, mask) if data_consistency else out
+
+  @torch.no_grad()
+  def reconstruct_tiled(self, x, hparams, tile_size=256, overlap=32, tile_batch=8,
+                        is_measurement=False, data_consistency=True):
+    '''Reconstruct images of any size from overlapping tiles.
+
+    The zero-filled input is computed from the full k-space, split into
+    tiles of tile_size with the given overlap, and tiles are run through the
+    network tile_batch at a time, so peak memory depends only on the tile
+    size. Tile outputs are blended with linear ramps over the overlap. For
+    CS-MRI and superresolution, measurements are then restored in the
+    stitched output, see data_consistency.
+
+    Args:
+      x: Images (bs, 1, l, w), or k-space measurements (bs, 2, l, w), or
+        (bs, num_coils, 2, l, w) for multi-coil runs
+      hparams: Single hyperparameter vector
+      tile_size: Tile side, a multiple of 8
+      overlap: Overlap of neighbouring tiles
+      tile_batch: Number of tiles per forward pass
+    '''
+    assert tile_size % 8 == 0, 'tile_size must be a multiple of 8'
+    assert 0 <= overlap < tile_size
+    y, mask = self.measure(x, is_measurement)
+    zf = self.network_input(y)
+
+    h, w = zf.shape[-2:]
+    pad_h, pad_w = max(tile_size, h) - h, max(tile_size, w) - w
+    zf_pad = F.pad(zf, (0, pad_w, 0, pad_h), mode='replicate')
+    window = tile_window(tile_size, overlap).to(self.device)
+    n_ch_out = self.config['n_ch_out']
+    out = torch.zeros(len(zf), n_ch_out, h + pad_h, w + pad_w, device=self.device)
+    weight = torch.zeros(1, 1, h + pad_h, w + pad_w, device=self.device)
+
+    tiles = [(b, i, j) for b in range(len(zf))
+             for i in tile_starts(h + pad_h, tile_size, overlap)
+             for j in tile_starts(w + pad_w, tile_size, overlap)]
+    for k in range(0, len(tiles), tile_batch):
+      chunk = tiles[k:k+tile_batch]
+      inp = torch.stack([zf_pad[b, :, i:i+tile_size, j:j+tile_size] for b, i, j in chunk])
+      pred = self.network(inp, self.coefficients(hparams, len(inp)))
+      for (b, i, j), p in zip(chunk, pred):
+        out[b, :, i:i+tile_size, j:j+tile_size] += p * window
+        if b == 0:
+          weight[0, :, i:i+tile_size, j:j+tile_size] += window
+    out = (out / weight)[..., :h, :w]
+    if data_consistency:
+      out = self.data_consistency(out, y, mask)
+    return out
+
+  def mask_for(self, image_dims):
+    if list(image_dims) == list(self.image_dims):
+      return self.mask_model
+    if tuple(image_dims) not in self._masks:
+      self._masks[tuple(image_dims)] = self.get_mask(image_dims)
+    return self._masks[tuple(image_dims)]
+
+  def iter_reconstruct(self, arr, list_of_hparams, batch_size=32, is_measurement=False,
+                       tile_size=None, tile_overlap=32):
+    '''Reconstruct arr in batches, tiled if tile_size is given.
+
+    Yields:
+      Start index of the batch, and list of reconstructions (bs, n_ch_out, l, w),
+      one per hyperparameter vector
+    '''
+    for i in range(0, len(arr), batch_size):
+      x = torch.from_numpy(np.ascontiguousarray(arr[i:i+batch_size]))
+      if x.dim() == 3:
+        x = x[:, None]
+      if tile_size is not None:
+        yield i, [self.reconstruct_tiled(x, hp, tile_size, tile_overlap, is_measurement=is_measurement).cpu().numpy()
+                  for hp in list_of_hparams]
+      else:
+        yield i, [self.reconstruct(x, hp, is_measurement).cpu().numpy() for hp in list_of_hparams]
+
+
+def tile_starts(size, tile_size, overlap):
+  '''Start offsets of tiles covering [0, size), the last one flush with the end.'''
+  stride = tile_size - overlap
+  starts = list(range(0, size - tile_size, stride))
+  return starts + [size - tile_size]
+
+def tile_window(tile_size, overlap):
+  '''Blending weights of a tile (tile_size, tile_size), ramping up over the overlap.'''
+  ramp = torch.ones(tile_size)
+  if overlap > 0:
+    edge = torch.arange(1, overlap + 1).float() / (overlap + 1)
+    ramp[:overlap] = edge
+    ramp[-overlap:] = edge.flip(0)
+  return ramp[:, None] * ramp[None, :]
+
+
+def stringify(hparams):
+  return '_'.join(str(float(h)) for h in hparams)
+
+def reconstruct_dir(reconstructor, in_dir, out_dir, list_of_hparams, batch_size=32,
+                    is_measurement=False, tile_size=None, tile_overlap=32):
+  '''Reconstruct every .npy in in_dir and save one file per input and hparam.
+
+  Inputs and outputs are memory-mapped, so only one batch is held in memory
+  at a time. With tile_size, images are reconstructed tile by tile.
+  '''
+  if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+  n_ch_out = reconstructor.config['n_ch_out']
+  for path in sorted(glob.glob(os.path.join(in_dir, '*.npy'))):
+    arr = np.load(path, mmap_mode='r')
+    stem = os.path.splitext(os.path.basename(path))[0]
+    outs = [np.lib.format.open_memmap(
+              os.path.join(out_dir, '{}_hp{}.npy'.format(stem, stringify(hp))),
+              mode='w+', dtype=np.float32, shape=(len(arr), n_ch_out) + tuple(arr.shape[-2:]))
+            for hp in list_of_hparams]
+    for i, recons in reconstructor.iter_reconstruct(
+        arr, list_of_hparams, batch_size, is_measurement, tile_size, tile_overlap):
+      for out, recon in zip(outs, recons):
+        out[i:i+len(recon)] = recon
+    for out in outs:
+      out.flush()
+    print('Reconstructed', path)
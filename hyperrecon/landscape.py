@@ -0,0 +1,187 @@
+"""Dense hyperparameter landscapes of reconstruction quality.
+
+Evaluates reconstructions of a set of slices over a grid (or simplex) of
+hyperparameters, many hyperparameters per forward pass. The hyperparameter cube
+is then refined adaptively: cells whose corners differ most in the chosen
+metric are split first. Results are cached on disk and reused across calls
+with the same checkpoint, slices and forward model.
+"""
+import os
+import glob
+import json
+import hashlib
+import itertools
+import numpy as np
+import torch
+
+from hyperrecon.loss import loss_ops
+
+METRICS = ['psnr', 'ssim']
+
+
+def cube_grid(num_hparams, res):
+  '''All points of a regular grid with res points per dimension on [0, 1]^d.'''
+  axis = np.linspace(0, 1, res)
+  return np.array(list(itertools.product(axis, repeat=num_hparams)))
+
+def simplex_grid(num_hparams, res):
+  '''All points of a regular grid on the simplex {h >= 0, sum(h) = 1}.'''
+  points = []
+  for c in itertools.product(range(res), repeat=num_hparams):
+    if sum(c) == res - 1:
+      points.append(np.array(c) / (res - 1))
+  return np.array(points)
+
+def point_key(h):
+  return '_'.join('{:.6f}'.format(v) for v in h)
+
+def cache_header(reconstructor, gt):
+  '''Everything cached results depend on besides the hyperparameters.'''
+  c = reconstructor.config
+  gt = np.ascontiguousarray(gt.numpy())
+  return {
+    'ckpt': reconstructor.ckpt_path,
+    'ckpt_mtime': os.path.getmtime(reconstructor.ckpt_path),
+    'quantized': reconstructor.quantized,
+    'forward_type': c['forward_type'],
+    'mask_type': c.get('mask_type'),
+    'undersampling_rate': c.get('undersampling_rate'),
+    'seed': c.get('seed'),
+    'gt_shape': list(gt.shape),
+    'gt_sha1': hashlib.sha1(gt.tobytes()).hexdigest(),
+    'metrics': METRICS,
+  }
+
+
+class Landscape(object):
+  '''Cached evaluation of metrics over hyperparameters.
+
+  Args:
+    reconstructor: hyperrecon.inference.Reconstructor
+    gt: Ground-truth slices (N, 1, l, w)
+    cache_dir: Directory to cache results
+    batch_size: Maximum number of (slice, hparam) pairs per forward pass
+    save_recons: Whether to cache reconstructions of every point
+  '''
+  def __init__(self, reconstructor, gt, cache_dir, batch_size=32, save_recons=False):
+    self.reconstructor = reconstructor
+    self.gt = torch.as_tensor(gt).float()
+    self.cache_dir = cache_dir
+    self.batch_size = batch_size
+    self.save_recons = save_recons
+    self.psnr = loss_ops.PSNR()
+    self.ssim = loss_ops.SSIM()
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir)
+    self.cache_path = os.path.join(cache_dir, 'landscape.jsonl')
+    # Round trip through json, to compare with the header on disk
+    self.header = json.loads(json.dumps(cache_header(reconstructor, self.gt)))
+    self.results = self._load_cache()
+
+  def _load_cache(self):
+    '''Results cached for the same header. A cache with another header is discarded.'''
+    results = {}
+    if os.path.exists(self.cache_path):
+      with open(self.cache_path) as f:
+        lines = f.readlines()
+      try:
+        header = json.loads(lines[0])['header'] if len(lines) > 0 else None
+      except (ValueError, KeyError, TypeError):
+        header = None
+      if header == self.header:
+        for line in lines[1:]:
+          try:
+            r = json.loads(line)
+          except ValueError:
+            continue
+          results[r['key']] = r
+        return results
+      print('Discarding landscape cache in {}, computed for another checkpoint, '
+            'data or forward model'.format(self.cache_dir))
+      for path in glob.glob(os.path.join(self.cache_dir, 'recon_*.npy')):
+        os.remove(path)
+    with open(self.cache_path, 'w') as f:
+      f.write(json.dumps({'header': self.header}) + '\n')
+    return results
+
+  def evaluate(self, points):
+    '''Evaluate metrics at points (P, num_hparams) not already cached.'''
+    todo = [h for h in np.asarray(points, dtype=float) if point_key(h) not in self.results]
+    if len(todo) == 0:
+      return
+    n = len(self.gt)
+    # Chunk of hparams such that every forward pass has at most batch_size samples
+    hp_per_pass = max(1, self.batch_size // n)
+    with open(self.cache_path, 'a') as f:
+      for i in range(0, len(todo), hp_per_pass):
+        hps = np.stack(todo[i:i+hp_per_pass])
+        x = self.gt.repeat(len(hps), 1, 1, 1)
+        hparams = torch.as_tensor(hps, dtype=torch.float32).repeat_interleave(n, dim=0)
+        with torch.no_grad():
+          recon = self.reconstructor.reconstruct_per_sample(x, hparams).cpu()
+          psnr = self.psnr(x, recon).view(len(hps), n).mean(dim=1)
+          ssim = 1 - self.ssim(x, recon).view(len(hps), n).mean(dim=1)
+        for j, h in enumerate(hps):
+          r = {'key': point_key(h), 'hparams': h.tolist(),
+               'psnr': psnr[j].item(), 'ssim': ssim[j].item()}
+          self.results[r['key']] = r
+          f.write(json.dumps(r) + '\n')
+          if self.save_recons:
+            np.save(os.path.join(self.cache_dir, 'recon_{}.npy'.format(r['key'])),
+                    recon[j*n:(j+1)*n].numpy())
+        f.flush()
+
+  def dense(self, res, simplex=False):
+    '''Evaluate a regular grid on the cube, or on the simplex.'''
+    d = self.reconstructor.num_hparams
+    self.evaluate(simplex_grid(d, res) if simplex else cube_grid(d, res))
+
+  def value(self, h, metric):
+    return self.results[point_key(h)][metric]
+
+  def refine(self, res, num_steps, num_cells, metric='psnr'):
+    '''Evaluate a coarse grid, then repeatedly split the cells of largest change.
+
+    Cells are hypercubes of the grid. A cell's score is the range of the
+    metric over its corners. Each step splits the num_cells highest scoring
+    cells into 2^d children and evaluates their new corners.
+
+    Args:
+      res: Points per dimension of the initial grid
+      num_steps: Number of refinement steps
+      num_cells: Number of cells to split per step
+      metric: One of [psnr, ssim]
+    '''
+    assert res >= 2, 'Initial grid needs at least 2 points per dimension'
+    d = self.reconstructor.num_hparams
+    size = 1. / (res - 1)
+    cells = [(np.array(c) * size, size) for c in itertools.product(range(res - 1), repeat=d)]
+    self.evaluate(cube_grid(d, res))
+    offsets = np.array(list(itertools.product([0, 1], repeat=d)))
+
+    def score(cell):
+      lo, s = cell
+      # Without range_restrict the all-zero corner has undefined coefficients
+      vals = [self.value(lo + o * s, metric) for o in offsets]
+      return np.nan_to_num(np.nanmax(vals) - np.nanmin(vals))
+
+    for step in range(num_steps):
+      cells.sort(key=score, reverse=True)
+      split, cells = cells[:num_cells], cells[num_cells:]
+      children = [(lo + o * s / 2, s / 2) for lo, s in split for o in offsets]
+      self.evaluate(np.array([lo + o * s for lo, s in children for o in offsets]))
+      cells += children
+      print('Refinement step {}: {} points evaluated'.format(step, len(self.results)))
+
+  def to_arrays(self):
+    '''All cached points and metrics as arrays.'''
+    rs = list(self.results.values())
+    return {
+      'hparams': np.array([r['hparams'] for r in rs]),
+      'psnr': np.array([r['psnr'] for r in rs]),
+      'ssim': np.array([r['ssim'] for r in rs]),
+    }
+
+  def best(self, metric='psnr'):
+    r = max(self.results.values(), key=lambda r: np.nan_to_num(r[metric], nan=-np.inf))
+    return r['hparams'], r[metric]
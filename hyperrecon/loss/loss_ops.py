@@ -1,9 +1,4 @@
-import sys
-sys.path.append('/home/aw847/PerceptualSimilarity/src/')
-sys.path.append('/home/aw847/torch-radon/')
 import torch
-from pytorch_wavelets import DWTForward
-import pytorch_ssim
 from hyperrecon.util import utils
 
 class DataConsistency(object):
@@ -17,13 +12,14 @@ class DataConsistency(object):
   def __call__(self, gt, pred, **kwargs):
     del kwargs
     batch_size = len(pred)
-    mask = self.mask_module(batch_size).cuda()
+    mask = self.mask_module(batch_size).to(pred.device)
     measurement = self.forward_model(pred, mask)
     measurement_gt = self.forward_model(gt, mask)
+    # Reduce over all non-batch dims, which include coils for multi-coil data
     if self.reduction == 'sum':
-      dc = torch.sum(self.l2(measurement, measurement_gt), dim=(1, 2, 3)) 
+      dc = torch.sum(self.l2(measurement, measurement_gt).flatten(1), dim=1)
     else:
-      dc = torch.mean(self.l2(measurement, measurement_gt), dim=(1, 2, 3)) * 2
+      dc = torch.mean(self.l2(measurement, measurement_gt).flatten(1), dim=1) * 2
     return dc
 
 class TotalVariation(object):
@@ -52,6 +48,9 @@ class TotalVariation(object):
 
 class L1Wavelets(object):
   def __init__(self, device):
+    # Optional dependency, imported only when the loss is used
+    from pytorch_wavelets import DWTForward
+    self.device = device
     self.xfm = DWTForward(J=3, mode='zero', wave='db4').to(device)
     self.l1 = torch.nn.L1Loss(reduction='none')
 
@@ -103,6 +102,7 @@ class L1Wavelets(object):
 
 class SSIM(object):
   def __init__(self):
+    import pytorch_ssim
     self.ssim_loss = pytorch_ssim.SSIM(size_average=False)
 
   def __call__(self, gt, pred, **kwargs):
@@ -147,12 +147,23 @@ class rPSNR(object):
     return self.psnr(gt, pred) - self.psnr(gt, zf)
 
 class L1PenaltyWeights(object):
+  '''L1 norm of conv weights per sample.
+
+  Reads weights collected by layers.WeightCollector from kwargs['weights'],
+  falling back to network.get_conv_weights() when none were collected.
+  '''
   def __call__(self, gt, pred, **kwargs):
     del gt
-    network = kwargs['network']
-    weights = network.get_conv_weights()
-
-    cap_reg = torch.zeros(len(pred), requires_grad=True).cuda()
+    weights = kwargs.get('weights')
+    if not weights:
+      network = kwargs['network']
+      if not getattr(network, 'store_weights', True):
+        raise ValueError('l1pen needs generated weights, but the network was built with '
+                         'store_weights=False and no weights were passed. Run the forward pass '
+                         'inside a layers.WeightCollector and pass its weights as weights=')
+      weights = network.get_conv_weights()
+
+    cap_reg = torch.zeros(len(pred), device=pred.device)
     for w in weights:
       w_flat = w.view(len(w), -1)
       if len(w_flat) != len(pred):
@@ -1,22 +1,49 @@
-from . import loss_ops
 import functools
+import importlib
 
-REGISTERED_SUP_LOSSES = [
-                          'ssim',
-                          'watson-dft',
-                          'l1',
-                          'mse',
-                          'dice',
-                          'lpips',
-                        ]
-REGISTERED_UNSUP_LOSSES = [
-                              'dc',
-                              'mindc',
-                              'tv',
-                              'wave',
-                              'shear',
-                              'l1pen'
-                            ]
+# Loss name -> (implementation, constructor arguments). Implementations are
+# imported on first use, so optional dependencies of unused losses, such as
+# pytorch_wavelets for 'wave', are never imported.
+REGISTERED_SUP_LOSSES = {
+  'ssim': ('hyperrecon.loss.loss_ops:SSIM', ()),
+  'l1': ('hyperrecon.loss.loss_ops:L1', ()),
+  'mse': ('hyperrecon.loss.loss_ops:MSE', ()),
+}
+REGISTERED_UNSUP_LOSSES = {
+  'dc': ('hyperrecon.loss.loss_ops:DataConsistency', ('forward_model', 'mask')),
+  'tv': ('hyperrecon.loss.loss_ops:TotalVariation', ()),
+  'wave': ('hyperrecon.loss.loss_ops:L1Wavelets', ('device',)),
+  'l1pen': ('hyperrecon.loss.loss_ops:L1PenaltyWeights', ()),
+}
+
+# Third-party packages register losses under this entry point group. An entry
+# point loads a factory called with keyword arguments forward_model, mask and
+# device, which returns a callable loss(gt, pred, **kwargs) of shape (bs,).
+ENTRY_POINT_GROUP = 'hyperrecon.losses'
+
+
+@functools.lru_cache(maxsize=None)
+def _import(path):
+  module, name = path.split(':')
+  return getattr(importlib.import_module(module), name)
+
+@functools.lru_cache(maxsize=None)
+def plugin_losses():
+  '''Entry points of third-party losses, by name. Does not import them.'''
+  try:
+    from importlib.metadata import entry_points
+  except ImportError:
+    import pkg_resources
+    return {ep.name: ep for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)}
+  eps = entry_points()
+  if hasattr(eps, 'select'):
+    group = eps.select(group=ENTRY_POINT_GROUP)
+  else:
+    group = eps.get(ENTRY_POINT_GROUP, [])
+  return {ep.name: ep for ep in group}
+
+def available_losses():
+  return sorted(set(REGISTERED_SUP_LOSSES) | set(REGISTERED_UNSUP_LOSSES) | set(plugin_losses()))
 
 
 def compose_loss_seq(loss_list, forward_model, mask, device):
@@ -34,23 +61,15 @@ def compose_loss_seq(loss_list, forward_model, mask, device):
 
 def generate_loss_ops(loss_type, forward_model, mask, device):
   """Generate Loss Operators."""
-  assert loss_type.lower() in REGISTERED_SUP_LOSSES + REGISTERED_UNSUP_LOSSES
-
-  if loss_type.lower() == 'tv':
-    tx_op = loss_ops.TotalVariation()
-  elif loss_type.lower() == 'wave':
-    tx_op = loss_ops.L1Wavelets(device)
-  elif loss_type.lower() == 'ssim':
-    tx_op = loss_ops.SSIM()
-  elif loss_type.lower() == 'dc':
-    tx_op = loss_ops.DataConsistency(forward_model, mask)
-  elif loss_type.lower() == 'l1':
-    tx_op = loss_ops.L1()
-  elif loss_type.lower() == 'mse':
-    tx_op = loss_ops.MSE()
-  elif loss_type.lower() == 'l1pen':
-    tx_op = loss_ops.L1PenaltyWeights()
+  loss_type = loss_type.lower()
+  context = {'forward_model': forward_model, 'mask': mask, 'device': device}
+  registered = dict(REGISTERED_SUP_LOSSES, **REGISTERED_UNSUP_LOSSES)
+  if loss_type in registered:
+    path, arg_names = registered[loss_type]
+    tx_op = _import(path)(*[context[name] for name in arg_names])
+  elif loss_type in plugin_losses():
+    tx_op = plugin_losses()[loss_type].load()(**context)
   else:
-    raise NotImplementedError
+    raise NotImplementedError('Unknown loss {}, available: {}'.format(loss_type, available_losses()))
 
-  return functools.partial(tx_op)
\ No newline at end of file
+  return functools.partial(tx_op)
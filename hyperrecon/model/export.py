@@ -0,0 +1,191 @@
+"""
+Export of trained HyperUnet models to TorchScript and ONNX.
+
+The export modules share parameters with a trained HyperUnet but are stateless
+and have fixed call signatures, so they can be scripted or traced. They take
+hyperparameters as an input and compute loss coefficients inside the graph.
+A frozen export materializes the Unet weights for a single hyperparameter
+vector, giving a plain convolutional network of the image only.
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from . import layers
+from hyperrecon.util.utils import generate_coefficients
+
+
+class ExportBatchConv2d(nn.Module):
+  '''Stateless BatchConv2d sharing weights with a trained layer.'''
+  def __init__(self, layer):
+    super(ExportBatchConv2d, self).__init__()
+    self.hyperkernel = layer.hyperkernel
+    self.hyperbias = layer.hyperbias
+    self.in_channels = layer.in_channels
+    self.out_channels = layer.out_channels
+    self.kernel_size = layer.kernel_size
+    self.stride = layer.stride
+    self.padding = layer.padding
+    self.dilation = layer.dilation
+
+  def forward(self, x, hyp_out):
+    b, c, h, w = x.shape
+    kernel = self.hyperkernel(hyp_out).view(b * self.out_channels, self.in_channels,
+                                            self.kernel_size, self.kernel_size)
+    out = F.conv2d(x.reshape(1, b * c, h, w), kernel, None, self.stride,
+                   self.padding, self.dilation, b)
+    out = out.view(b, self.out_channels, out.shape[-2], out.shape[-1])
+    return out + self.hyperbias(hyp_out).view(b, self.out_channels, 1, 1)
+
+class FrozenConv2d(nn.Module):
+  '''Conv2d with weights generated for a single hyperparameter vector.'''
+  def __init__(self, layer, hyp_out):
+    super(FrozenConv2d, self).__init__()
+    self.conv = nn.Conv2d(layer.in_channels, layer.out_channels, layer.kernel_size,
+                          stride=layer.stride, padding=layer.padding, dilation=layer.dilation)
+    with torch.no_grad():
+      self.conv.weight.copy_(layer.hyperkernel(hyp_out).view(*layer.get_kernel_shape()))
+      self.conv.bias.copy_(layer.hyperbias(hyp_out).view(*layer.get_bias_shape()))
+
+  def forward(self, x, hyp_out):
+    return self.conv(x)
+
+class ExportDoubleConv(nn.Module):
+  '''Conv, (BatchNorm), ReLU, Conv, (BatchNorm), ReLU.'''
+  def __init__(self, seq, make_conv):
+    super(ExportDoubleConv, self).__init__()
+    convs = [m for m in seq if isinstance(m, layers.BatchConv2d)]
+    bns = [m for m in seq if isinstance(m, nn.BatchNorm2d)]
+    self.conv1 = make_conv(convs[0])
+    self.conv2 = make_conv(convs[1])
+    self.bn1 = bns[0] if len(bns) > 0 else nn.Identity()
+    self.bn2 = bns[1] if len(bns) > 0 else nn.Identity()
+
+  def forward(self, x, hyp_out):
+    x = F.relu(self.bn1(self.conv1(x, hyp_out)))
+    return F.relu(self.bn2(self.conv2(x, hyp_out)))
+
+class ExportUnet(nn.Module):
+  '''Scriptable version of a hypernetwork Unet.'''
+  def __init__(self, unet, make_conv):
+    super(ExportUnet, self).__init__()
+    self.residual = unet.residual
+    self.dconv_down1 = ExportDoubleConv(unet.dconv_down1, make_conv)
+    self.dconv_down2 = ExportDoubleConv(unet.dconv_down2, make_conv)
+    self.dconv_down3 = ExportDoubleConv(unet.dconv_down3, make_conv)
+    self.dconv_down4 = ExportDoubleConv(unet.dconv_down4, make_conv)
+    self.dconv_up3 = ExportDoubleConv(unet.dconv_up3, make_conv)
+    self.dconv_up2 = ExportDoubleConv(unet.dconv_up2, make_conv)
+    self.dconv_up1 = ExportDoubleConv(unet.dconv_up1, make_conv)
+    self.conv_last = make_conv(unet.conv_last)
+
+  def up(self, x):
+    return F.interpolate(x, scale_factor=2., mode='bilinear', align_corners=True)
+
+  def forward(self, zf, hyp_out):
+    conv1 = self.dconv_down1(zf, hyp_out)
+    conv2 = self.dconv_down2(F.max_pool2d(conv1, 2), hyp_out)
+    conv3 = self.dconv_down3(F.max_pool2d(conv2, 2), hyp_out)
+    x = self.dconv_down4(F.max_pool2d(conv3, 2), hyp_out)
+    x = self.dconv_up3(torch.cat([self.up(x), conv3], dim=1), hyp_out)
+    x = self.dconv_up2(torch.cat([self.up(x), conv2], dim=1), hyp_out)
+    x = self.dconv_up1(torch.cat([self.up(x), conv1], dim=1), hyp_out)
+    out = self.conv_last(x, hyp_out)
+    if self.residual:
+      out = zf.norm(p=2, dim=1, keepdim=True) + out
+    return out
+
+class ExportHyperUnet(nn.Module):
+  '''HyperUnet of (zf, hparams), with coefficients computed in the graph.
+
+  Args:
+    network: Trained HyperUnet
+    num_losses: Number of losses the model was trained with
+    range_restrict: Whether the model was trained with range_restrict
+  '''
+  def __init__(self, network, num_losses, range_restrict):
+    super(ExportHyperUnet, self).__init__()
+    self.hnet = network.hnet
+    self.unet = ExportUnet(network.unet, ExportBatchConv2d)
+    self.num_losses = num_losses
+    self.range_restrict = range_restrict
+
+  def coefficients(self, hparams):
+    # Same as utils.generate_coefficients
+    if self.range_restrict and self.num_losses == 2:
+      alpha = hparams[:, 0]
+      return torch.stack((1-alpha, alpha), dim=1)
+    elif self.range_restrict and self.num_losses == 3:
+      alpha = hparams[:, 0]
+      beta = hparams[:, 1]
+      return torch.stack((alpha, (1-alpha)*beta, (1-alpha)*(1-beta)), dim=1)
+    return hparams / torch.sum(hparams, dim=1, keepdim=True)
+
+  def forward(self, zf, hparams):
+    hyp_out = self.hnet(self.coefficients(hparams))
+    return self.unet(zf, hyp_out)
+
+class FrozenHyperUnet(nn.Module):
+  '''HyperUnet frozen at a single hyperparameter vector, a function of zf only.'''
+  def __init__(self, network, hparams, num_losses, range_restrict):
+    super(FrozenHyperUnet, self).__init__()
+    hparams = torch.as_tensor(hparams, dtype=torch.float32).view(1, -1)
+    with torch.no_grad():
+      hyp_out = network.hnet(generate_coefficients(hparams, num_losses, range_restrict))
+    self.unet = ExportUnet(network.unet, lambda layer: FrozenConv2d(layer, hyp_out))
+    self.register_buffer('hyp_out', torch.zeros(0))
+
+  def forward(self, zf):
+    return self.unet(zf, self.hyp_out)
+
+
+def export(network, path, num_losses, range_restrict, fmt='torchscript',
+           freeze_hparams=None, example_inputs=None, opset_version=11):
+  '''Export a trained HyperUnet.
+
+  Args:
+    network: Trained HyperUnet
+    path: Output path
+    num_losses: Number of losses the model was trained with
+    range_restrict: Whether the model was trained with range_restrict
+    fmt: One of [torchscript, onnx]
+    freeze_hparams: If given, export a graph frozen at these hyperparameters
+    example_inputs: Tuple of example inputs, required for onnx. The batch size
+      of onnx graphs with hyperparameter input is fixed to that of the
+      example, since grouped convolutions have a static number of groups.
+
+  Returns:
+    Export module in eval mode
+  '''
+  network = network.cpu().eval()
+  if freeze_hparams is not None:
+    module = FrozenHyperUnet(network, freeze_hparams, num_losses, range_restrict).eval()
+    input_names, dynamic_axes = ['zf'], {'zf': {0: 'batch'}, 'out': {0: 'batch'}}
+  else:
+    module = ExportHyperUnet(network, num_losses, range_restrict).eval()
+    input_names, dynamic_axes = ['zf', 'hparams'], None
+
+  if fmt == 'torchscript':
+    torch.jit.save(torch.jit.script(module), path)
+  elif fmt == 'onnx':
+    assert example_inputs is not None, 'ONNX export requires example_inputs'
+    torch.onnx.export(module, example_inputs, path, input_names=input_names,
+                      output_names=['out'], dynamic_axes=dynamic_axes,
+                      opset_version=opset_version)
+  else:
+    raise ValueError('Unknown export format {}'.format(fmt))
+  print('Exported', fmt, 'to', path)
+  return module
+
+@torch.no_grad()
+def check_parity(network, module, zf, hparams, num_losses, range_restrict, frozen=False):
+  '''Max absolute difference between a HyperUnet and its export on CPU.
+
+  Args:
+    zf: Network input (bs, n_ch, l, w)
+    hparams: Hyperparameters (bs, num_hparams). For frozen modules, all rows
+      must equal the frozen hyperparameters.
+  '''
+  network = network.cpu().eval()
+  expected = network(zf, generate_coefficients(hparams, num_losses, range_restrict))
+  actual = module(zf) if frozen else module(zf, hparams)
+  return (expected - actual).abs().max().item()
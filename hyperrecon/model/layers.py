@@ -6,6 +6,7 @@ For more details, please read:
 """
 import numbers
 import math
+import threading
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -39,6 +40,35 @@ class Conv2d(nn.Module):
   def forward(self, x, hyp_out=None):
     return self.layer(x)
 
+_collectors = threading.local()
+
+class WeightCollector(object):
+  '''Collects the weights generated by BatchConv2d layers in forward passes
+  run inside its context, on the current thread.
+
+    with WeightCollector() as collector:
+      pred = network(zf, coeffs)
+    collector.weights  # [kernel, bias, kernel, bias, ...], each (bs, units)
+
+  Args:
+    enabled: If False, nothing is collected
+  '''
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.weights = []
+
+  def __enter__(self):
+    self.prev = getattr(_collectors, 'active', None)
+    if self.enabled:
+      _collectors.active = self
+    return self
+
+  def __exit__(self, *exc):
+    _collectors.active = self.prev
+
+def active_collector():
+  return getattr(_collectors, 'active', None)
+
 class BatchConv2d(nn.Module):
   """
   Conv2D for a batch of images and weights
@@ -46,11 +76,17 @@ class BatchConv2d(nn.Module):
   images[0] and weights[0], images[1] and weights[1], ..., images[B-1] and weights[B-1]
 
   Takes hypernet output and transforms it to weights and biases
+
+  With store_weights=False, generated weights are not kept on the module, so
+  they are freed as soon as autograd allows and the module can be shared by
+  concurrent threads. Use a WeightCollector to get them.
   """
   def __init__(self, in_channels, out_channels, hyp_out_units, stride=1,
-         padding=0, dilation=1, kernel_size=3):
+         padding=0, dilation=1, kernel_size=3, store_weights=True):
     super(BatchConv2d, self).__init__()
 
+    self.store_weights = store_weights
+
     self.stride = stride
     self.padding = padding
     self.dilation = dilation
@@ -58,8 +94,9 @@ class BatchConv2d(nn.Module):
     self.in_channels = in_channels
     self.out_channels = out_channels
 
-    kernel_units = np.prod(self.get_kernel_shape())
-    bias_units = np.prod(self.get_bias_shape())
+    # Python ints, numpy ints are not valid TorchScript constants
+    kernel_units = int(np.prod(self.get_kernel_shape()))
+    bias_units = int(np.prod(self.get_bias_shape()))
     self.hyperkernel = nn.Linear(hyp_out_units, kernel_units)
     self.hyperbias = nn.Linear(hyp_out_units, bias_units)
 
@@ -71,8 +108,13 @@ class BatchConv2d(nn.Module):
 
     # Reshape input and get weights from hyperkernel
     out = x.permute([1, 0, 2, 3, 4]).contiguous().view(b_j, b_i * c, h, w)
-    self.kernel = self.hyperkernel(hyp_out)
-    kernel = self.kernel.view(b_i * self.out_channels, self.in_channels, self.kernel_size, self.kernel_size)
+    generated = self.hyperkernel(hyp_out)
+    collector = active_collector()
+    if self.store_weights:
+      self.kernel = generated
+    if collector is not None:
+      collector.weights.append(generated)
+    kernel = generated.view(b_i * self.out_channels, self.in_channels, self.kernel_size, self.kernel_size)
     out = F.conv2d(out, weight=kernel, bias=None, stride=self.stride, dilation=self.dilation, groups=b_i,
              padding=self.padding)
 
@@ -81,15 +123,21 @@ class BatchConv2d(nn.Module):
 
     if include_bias:
       # Get weights from hyperbias
-      self.bias = self.hyperbias(hyp_out)
-      out = out + self.bias.unsqueeze(1).unsqueeze(3).unsqueeze(3)
+      bias = self.hyperbias(hyp_out)
+      if self.store_weights:
+        self.bias = bias
+      if collector is not None:
+        collector.weights.append(bias)
+      out = out + bias.unsqueeze(1).unsqueeze(3).unsqueeze(3)
 
     out = out[:,0,...]
     return out
 
   def get_kernel(self):
+    assert self.store_weights, 'Weights are not stored with store_weights=False, use a WeightCollector'
     return self.kernel
   def get_bias(self):
+    assert self.store_weights, 'Weights are not stored with store_weights=False, use a WeightCollector'
     return self.bias
   def get_kernel_shape(self):
     return [self.out_channels, self.in_channels, self.kernel_size, self.kernel_size]
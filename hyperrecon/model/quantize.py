@@ -0,0 +1,106 @@
+"""
+Dynamic INT8 quantization of HyperUnet for CPU inference.
+
+The hypernetwork Linears and the hyperkernel/hyperbias heads of every
+BatchConv2d are quantized to INT8 with dynamic (per-batch) activation scales.
+Kernels generated by the quantized heads are additionally fake-quantized to
+INT8 per output channel, then materialized as float weights for the main
+convolutions, since grouped per-sample convolutions have no quantized kernel.
+"""
+import io
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from . import layers
+from hyperrecon.loss import loss_ops
+
+
+def fake_quantize(w):
+  '''Symmetric INT8 fake quantization of a 2D tensor, with one scale per row.'''
+  scale = w.abs().max(dim=1, keepdim=True)[0].clamp(min=1e-8) / 127.
+  return torch.round(w / scale).clamp(-127, 127) * scale
+
+class FakeQuantKernel(nn.Module):
+  '''Wraps a hyperkernel head, fake-quantizing each generated kernel per output channel.'''
+  def __init__(self, hyperkernel, out_channels):
+    super(FakeQuantKernel, self).__init__()
+    self.hyperkernel = hyperkernel
+    self.out_channels = out_channels
+
+  def forward(self, hyp_out):
+    kernel = self.hyperkernel(hyp_out)
+    b = kernel.shape[0]
+    return fake_quantize(kernel.view(b * self.out_channels, -1)).view(b, -1)
+
+
+def quantize(network, quantize_kernels=True):
+  '''INT8 copy of a trained network for CPU inference.
+
+  Args:
+    network: Trained HyperUnet or Unet
+    quantize_kernels: Whether to fake-quantize the generated conv kernels
+
+  Returns:
+    Quantized copy of network in eval mode
+  '''
+  network = copy.deepcopy(network).cpu().eval()
+  qnetwork = torch.quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+  if quantize_kernels:
+    for m in qnetwork.modules():
+      if isinstance(m, layers.BatchConv2d):
+        m.hyperkernel = FakeQuantKernel(m.hyperkernel, m.out_channels)
+  return qnetwork
+
+def model_size(network):
+  '''Size in bytes of the serialized state dict.'''
+  buf = io.BytesIO()
+  torch.save(network.state_dict(), buf)
+  return buf.tell()
+
+
+@torch.no_grad()
+def accuracy_report(reconstructor, qnetwork, gt, list_of_hparams, batch_size=32):
+  '''PSNR/SSIM of fp32 and INT8 reconstructions against ground truth.
+
+  Both networks see the same undersampled inputs. Each network runs one
+  untimed forward pass first, so one-off allocation and kernel selection
+  costs are not counted.
+
+  Args:
+    reconstructor: hyperrecon.inference.Reconstructor with the fp32 network on CPU
+    qnetwork: Quantized network
+    gt: Ground-truth images (N, 1, l, w)
+    list_of_hparams: Hyperparameter vectors to evaluate
+
+  Returns:
+    Dict of model sizes, and per-hparam mean metrics and median CPU time per image
+  '''
+  psnr, ssim = loss_ops.PSNR(), loss_ops.SSIM()
+  report = {'size:fp32': model_size(reconstructor.network),
+            'size:int8': model_size(qnetwork), 'hparams': {}}
+  x = torch.as_tensor(gt[:batch_size]).float()
+  zf = reconstructor.prepare_inputs(x)
+  coeffs = reconstructor.coefficients(list_of_hparams[0], len(zf))
+  for net in [reconstructor.network, qnetwork]:
+    net(zf, coeffs)
+  for hp in list_of_hparams:
+    stats = {k: [] for k in ['psnr:fp32', 'psnr:int8', 'ssim:fp32', 'ssim:int8',
+                             'psnr:int8_vs_fp32', 'time:fp32', 'time:int8']}
+    for i in range(0, len(gt), batch_size):
+      x = torch.as_tensor(gt[i:i+batch_size]).float()
+      zf = reconstructor.prepare_inputs(x)
+      coeffs = reconstructor.coefficients(hp, len(zf))
+      for name, net in [('fp32', reconstructor.network), ('int8', qnetwork)]:
+        start = time.perf_counter()
+        pred = net(zf, coeffs)
+        stats['time:' + name].append((time.perf_counter() - start) / len(zf))
+        stats['psnr:' + name] += psnr(x, pred).tolist()
+        stats['ssim:' + name] += (1 - ssim(x, pred)).tolist()
+        if name == 'fp32':
+          fp32_pred = pred
+      stats['psnr:int8_vs_fp32'] += psnr(fp32_pred, pred).tolist()
+    report['hparams'][str(list(hp))] = {
+      k: float(np.median(v) if k.startswith('time:') else np.mean(v)) for k, v in stats.items()}
+  return report
@@ -10,16 +10,18 @@ from . import layers
 from .hypernetwork import HyperNetwork
 
 class Unet(nn.Module):
-  def __init__(self, in_ch, out_ch, h_ch, hnet_hdim=None, residual=True, use_batchnorm=False):
+  def __init__(self, in_ch, out_ch, h_ch, hnet_hdim=None, residual=True, use_batchnorm=False, store_weights=True):
     '''Main Unet architecture.
     
-    hnet_hdim activates hypernetwork for Unet.
+    hnet_hdim activates hypernetwork for Unet. store_weights is passed to
+    BatchConv2d layers; if False, no per-batch state is kept on the module.
     '''
     super(Unet, self).__init__()
         
     self.residual = residual
     self.hnet_hdim = hnet_hdim
     self.use_batchnorm = use_batchnorm
+    self.store_weights = store_weights
 
     self.dconv_down1 = self.double_conv(in_ch, h_ch)
     self.dconv_down2 = self.double_conv(h_ch, h_ch)
@@ -34,7 +36,7 @@ class Unet(nn.Module):
     self.dconv_up1 = self.double_conv(h_ch+h_ch, h_ch)
     
     if hnet_hdim is not None:
-      self.conv_last = layers.BatchConv2d(h_ch, out_ch, hnet_hdim, kernel_size=1)
+      self.conv_last = layers.BatchConv2d(h_ch, out_ch, hnet_hdim, kernel_size=1, store_weights=store_weights)
     else:
       self.conv_last = nn.Conv2d(h_ch, out_ch, 1)
     
@@ -43,18 +45,18 @@ class Unet(nn.Module):
     if self.hnet_hdim is not None:
       if self.use_batchnorm:
         return layers.MultiSequential(
-          layers.BatchConv2d(in_channels, out_channels, self.hnet_hdim, padding=1),
+          layers.BatchConv2d(in_channels, out_channels, self.hnet_hdim, padding=1, store_weights=self.store_weights),
           nn.BatchNorm2d(out_channels),
           nn.ReLU(inplace=True),
-          layers.BatchConv2d(out_channels, out_channels, self.hnet_hdim, padding=1),
+          layers.BatchConv2d(out_channels, out_channels, self.hnet_hdim, padding=1, store_weights=self.store_weights),
           nn.BatchNorm2d(out_channels),
           nn.ReLU(inplace=True)
         )   
       else:
         return layers.MultiSequential(
-          layers.BatchConv2d(in_channels, out_channels, self.hnet_hdim, padding=1),
+          layers.BatchConv2d(in_channels, out_channels, self.hnet_hdim, padding=1, store_weights=self.store_weights),
           nn.ReLU(inplace=True),
-          layers.BatchConv2d(out_channels, out_channels, self.hnet_hdim, padding=1),
+          layers.BatchConv2d(out_channels, out_channels, self.hnet_hdim, padding=1, store_weights=self.store_weights),
           nn.ReLU(inplace=True)
         )   
     else:
@@ -94,7 +96,9 @@ class Unet(nn.Module):
     x = self.dconv_down4(x, hyp_out)
     feature_mean = feature_mean + x.mean(dim=(1,2,3))
 
-    self.feature_mean = feature_mean
+    # Per-batch state is only kept on the module if it stores weights
+    if self.store_weights:
+      self.feature_mean = feature_mean
     
     x = self.upsample(x)        
     x = torch.cat([x, conv3], dim=1)
@@ -120,6 +124,7 @@ class Unet(nn.Module):
     return out
 
   def get_feature_mean(self):
+    assert self.store_weights, 'Feature mean is not stored with store_weights=False'
     return self.feature_mean
 
   def get_conv_weights(self):
@@ -132,7 +137,7 @@ class Unet(nn.Module):
 
 class HyperUnet(nn.Module):
   """HyperUnet for hyperparameter-agnostic image reconstruction"""
-  def __init__(self, in_units_hnet, h_units_hnet, in_ch_main, out_ch_main, h_ch_main, residual=True, use_batchnorm=False):
+  def __init__(self, in_units_hnet, h_units_hnet, in_ch_main, out_ch_main, h_ch_main, residual=True, use_batchnorm=False, store_weights=True):
     """
     Args:
       in_units_hnet : Input dimension for hypernetwork
@@ -141,8 +146,10 @@ class HyperUnet(nn.Module):
       out_ch_main : Output channels for Unet
       h_ch_main : Hidden channels for Unet
       residual : Whether or not to use residual U-Net architecture
+      store_weights : Whether BatchConv2d layers keep generated weights, see layers.WeightCollector
     """
     super(HyperUnet, self).__init__()
+    self.store_weights = store_weights
 
     # HyperNetwork
     self.hnet = HyperNetwork(
@@ -155,7 +162,8 @@ class HyperUnet(nn.Module):
                     h_ch=h_ch_main, 
                     hnet_hdim=h_units_hnet,
                     residual=residual,
-                    use_batchnorm=use_batchnorm
+                    use_batchnorm=use_batchnorm,
+                    store_weights=store_weights
                 )
 
   def forward(self, x, hyperparams):
@@ -174,6 +182,7 @@ class HyperUnet(nn.Module):
   def get_conv_weights(self):
     #TODO: hacky implementation, assumes that forward pass on hyperkernel and hyperbias has been called.
     #      Also, is dependent on batch size of the forward pass.
+    #      Prefer collecting weights with layers.WeightCollector.
     weights = []
     modules = [module for module in self.unet.modules() if (not isinstance(module, layers.MultiSequential) and isinstance(module, layers.BatchConv2d))]
     for l in modules:
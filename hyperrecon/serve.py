@@ -0,0 +1,214 @@
+"""Local reconstruction server with dynamic batching across hyperparameters.
+
+Concurrent requests, each with its own image (or measurement) and
+hyperparameter vector, are coalesced into a single forward pass: BatchConv2d
+generates separate weights for every sample of a batch. A batch is run when it
+reaches max_batch_size or when its oldest request has waited max_wait_ms.
+"""
+import io
+import json
+import time
+import base64
+import threading
+import collections
+import numpy as np
+import torch
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+def encode_array(arr):
+  buf = io.BytesIO()
+  np.save(buf, np.asarray(arr), allow_pickle=False)
+  return base64.b64encode(buf.getvalue()).decode('ascii')
+
+def decode_array(s):
+  return np.load(io.BytesIO(base64.b64decode(s)), allow_pickle=False)
+
+
+class Request(object):
+  '''A single-image reconstruction request and its result slot.'''
+  def __init__(self, x, hparams, is_measurement=False):
+    self.x = x
+    self.hparams = hparams
+    self.is_measurement = is_measurement
+    self.arrival = time.perf_counter()
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.stats = {}
+
+  def key(self):
+    # Only requests with equal shapes and input type can share a batch
+    return (tuple(self.x.shape), self.is_measurement)
+
+
+class QueueFull(Exception):
+  pass
+
+
+class DynamicBatcher(object):
+  '''Coalesces requests into batches on a single worker thread.
+
+  Args:
+    reconstructor: hyperrecon.inference.Reconstructor
+    max_batch_size: Maximum number of requests per forward pass
+    max_wait_ms: Maximum time the oldest request of a batch waits for others
+    max_queue: Maximum number of pending requests of all keys, beyond which new
+      ones are rejected
+  '''
+  def __init__(self, reconstructor, max_batch_size=16, max_wait_ms=10., max_queue=256):
+    self.reconstructor = reconstructor
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait_ms / 1000.
+    self.max_queue = max_queue
+    # Pending requests by key, each in arrival order
+    self.pending = collections.OrderedDict()
+    self.num_pending = 0
+    self.cond = threading.Condition()
+    self.lock = threading.Lock()
+    self.latencies = []
+    self.batch_sizes = []
+    self.num_rejected = 0
+    self.thread = threading.Thread(target=self._worker, daemon=True)
+    self.thread.start()
+
+  def submit(self, request, timeout=None):
+    '''Queue request and wait for its result. Raises QueueFull under backpressure,
+    and ValueError for inputs which cannot be reconstructed.'''
+    self.reconstructor.check_input(request.x.shape, np.size(request.hparams), request.is_measurement)
+    with self.cond:
+      full = self.num_pending >= self.max_queue
+      if not full:
+        self.pending.setdefault(request.key(), collections.deque()).append(request)
+        self.num_pending += 1
+        self.cond.notify()
+    if full:
+      with self.lock:
+        self.num_rejected += 1
+      raise QueueFull()
+    if not request.done.wait(timeout):
+      raise TimeoutError('Reconstruction timed out')
+    if request.error is not None:
+      raise request.error
+    return request.result
+
+  def _next_batch(self):
+    with self.cond:
+      while self.num_pending == 0:
+        self.cond.wait()
+      # Key of the oldest pending request, which waits for others of its key
+      key = min(self.pending, key=lambda k: self.pending[k][0].arrival)
+      requests = self.pending[key]
+      deadline = requests[0].arrival + self.max_wait
+      while len(requests) < self.max_batch_size:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+          break
+        self.cond.wait(remaining)
+      batch = [requests.popleft() for _ in range(min(len(requests), self.max_batch_size))]
+      if len(requests) == 0:
+        del self.pending[key]
+      self.num_pending -= len(batch)
+    return batch
+
+  def _worker(self):
+    while True:
+      batch = self._next_batch()
+      start = time.perf_counter()
+      try:
+        x = torch.stack([torch.as_tensor(r.x) for r in batch])
+        hparams = torch.stack([torch.as_tensor(r.hparams, dtype=torch.float32).view(-1) for r in batch])
+        out = self.reconstructor.reconstruct_per_sample(x, hparams, batch[0].is_measurement).cpu().numpy()
+      except Exception as e:
+        out = None
+        for r in batch:
+          r.error = e
+      end = time.perf_counter()
+      with self.lock:
+        self.batch_sizes.append(len(batch))
+        for i, r in enumerate(batch):
+          r.stats = {'queue_ms': (start - r.arrival) * 1000,
+                     'compute_ms': (end - start) * 1000,
+                     'latency_ms': (end - r.arrival) * 1000,
+                     'batch_size': len(batch)}
+          self.latencies.append(r.stats['latency_ms'])
+      for i, r in enumerate(batch):
+        if out is not None:
+          r.result = out[i]
+        r.done.set()
+
+  def metrics(self):
+    with self.lock:
+      lat = np.array(self.latencies) if len(self.latencies) > 0 else np.zeros(1)
+      return {
+        'num_requests': len(self.latencies),
+        'num_batches': len(self.batch_sizes),
+        'num_rejected': self.num_rejected,
+        'queue_size': self.num_pending,
+        'mean_batch_size': float(np.mean(self.batch_sizes)) if len(self.batch_sizes) > 0 else 0.,
+        'latency_ms:p50': float(np.percentile(lat, 50)),
+        'latency_ms:p90': float(np.percentile(lat, 90)),
+        'latency_ms:p99': float(np.percentile(lat, 99)),
+      }
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+def make_handler(batcher, timeout=60.):
+  class Handler(BaseHTTPRequestHandler):
+    '''POST /reconstruct with json {"data": npy base64, "hparams": [...],
+    "measurement": bool}. GET /metrics for latency and batching statistics.
+    '''
+    def _send(self, code, body):
+      payload = json.dumps(body).encode('utf-8')
+      self.send_response(code)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(payload)))
+      self.end_headers()
+      self.wfile.write(payload)
+
+    def do_GET(self):
+      if self.path == '/metrics':
+        self._send(200, batcher.metrics())
+      else:
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+      if self.path != '/reconstruct':
+        self._send(404, {'error': 'not found'})
+        return
+      try:
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        x = decode_array(body['data']).astype(np.float32)
+        if x.ndim == 2:
+          x = x[None]
+        request = Request(x, body['hparams'], body.get('measurement', False))
+      except Exception as e:
+        self._send(400, {'error': repr(e)})
+        return
+      try:
+        recon = batcher.submit(request, timeout=timeout)
+      except QueueFull:
+        self._send(503, {'error': 'queue full'})
+        return
+      except ValueError as e:
+        # Input the client can fix
+        self._send(400, {'error': str(e)})
+        return
+      except Exception as e:
+        self._send(500, {'error': repr(e)})
+        return
+      self._send(200, dict(recon=encode_array(recon), **request.stats))
+
+    def log_message(self, format, *args):
+      pass
+  return Handler
+
+def serve(reconstructor, host='127.0.0.1', port=8080, max_batch_size=16,
+          max_wait_ms=10., max_queue=256):
+  batcher = DynamicBatcher(reconstructor, max_batch_size, max_wait_ms, max_queue)
+  server = ThreadingHTTPServer((host, port), make_handler(batcher))
+  print('Serving on http://{}:{}'.format(host, port))
+  server.serve_forever()
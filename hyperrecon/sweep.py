@@ -0,0 +1,204 @@
+"""Local hyperparameter sweeps over a grid of run.py configurations.
+
+Runs are scheduled onto a bounded process pool. Datasets and masks used by any
+run are loaded once by the scheduler and shared read-only with every worker
+through shared memory. Run status is kept in `status.json` in the sweep
+directory so that an interrupted sweep can be resumed.
+"""
+import os
+import json
+import time
+import hashlib
+import itertools
+import torch
+import torch.multiprocessing as mp
+
+from hyperrecon.argparser import Parser
+from hyperrecon import train_and_eval_lib
+from hyperrecon.data import shared
+from hyperrecon.data.mask import poisson_mask_path
+
+PENDING = 'pending'
+DONE = 'done'
+PRUNED = 'pruned'
+FAILED = 'failed'
+
+
+def to_argv(config):
+  '''Convert dict of flag values to a list of command-line arguments.
+
+  True/False map to --flag/--no_flag, lists are expanded and None is skipped.
+  '''
+  argv = []
+  for key, val in config.items():
+    if val is None:
+      continue
+    if isinstance(val, bool):
+      argv.append('--' + key if val else '--no_' + key)
+    elif isinstance(val, (list, tuple)):
+      argv.append('--' + key)
+      argv += [str(v) for v in val]
+    else:
+      argv += ['--' + key, str(val)]
+  return argv
+
+def expand_grid(base, grid):
+  '''Cartesian product of grid values, each merged on top of base.'''
+  keys = sorted(grid.keys())
+  configs = []
+  for values in itertools.product(*[grid[k] for k in keys]):
+    config = dict(base)
+    config.update(dict(zip(keys, values)))
+    configs.append(config)
+  return configs
+
+def run_id(config):
+  '''Stable identifier for a configuration.'''
+  s = json.dumps(config, sort_keys=True)
+  return hashlib.md5(s.encode('utf-8')).hexdigest()[:10]
+
+def shared_paths(configs):
+  '''All dataset and mask files read by configs.'''
+  defaults = vars(Parser().parse_args(['-fp', 'x', '--loss_list', 'l1', '--method', 'base_train']))
+  paths = set()
+  for config in configs:
+    c = dict(defaults)
+    c.update(config)
+    for key in ['train_path', 'test_path']:
+      if c[key] is not None:
+        paths.add(c[key])
+    if c['forward_type'] == 'csmri' and c['mask_type'] == 'poisson':
+      paths.add(poisson_mask_path(c['image_dims'], c['undersampling_rate']))
+  return sorted(p for p in paths if os.path.exists(p))
+
+
+class RunStatus(object):
+  '''JSON-backed status of every run in a sweep.'''
+  def __init__(self, path):
+    self.path = path
+    self.runs = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        self.runs = json.load(f)
+
+  def add(self, rid, config, **info):
+    '''Add run if new. info fills fields missing from an existing run.'''
+    if rid not in self.runs:
+      self.runs[rid] = {'config': config, 'status': PENDING}
+    for key, val in info.items():
+      self.runs[rid].setdefault(key, val)
+
+  def set(self, rid, status, **info):
+    self.runs[rid]['status'] = status
+    self.runs[rid].update(info)
+    self.save()
+
+  def todo(self, retry_failed=False):
+    '''Runs which have not finished, including those interrupted by a crash.'''
+    redo = [PENDING] + ([FAILED] if retry_failed else [])
+    return [rid for rid, r in self.runs.items() if r['status'] in redo]
+
+  def save(self):
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(self.runs, f, indent=4)
+    os.replace(tmp, self.path)
+
+
+def _init_worker(shared_arrays, num_threads):
+  shared.register_all(shared_arrays)
+  torch.set_num_threads(num_threads)
+
+def _run(rid, config):
+  args = Parser().parse(to_argv(config))
+  if torch.cuda.is_available():
+    args.device = torch.device('cuda:0')
+  else:
+    args.device = torch.device('cpu')
+  args.rank = 0
+  trainer = train_and_eval_lib.get_trainer(args)
+  trainer.config()
+  trainer.train()
+  return rid, args.run_dir, trainer.stopped_early
+
+class Sweep(object):
+  '''Schedules a grid of training runs onto a bounded process pool.
+
+  Args:
+    sweep_dir: Directory for sweep status
+    base: Dict of flags shared by all runs
+    grid: Dict mapping flag to list of values to sweep over
+    num_workers: Maximum number of concurrent runs
+    pruning: Optional dict of prune_* flags, e.g.
+      {"policy": "successive_halving", "milestones": [50, 100], "eta": 2}.
+      Stopped runs free their worker for the next queued run.
+  '''
+  def __init__(self, sweep_dir, base, grid, num_workers=1, pruning=None):
+    self.sweep_dir = sweep_dir
+    self.num_workers = num_workers
+    if not os.path.exists(sweep_dir):
+      os.makedirs(sweep_dir)
+    if pruning is not None:
+      base = dict(base)
+      base.update({'prune_' + k: v for k, v in pruning.items()})
+      base['prune_dir'] = sweep_dir
+
+    self.configs = {run_id(c): c for c in expand_grid(base, grid)}
+    self.status = RunStatus(os.path.join(sweep_dir, 'status.json'))
+    # Runs get their own directory, with the date pinned when first added so
+    # that resuming on a later day continues in the same directory
+    date = time.strftime('%b_%d')
+    for rid, config in self.configs.items():
+      self.status.add(rid, config,
+                      filename_prefix=os.path.join(config['filename_prefix'], rid),
+                      date=config.get('date') or date)
+    self.status.save()
+
+  def trial_config(self, rid):
+    '''Flags of run rid, with its unique filename_prefix and pinned date.
+    Pruning scores are keyed by rid.'''
+    config = dict(self.configs[rid])
+    config['trial_id'] = rid
+    config['filename_prefix'] = self.status.runs[rid]['filename_prefix']
+    config['date'] = self.status.runs[rid]['date']
+    return config
+
+  def run(self, retry_failed=False):
+    todo = [rid for rid in self.status.todo(retry_failed) if rid in self.configs]
+    print('Sweep: {} of {} runs to do'.format(len(todo), len(self.configs)))
+    if len(todo) == 0:
+      return self.status.runs
+
+    shared_arrays = {}
+    for path in shared_paths([self.configs[rid] for rid in todo]):
+      print('Sharing', path)
+      shared_arrays[path] = shared.to_shared(path)
+    num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+
+    ctx = mp.get_context('spawn')
+    # A fresh process per run keeps RNG, CUDA and allocator state independent
+    pool = ctx.Pool(self.num_workers, initializer=_init_worker,
+                    initargs=(shared_arrays, num_threads), maxtasksperchild=1)
+
+    def on_done(result):
+      rid, run_dir, stopped_early = result
+      self.status.set(rid, PRUNED if stopped_early else DONE, run_dir=run_dir)
+
+    def on_error(rid):
+      return lambda e: self.status.set(rid, FAILED, error=repr(e))
+
+    results = []
+    for rid in todo:
+      results.append(pool.apply_async(_run, (rid, self.trial_config(rid)),
+                                       callback=on_done, error_callback=on_error(rid)))
+    pool.close()
+    pool.join()
+    return self.status.runs
+
+def load_config(path):
+  '''Load sweep config of the form
+  {"base": {...}, "grid": {...}, "num_workers": n, "pruning": {...}}.
+  '''
+  with open(path) as f:
+    config = json.load(f)
+  return config['base'], config['grid'], config.get('num_workers', 1), config.get('pruning')
@@ -0,0 +1,201 @@
+"""
+CPU micro-benchmarks for HyperRecon hot paths.
+
+Every benchmark is timed over a sweep of batch size, Unet hidden channels,
+hypernetwork hidden units and image size. Results are written as json and can
+be compared against a saved baseline to flag regressions.
+"""
+import json
+import time
+import platform
+import itertools
+import numpy as np
+import torch
+
+from hyperrecon.argparser import Parser
+from hyperrecon.util import utils
+from hyperrecon.util.train import BaseTrain
+from hyperrecon.util.forward import CSMRIForward, MultiCoilCSMRIForward
+from hyperrecon.loss import loss_ops
+from hyperrecon.loss.losses import generate_loss_ops
+from hyperrecon.model.layers import BatchConv2d, WeightCollector
+from hyperrecon.model.unet import HyperUnet
+from hyperrecon.data.mask import VDSRandom
+from hyperrecon.data.phantom import sensitivity_maps
+
+BENCH_LOSSES = ['dc', 'tv', 'l1', 'mse', 'ssim', 'wave', 'l1pen']
+
+
+def time_fn(fn, warmup=2, repeat=10):
+  '''Time fn() over repeat calls after warmup calls.
+
+  Returns:
+    Dict of median and min time in milliseconds
+  '''
+  for _ in range(warmup):
+    fn()
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    times.append((time.perf_counter() - start) * 1000)
+  return {'median_ms': float(np.median(times)), 'min_ms': float(np.min(times))}
+
+class BenchTrain(BaseTrain):
+  '''BaseTrain on random data, without dataloaders or run directories.'''
+  def get_dataloader(self):
+    self.train_loader, self.val_loader = None, None
+
+def get_bench_trainer(bs, unet_hdim, hnet_hdim, image_size, loss_list=('dc', 'tv')):
+  argv = ['-fp', 'bench', '--method', 'base_train', '--loss_list'] + list(loss_list) + [
+    '--batch_size', str(bs), '--unet_hdim', str(unet_hdim), '--hnet_hdim', str(hnet_hdim),
+    '--image_dims', str(image_size), str(image_size), '--stage_timing', 'off',
+    '--mask_type', 'vds', '--undersampling_rate', '4']
+  args = Parser().parse_args(argv)
+  args.run_dir = None
+  args.device = torch.device('cpu')
+  args.rank = 0
+  trainer = BenchTrain(args)
+  trainer.config()
+  return trainer
+
+
+def bench_batchconv(bs, unet_hdim, hnet_hdim, image_size, **kwargs):
+  layer = BatchConv2d(unet_hdim, unet_hdim, hnet_hdim, padding=1)
+  x = torch.randn(bs, unet_hdim, image_size, image_size, requires_grad=True)
+  hyp_out = torch.randn(bs, hnet_hdim)
+  results = {'batchconv2d:forward': time_fn(lambda: layer(x, hyp_out), **kwargs)}
+
+  def fwd_bwd():
+    layer.zero_grad()
+    layer(x, hyp_out).sum().backward()
+  results['batchconv2d:forward_backward'] = time_fn(fwd_bwd, **kwargs)
+  return results
+
+def bench_fft(bs, image_size, **kwargs):
+  x = torch.randn(bs, 1, image_size, image_size)
+  ksp = utils.fft(x)
+  return {
+    'utils:fft': time_fn(lambda: utils.fft(x), **kwargs),
+    'utils:ifft': time_fn(lambda: utils.ifft(ksp), **kwargs),
+  }
+
+def bench_multicoil(bs, image_size, num_coils=16, **kwargs):
+  x = torch.rand(bs, 1, image_size, image_size)
+  forward = MultiCoilCSMRIForward(sensitivity_maps(num_coils, (image_size, image_size)))
+  mask = VDSRandom((image_size, image_size), '4')(bs)
+  ksp = forward(x, mask)
+  return {
+    'multicoil:forward': time_fn(lambda: forward(x, mask), **kwargs),
+    'multicoil:adjoint': time_fn(lambda: forward.adjoint(ksp), **kwargs),
+  }
+
+def bench_losses(bs, unet_hdim, hnet_hdim, image_size, **kwargs):
+  network = HyperUnet(2, hnet_hdim, in_ch_main=2, out_ch_main=1, h_ch_main=unet_hdim,
+                      store_weights=False)
+  gt = torch.rand(bs, 1, image_size, image_size)
+  zf = torch.randn(bs, 2, image_size, image_size)
+  # Generated weights are read by l1pen
+  with WeightCollector() as collector:
+    pred = network(zf, torch.rand(bs, 2)).detach()
+  weights = [w.detach() for w in collector.weights]
+  mask = VDSRandom((image_size, image_size), '4')
+  results = {}
+  for name in BENCH_LOSSES:
+    try:
+      op = generate_loss_ops(name, CSMRIForward(), mask, torch.device('cpu'))
+    except ImportError as e:
+      # Optional dependency, e.g. pytorch_wavelets for wave, is not installed
+      results['loss_ops:' + name] = {'skipped': repr(e)}
+      continue
+    results['loss_ops:' + name] = time_fn(lambda: op(gt, pred, network=network, weights=weights), **kwargs)
+  results['loss_ops:psnr'] = time_fn(lambda: loss_ops.PSNR()(gt, pred), **kwargs)
+  return results
+
+def bench_hyperunet(bs, unet_hdim, hnet_hdim, image_size, **kwargs):
+  network = HyperUnet(2, hnet_hdim, in_ch_main=2, out_ch_main=1, h_ch_main=unet_hdim,
+                      use_batchnorm=True)
+  zf = torch.randn(bs, 2, image_size, image_size)
+  coeffs = torch.rand(bs, 2)
+  with torch.no_grad():
+    return {'hyperunet:forward': time_fn(lambda: network(zf, coeffs), **kwargs)}
+
+def bench_train_step(bs, unet_hdim, hnet_hdim, image_size, **kwargs):
+  trainer = get_bench_trainer(bs, unet_hdim, hnet_hdim, image_size)
+  trainer.network.train()
+  batch = [torch.rand(bs, 1, image_size, image_size)]
+  return {'basetrain:train_step': time_fn(lambda: trainer.train_step(batch), **kwargs)}
+
+
+def run(batch_sizes, unet_hdims, hnet_hdims, image_sizes, warmup=2, repeat=10, num_threads=None):
+  '''Run all benchmarks over the product of configurations.
+
+  Returns:
+    Dict with environment info and a list of results
+  '''
+  if num_threads is not None:
+    torch.set_num_threads(num_threads)
+  torch.manual_seed(0)
+  kwargs = {'warmup': warmup, 'repeat': repeat}
+  results = []
+  for bs, unet_hdim, hnet_hdim, image_size in itertools.product(
+      batch_sizes, unet_hdims, hnet_hdims, image_sizes):
+    params = {'batch_size': bs, 'unet_hdim': unet_hdim,
+              'hnet_hdim': hnet_hdim, 'image_size': image_size}
+    print('Benchmarking', params)
+    timings = {}
+    timings.update(bench_batchconv(bs, unet_hdim, hnet_hdim, image_size, **kwargs))
+    timings.update(bench_fft(bs, image_size, **kwargs))
+    timings.update(bench_multicoil(bs, image_size, **kwargs))
+    timings.update(bench_losses(bs, unet_hdim, hnet_hdim, image_size, **kwargs))
+    timings.update(bench_hyperunet(bs, unet_hdim, hnet_hdim, image_size, **kwargs))
+    timings.update(bench_train_step(bs, unet_hdim, hnet_hdim, image_size, **kwargs))
+    for name, t in timings.items():
+      results.append(dict(name=name, params=params, **t))
+      if 'skipped' in t:
+        print('  {:<32s} skipped: {}'.format(name, t['skipped']))
+      else:
+        print('  {:<32s} {:10.3f} ms'.format(name, t['median_ms']))
+
+  return {
+    'env': {
+      'torch': torch.__version__,
+      'numpy': np.__version__,
+      'python': platform.python_version(),
+      'machine': platform.machine(),
+      'num_threads': torch.get_num_threads(),
+    },
+    'results': results,
+  }
+
+def result_key(result):
+  p = result['params']
+  return '{}|bs{}|unet{}|hnet{}|img{}'.format(result['name'], p['batch_size'],
+    p['unet_hdim'], p['hnet_hdim'], p['image_size'])
+
+def compare(current, baseline, threshold=0.1):
+  '''Compare median times of current against baseline. Benchmarks skipped in
+  either are ignored.
+
+  Returns:
+    List of (key, baseline_ms, current_ms, ratio) for results slower than
+    baseline by more than threshold
+  '''
+  base = {result_key(r): r for r in baseline['results'] if 'skipped' not in r}
+  regressions = []
+  for r in current['results']:
+    key = result_key(r)
+    if key not in base or 'skipped' in r:
+      continue
+    ratio = r['median_ms'] / base[key]['median_ms']
+    if ratio > 1 + threshold:
+      regressions.append((key, base[key]['median_ms'], r['median_ms'], ratio))
+  return regressions
+
+def save(results, path):
+  with open(path, 'w') as f:
+    json.dump(results, f, indent=4)
+
+def load(path):
+  with open(path) as f:
+    return json.load(f)
@@ -0,0 +1,182 @@
+"""
+Asynchronous checkpointing for HyperRecon.
+
+State is snapshotted to CPU on the training thread and serialized by a
+background thread. Files are written to a temporary path and renamed, so a
+checkpoint on disk is either complete or absent.
+"""
+import os
+import re
+import glob
+import json
+import queue
+import pickle
+import zipfile
+import random
+import threading
+import numpy as np
+import torch
+
+CKPT_PATTERN = re.compile(r'model\.(\d+)\.h5$')
+# Raised by torch.load on truncated or corrupted files
+UNREADABLE_ERRORS = (EOFError, pickle.UnpicklingError, zipfile.BadZipFile, RuntimeError)
+
+
+def snapshot(obj):
+  '''Recursively copy all tensors in obj to CPU, detached from training.'''
+  if torch.is_tensor(obj):
+    return obj.detach().cpu().clone()
+  elif isinstance(obj, dict):
+    return {k: snapshot(v) for k, v in obj.items()}
+  elif isinstance(obj, (list, tuple)):
+    return type(obj)(snapshot(v) for v in obj)
+  return obj
+
+def get_rng_state():
+  state = {
+    'random': random.getstate(),
+    'numpy': np.random.get_state(),
+    'torch': torch.get_rng_state(),
+  }
+  if torch.cuda.is_available():
+    state['cuda'] = torch.cuda.get_rng_state_all()
+  return state
+
+def set_rng_state(state):
+  random.setstate(state['random'])
+  np.random.set_state(state['numpy'])
+  torch.set_rng_state(state['torch'])
+  if 'cuda' in state and torch.cuda.is_available():
+    torch.cuda.set_rng_state_all(state['cuda'])
+
+def atomic_save(state, path):
+  '''torch.save to a temporary file in the same directory, then rename.'''
+  tmp = path + '.tmp'
+  torch.save(state, tmp)
+  os.replace(tmp, path)
+
+def list_checkpoints(ckpt_dir):
+  '''Sorted list of (epoch, path) of checkpoints in ckpt_dir.'''
+  ckpts = []
+  for path in glob.glob(os.path.join(ckpt_dir, 'model.*.h5')):
+    match = CKPT_PATTERN.search(path)
+    if match:
+      ckpts.append((int(match.group(1)), path))
+  return sorted(ckpts)
+
+def load(path):
+  '''Load checkpoint on CPU. Checkpoints hold python and numpy RNG state, so
+  they are not loadable with weights_only=True.'''
+  return torch.load(path, map_location=torch.device('cpu'), weights_only=False)
+
+def load_latest(ckpt_dir):
+  '''Load latest checkpoint in ckpt_dir which can be read, skipping truncated
+  or corrupted files.
+
+  Returns:
+    Checkpoint dict, or None if there is no checkpoint
+
+  Raises:
+    RuntimeError if there are checkpoints but none can be read
+  '''
+  ckpts = list_checkpoints(ckpt_dir)
+  for epoch, path in reversed(ckpts):
+    try:
+      return load(path)
+    except UNREADABLE_ERRORS as e:
+      print('Skipping unreadable checkpoint', path, repr(e))
+  if len(ckpts) > 0:
+    raise RuntimeError('None of the {} checkpoints in {} can be read'.format(len(ckpts), ckpt_dir))
+  return None
+
+def read_best(ckpt_dir):
+  '''Best {epoch, score} recorded by CheckpointWriter, or None.'''
+  index_path = os.path.join(ckpt_dir, 'index.json')
+  if os.path.exists(index_path):
+    with open(index_path) as f:
+      return json.load(f)['best']
+  return None
+
+
+class CheckpointWriter(object):
+  '''Writes checkpoints on a background thread with retention.
+
+  Keeps the keep_last most recent checkpoints plus the best one according to
+  the score passed to save().
+
+  Args:
+    ckpt_dir: Directory to save checkpoints
+    keep_last: Number of most recent checkpoints to keep. Keeps all if None or 0
+    mode: One of [max, min], whether higher or lower score is better
+  '''
+  def __init__(self, ckpt_dir, keep_last=None, mode='max'):
+    assert mode in ['max', 'min']
+    self.ckpt_dir = ckpt_dir
+    self.keep_last = keep_last
+    self.mode = mode
+    self.index_path = os.path.join(ckpt_dir, 'index.json')
+    self.best = read_best(ckpt_dir)
+
+    # Bounded so that at most one snapshot waits behind the one being written
+    self.queue = queue.Queue(maxsize=1)
+    self.error = None
+    self.thread = threading.Thread(target=self._worker, daemon=True)
+    self.thread.start()
+
+  def save(self, epoch, state, score=None):
+    '''Snapshot state and queue it for writing.'''
+    self._raise_error()
+    self.queue.put((epoch, snapshot(state), score))
+
+  def close(self):
+    '''Wait for all queued checkpoints to be written.'''
+    self.queue.put(None)
+    self.thread.join()
+    self._raise_error()
+
+  def _raise_error(self):
+    if self.error is not None:
+      raise self.error
+
+  def _worker(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      try:
+        self._write(*item)
+      except Exception as e:
+        self.error = e
+
+  def _write(self, epoch, state, score):
+    path = os.path.join(self.ckpt_dir, 'model.{epoch:04d}.h5'.format(epoch=epoch))
+    atomic_save(state, path)
+    print('Saved checkpoint to', path)
+    if score is not None and self._is_better(score):
+      self.best = {'epoch': epoch, 'score': score}
+      self._save_index()
+    self._cleanup()
+
+  def _is_better(self, score):
+    if self.best is None:
+      return True
+    if self.mode == 'max':
+      return score > self.best['score']
+    return score < self.best['score']
+
+  def _cleanup(self):
+    if not self.keep_last:
+      return
+    ckpts = list_checkpoints(self.ckpt_dir)
+    keep = set(e for e, _ in ckpts[-self.keep_last:])
+    if self.best is not None:
+      keep.add(self.best['epoch'])
+    for epoch, path in ckpts:
+      if epoch not in keep:
+        os.remove(path)
+
+  def _save_index(self):
+    tmp = self.index_path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'best': self.best}, f, indent=4)
+    os.replace(tmp, self.index_path)
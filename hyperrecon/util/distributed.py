@@ -0,0 +1,127 @@
+"""
+Distributed data-parallel utilities for HyperRecon.
+
+Each process trains an identical copy of the network on a disjoint shard of the
+training set. Gradients are averaged across processes after every backward pass,
+so the gloo backend can be used on CPU-only nodes.
+"""
+import os
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def is_distributed():
+  return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+  return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+  return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+  return get_rank() == 0
+
+def init_process_group(rank, world_size, backend='gloo', init_method='tcp://127.0.0.1:29500'):
+  '''Join the process group.
+
+  Args:
+    rank: Rank of this process
+    world_size: Total number of processes
+    backend: One of [gloo, nccl]
+    init_method: URL used by processes to rendezvous
+  '''
+  dist.init_process_group(backend=backend, init_method=init_method,
+                          world_size=world_size, rank=rank)
+
+def cleanup():
+  if is_distributed():
+    dist.destroy_process_group()
+
+def barrier():
+  if is_distributed():
+    dist.barrier()
+
+def reduce_device():
+  '''Device of tensors passed to collectives. NCCL only reduces CUDA tensors.'''
+  if is_distributed() and dist.get_backend() == 'nccl':
+    return torch.device('cuda', torch.cuda.current_device())
+  return torch.device('cpu')
+
+def broadcast_parameters(model, src=0):
+  '''Copy parameters and buffers of model on rank src to all other ranks.'''
+  if not is_distributed():
+    return
+  for tensor in list(model.parameters()) + list(model.buffers()):
+    dist.broadcast(tensor.data, src=src)
+
+def broadcast_buffers(model, src=0):
+  '''Copy buffers of model, e.g. BatchNorm running statistics, on rank src to
+  all other ranks. Each rank otherwise tracks statistics of its own shard.'''
+  if not is_distributed():
+    return
+  for tensor in model.buffers():
+    dist.broadcast(tensor.data, src=src)
+
+def all_reduce_gradients(model):
+  '''Average gradients of model across all ranks, in-place.'''
+  world_size = get_world_size()
+  if world_size == 1:
+    return
+  grads = [p.grad.data for p in model.parameters() if p.grad is not None]
+  if len(grads) == 0:
+    return
+  # Flatten into one buffer so that a single collective is issued per step
+  flat = torch.cat([g.view(-1) for g in grads])
+  dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+  flat /= world_size
+  offset = 0
+  for g in grads:
+    n = g.numel()
+    g.copy_(flat[offset:offset+n].view_as(g))
+    offset += n
+
+def all_reduce_mean(value):
+  '''Average a python scalar across all ranks.'''
+  world_size = get_world_size()
+  if world_size == 1:
+    return value
+  t = torch.tensor(float(value), dtype=torch.float64, device=reduce_device())
+  dist.all_reduce(t, op=dist.ReduceOp.SUM)
+  return t.item() / world_size
+
+def all_reduce_sum(tensor):
+  '''Sum of tensor across all ranks, on the device of tensor.'''
+  if get_world_size() == 1:
+    return tensor
+  t = tensor.to(reduce_device())
+  dist.all_reduce(t, op=dist.ReduceOp.SUM)
+  return t.to(tensor.device)
+
+def get_device(rank, backend):
+  '''Device for a given rank. CUDA is only used with the nccl backend.'''
+  if backend == 'nccl' and torch.cuda.is_available():
+    return torch.device('cuda:{}'.format(rank % torch.cuda.device_count()))
+  return torch.device('cpu')
+
+def _worker(rank, main_fn, args):
+  init_process_group(rank, args.world_size, args.dist_backend, args.dist_url)
+  args.rank = rank
+  args.device = get_device(rank, args.dist_backend)
+  if args.device.type == 'cuda':
+    torch.cuda.set_device(args.device)
+  if args.device.type == 'cpu':
+    # Split cores evenly so that processes do not oversubscribe the node
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.world_size))
+  try:
+    main_fn(args)
+  finally:
+    cleanup()
+
+def launch(main_fn, args):
+  '''Spawn args.world_size processes, each running main_fn(args).
+
+  Sets args.rank and args.device in every process before calling main_fn.
+  '''
+  mp.spawn(_worker, args=(main_fn, args), nprocs=args.world_size, join=True)
@@ -0,0 +1,162 @@
+"""Analytical cost model of HyperUnet training and inference.
+
+Estimates FLOPs, memory of kernels generated per batch by every BatchConv2d,
+activation memory retained for backward, the working set of gradients during
+backward, and parameter and Adam state, as a function of batch size, image
+size and network widths. Everything except
+fixed parameter state grows linearly with the batch size, which gives the
+largest batch fitting a memory budget directly.
+"""
+import time
+import numpy as np
+import torch
+
+from hyperrecon.model.unet import HyperUnet
+from hyperrecon.model import layers
+
+BYTES = 4
+
+
+def unet_convs(n_ch_in, n_ch_out, h_ch):
+  '''BatchConv2d layers of Unet as (in_channels, out_channels, kernel_size, downsampling).'''
+  convs = []
+  for c_in, down in [(n_ch_in, 1), (h_ch, 2), (h_ch, 4), (h_ch, 8)]:
+    convs += [(c_in, h_ch, 3, down), (h_ch, h_ch, 3, down)]
+  for down in [4, 2, 1]:
+    convs += [(2 * h_ch, h_ch, 3, down), (h_ch, h_ch, 3, down)]
+  convs.append((h_ch, n_ch_out, 1, 1))
+  return convs
+
+def estimate(batch_size, image_dims, unet_hdim, hnet_hdim, num_losses, n_ch_in=2,
+             n_ch_out=1, use_batchnorm=True, training=True):
+  '''Estimate costs of a HyperUnet forward pass, or of a training step with Adam.
+
+  Returns:
+    Dict of parameter counts, FLOPs (multiply-adds count as 2) and memory in bytes
+  '''
+  b = batch_size
+  pixels = image_dims[0] * image_dims[1]
+  hnet_params = num_losses * hnet_hdim + hnet_hdim + 3 * (hnet_hdim ** 2 + hnet_hdim)
+  head_params = 0
+  main_weights = 0
+  max_weights = 0
+  flops = 2 * b * (num_losses * hnet_hdim + 3 * hnet_hdim ** 2)
+  activations = 0
+  for c_in, c_out, k, down in unet_convs(n_ch_in, n_ch_out, unet_hdim):
+    weights = c_out * c_in * k * k + c_out
+    main_weights += weights
+    max_weights = max(max_weights, weights)
+    head_params += (hnet_hdim + 1) * weights
+    hw = pixels / down ** 2
+    flops += 2 * b * hnet_hdim * weights + 2 * b * c_out * c_in * k * k * hw
+    # Each saved tensor is counted once. The input of a conv is the output of
+    # the previous block, or a tensor counted below. The biased conv output
+    # is saved by BatchNorm (by the in-place ReLU without it), and the
+    # BatchNorm output by the in-place ReLU.
+    activations += b * hw * c_out * (2 if use_batchnorm and k > 1 else 1)
+  for down in [2, 4, 8]:
+    # Max-pool outputs, saved as conv inputs, and their int64 indices
+    activations += 3 * b * unet_hdim * pixels / down ** 2
+  for down in [4, 2, 1]:
+    # Skip concatenations, saved as conv inputs
+    activations += 2 * b * unet_hdim * pixels / down ** 2
+
+  params = hnet_params + head_params
+  out = {
+    'params': params,
+    'main_weights': main_weights,
+    'flops:forward': flops,
+    'bytes:generated_weights': b * main_weights * BYTES,
+    'bytes:inputs': b * pixels * (n_ch_in + 1) * BYTES,
+  }
+  if training:
+    out['flops:step'] = 3 * flops
+    out['bytes:activations'] = activations * BYTES
+    # Gradients are freed layer by layer, so the working set is that of the
+    # widest layer at full resolution (output and concatenated input of the
+    # first conv of dconv_up1) plus the gradient of its generated weights
+    out['bytes:backward'] = b * (3 * unet_hdim * pixels + max_weights) * BYTES
+    # Weights, gradients and two Adam moments
+    out['bytes:param_state'] = 4 * params * BYTES
+  else:
+    # Only the largest live pair of consecutive activations at full resolution
+    out['bytes:activations'] = b * pixels * (2 * unet_hdim + 2 * unet_hdim) * BYTES
+    out['bytes:backward'] = 0
+    out['bytes:param_state'] = params * BYTES
+  out['bytes:peak'] = (out['bytes:generated_weights'] + out['bytes:inputs']
+                       + out['bytes:activations'] + out['bytes:backward']
+                       + out['bytes:param_state'])
+  return out
+
+def recommend_batch_size(budget_bytes, image_dims, unet_hdim, hnet_hdim, num_losses,
+                         safety=0.9, even=True, **kwargs):
+  '''Largest batch size whose estimated peak memory fits safety * budget_bytes.
+
+  The peak is fixed parameter state plus a per-sample cost, so the batch size
+  is solved for directly. Training batch sizes are rounded down to even.
+  '''
+  one = estimate(1, image_dims, unet_hdim, hnet_hdim, num_losses, **kwargs)
+  two = estimate(2, image_dims, unet_hdim, hnet_hdim, num_losses, **kwargs)
+  per_sample = two['bytes:peak'] - one['bytes:peak']
+  fixed = one['bytes:peak'] - per_sample
+  bs = int((safety * budget_bytes - fixed) // per_sample)
+  if even:
+    bs -= bs % 2
+  return max(bs, 0)
+
+
+def measure(batch_size, image_dims, unet_hdim, hnet_hdim, num_losses, n_ch_in=2,
+            n_ch_out=1, use_batchnorm=True, device=torch.device('cpu')):
+  '''Measure a training step of HyperUnet with Adam, for comparison with estimate().
+
+  Generated weights are summed over BatchConv2d forward hooks. Peak memory is
+  only measured on CUDA devices.
+  '''
+  network = HyperUnet(num_losses, hnet_hdim, in_ch_main=n_ch_in, out_ch_main=n_ch_out,
+                      h_ch_main=unet_hdim, use_batchnorm=use_batchnorm).to(device)
+  optimizer = torch.optim.Adam(network.parameters())
+  zf = torch.randn(batch_size, n_ch_in, *image_dims, device=device)
+  coeffs = torch.rand(batch_size, num_losses, device=device)
+
+  generated = []
+  def hook(module, inputs, output):
+    generated.append(len(output) * (np.prod(module.get_kernel_shape()) + module.out_channels))
+  handles = [m.register_forward_hook(hook) for m in network.modules()
+             if isinstance(m, layers.BatchConv2d)]
+
+  def step():
+    optimizer.zero_grad()
+    network(zf, coeffs).abs().mean().backward()
+    optimizer.step()
+
+  # First step allocates Adam state
+  step()
+  for h in handles:
+    h.remove()
+  out = {
+    'params': sum(p.numel() for p in network.parameters()),
+    'bytes:generated_weights': int(sum(generated)) * BYTES,
+  }
+  if device.type == 'cuda':
+    torch.cuda.synchronize()
+    torch.cuda.reset_max_memory_allocated(device)
+  start = time.perf_counter()
+  step()
+  if device.type == 'cuda':
+    torch.cuda.synchronize()
+    out['bytes:peak'] = torch.cuda.max_memory_allocated(device)
+  out['time:step'] = time.perf_counter() - start
+  return out
+
+def compare(batch_size, image_dims, unet_hdim, hnet_hdim, num_losses, device=torch.device('cpu'), **kwargs):
+  '''Estimated and measured values side by side, with their ratio.'''
+  est = estimate(batch_size, image_dims, unet_hdim, hnet_hdim, num_losses, **kwargs)
+  meas = measure(batch_size, image_dims, unet_hdim, hnet_hdim, num_losses, device=device, **kwargs)
+  rows = {}
+  for key in est:
+    rows[key] = {'estimate': est[key], 'measured': meas.get(key),
+                 'ratio': meas[key] / est[key] if key in meas else None}
+  if 'time:step' in meas:
+    rows['tflops:measured'] = {'estimate': None, 'ratio': None,
+                               'measured': est['flops:step'] / meas['time:step'] / 1e12}
+  return rows
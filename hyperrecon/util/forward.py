@@ -1,7 +1,19 @@
 from abc import ABC, abstractmethod
 import torch
 import torch.nn.functional as F
-from .utils import fft
+from .utils import fft, ifft
+
+def complex_mul(a, b, conj_b=False):
+  '''Elementwise product of complex tensors with real and imaginary parts in dim -3.'''
+  a_re, a_im = a.select(-3, 0), a.select(-3, 1)
+  b_re, b_im = b.select(-3, 0), b.select(-3, 1)
+  if conj_b:
+    b_im = -b_im
+  return torch.stack((a_re * b_re - a_im * b_im, a_re * b_im + a_im * b_re), dim=-3)
+
+def num_input_channels(forward_type):
+  '''Channels of network inputs: real and imaginary parts for csmri, real otherwise.'''
+  return 2 if forward_type == 'csmri' else 1
 
 class BaseForward(ABC):
   def __init__(self):
@@ -29,26 +41,170 @@ class CSMRIForward(BaseForward):
       mask: Stack of masks (N, 1, l, w)
     '''
     ksp = fft(fullysampled)
+    if mask is None:
+      return ksp
     under_ksp = ksp * mask
     return under_ksp
+
+  def adjoint(self, ksp):
+    '''Zero-filled image (N, 2, l, w) from under-sampled k-space (N, 2, l, w).'''
+    return ifft(ksp)
+
+class MultiCoilCSMRIForward(BaseForward):
+  '''Forward model for multi-coil CS-MRI with coil sensitivity maps.
+
+  The FFTs of all coils in a chunk run as one batched transform. Coils are
+  processed coil_chunk at a time, which bounds the memory of intermediate
+  coil images.
+
+  Args:
+    sens_maps: Coil sensitivity maps (num_coils, 2, l, w)
+    coil_chunk: Number of coils per batched transform, default all
+  '''
+  def __init__(self, sens_maps, coil_chunk=None):
+    super(MultiCoilCSMRIForward, self).__init__()
+    self.sens_maps = torch.as_tensor(sens_maps).float()
+    self.num_coils = len(self.sens_maps)
+    self.coil_chunk = coil_chunk or self.num_coils
+    self._maps = {}
+
+  def maps(self, device):
+    if device not in self._maps:
+      self._maps[device] = self.sens_maps.to(device)
+    return self._maps[device]
+
+  def __call__(self, fullysampled, mask=None):
+    '''Generate under-sampled multi-coil k-space data.
+
+    Args:
+      fullysampled: Clean image in image space (N, n_ch, l, w)
+      mask: Stack of masks (N, 1, l, w)
+
+    Returns:
+      Multi-coil k-space (N, num_coils, 2, l, w)
+    '''
+    x = fullysampled
+    if x.shape[1] == 1:
+      x = torch.cat((x, torch.zeros_like(x)), dim=1)
+    n, _, l, w = x.shape
+    maps = self.maps(x.device)
+    out = x.new_empty(n, self.num_coils, 2, l, w)
+    for c in range(0, self.num_coils, self.coil_chunk):
+      coil_imgs = complex_mul(x[:, None], maps[None, c:c+self.coil_chunk])
+      k = coil_imgs.shape[1]
+      ksp = fft(coil_imgs.reshape(n * k, 2, l, w)).view(n, k, 2, l, w)
+      if mask is not None:
+        ksp = ksp * mask[:, None]
+      out[:, c:c+k] = ksp
+    return out
+
+  def adjoint(self, ksp):
+    '''Coil-combined zero-filled image (N, 2, l, w) from k-space (N, num_coils, 2, l, w).'''
+    n, _, _, l, w = ksp.shape
+    maps = self.maps(ksp.device)
+    out = 0
+    for c in range(0, self.num_coils, self.coil_chunk):
+      k = min(self.coil_chunk, self.num_coils - c)
+      coil_imgs = ifft(ksp[:, c:c+k].reshape(n * k, 2, l, w)).view(n, k, 2, l, w)
+      out = out + complex_mul(coil_imgs, maps[None, c:c+k], conj_b=True).sum(dim=1)
+    return out
   
 class SuperresolutionForward(BaseForward):
-  '''Forward model for super-resolution.'''
+  '''Forward model for super-resolution.
+
+  Bicubic downsampling by an integer factor followed by nearest upsampling,
+  as a strided convolution and a transposed convolution. Bicubic
+  downsampling (align_corners=False) reads clamped indices, which is
+  replicate padding of the input, so the convolution is exact at the
+  borders too. Kernels and padding indices are precomputed once per
+  (size, device) by each instance.
+  '''
   def __init__(self, factor):
     super(SuperresolutionForward, self).__init__()
-    self.factor = float(1/int(factor))
+    self.scale = int(factor)
+    self._cache = {}
+    self._norms = {}
+
+  def operator(self, size, device):
+    key = (tuple(size), device)
+    if key not in self._cache:
+      taps, offset = bicubic_taps(self.scale)
+      kernel = (taps[:, None] * taps[None, :])[None, None].to(device)
+      idx = [pad_indices(n, self.scale, len(taps), offset).to(device) for n in size]
+      up_kernel = torch.ones(1, 1, self.scale, self.scale, device=device)
+      self._cache[key] = (kernel, idx, up_kernel)
+    return self._cache[key]
+
+  def downsample(self, x):
+    n, c, l, w = x.shape
+    kernel, (idx_l, idx_w), _ = self.operator((l, w), x.device)
+    x = x.reshape(n * c, 1, l, w).index_select(2, idx_l).index_select(3, idx_w)
+    x = F.conv2d(x, kernel, stride=self.scale)
+    return x.view(n, c, x.shape[-2], x.shape[-1])
+
+  def upsample(self, x, size):
+    n, c, l, w = x.shape
+    _, _, up_kernel = self.operator(size, x.device)
+    x = F.conv_transpose2d(x.reshape(n * c, 1, l, w), up_kernel, stride=self.scale)
+    return x.view(n, c, *size)
 
   def __call__(self, x, *args):
     '''Downsample input.
-    
+
     Args:
       x: Clean image in image space (N, n_ch, l, w)
     '''
     del args
-    x_down = F.interpolate(x, scale_factor=self.factor, mode='bicubic', align_corners=False) 
-    x_down = F.upsample(x_down, scale_factor=int(1/self.factor), mode='nearest')
-    x_down = torch.cat((x_down, torch.zeros_like(x_down)), dim=1)
-    return x_down
+    return self.upsample(self.downsample(x), x.shape[-2:])
+
+  def adjoint(self, y):
+    '''Adjoint of the forward model, for images (N, n_ch, l, w).'''
+    n, c, l, w = y.shape
+    kernel, (idx_l, idx_w), up_kernel = self.operator((l, w), y.device)
+    y = F.conv2d(y.reshape(n * c, 1, l, w), up_kernel, stride=self.scale)
+    y = F.conv_transpose2d(y, kernel, stride=self.scale)
+    # Adjoint of index_select sums padded values back into their source pixels
+    y = y.new_zeros(n * c, 1, len(idx_l), w).index_add_(3, idx_w, y)
+    y = y.new_zeros(n * c, 1, l, w).index_add_(2, idx_l, y)
+    return y.view(n, c, l, w)
+
+  def norm_squared(self, size, device, num_iters=30):
+    '''Largest eigenvalue of A^T A for images of size, by power iteration.'''
+    key = (tuple(size), device)
+    if key not in self._norms:
+      x = torch.rand(1, 1, *size, device=device)
+      for _ in range(num_iters):
+        x = self.adjoint(self(x))
+        value = x.norm()
+        x = x / value
+      self._norms[key] = value.item()
+    return self._norms[key]
+
+  def data_consistency(self, x, y, num_iters=10):
+    '''Move reconstructions x towards consistency with measurements y = A x_true,
+    by gradient steps on ||A x - y||^2 of step size 1 / ||A||^2.'''
+    step = 1. / self.norm_squared(x.shape[-2:], x.device)
+    for _ in range(num_iters):
+      x = x - step * self.adjoint(self(x) - y)
+    return x
+
+def bicubic_taps(scale):
+  '''1D taps of bicubic downsampling by scale, and offset of the first tap
+  of output i from input i * scale.'''
+  n = 8 * scale
+  # Rows of the downsampling matrix, by interpolating unit impulses
+  basis = torch.eye(n).view(n, 1, 1, n)
+  mat = F.interpolate(basis, size=(1, n // scale), mode='bicubic', align_corners=False)
+  row = mat.view(n, n // scale)[:, 4]
+  nonzero = torch.nonzero(row).flatten()
+  first, last = nonzero[0].item(), nonzero[-1].item()
+  return row[first:last+1].clone(), first - 4 * scale
+
+def pad_indices(size, scale, num_taps, offset):
+  '''Source indices, clamped to the image, of the padded input of a strided convolution.'''
+  assert size % scale == 0, 'Image size must be divisible by the superresolution factor'
+  length = (size // scale - 1) * scale + num_taps
+  return torch.arange(offset, offset + length).clamp(0, size - 1)
 
 class DenoisingForward(BaseForward):
   '''Forward model for de-noising.'''
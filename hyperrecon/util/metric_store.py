@@ -0,0 +1,95 @@
+"""
+Append-only metric storage.
+
+Each epoch appends one JSON line holding the latest value of every metric,
+val metric and monitor key, instead of rewriting the full history of every
+key to its own text file. Lines are buffered and flushed in blocks.
+"""
+import os
+import json
+import numpy as np
+
+METRICS_FILE = 'metrics.jsonl'
+
+
+class MetricWriter(object):
+  '''Buffered append-only writer of per-epoch metric records.
+
+  Args:
+    path: Path to jsonl file, appended to if it exists
+    flush_every: Number of records to buffer before writing
+  '''
+  def __init__(self, path, flush_every=10):
+    self.path = path
+    self.flush_every = flush_every
+    self.buffer = []
+
+  def append(self, epoch, *loggers):
+    '''Append latest value of every key in loggers as one record.'''
+    record = {'epoch': epoch}
+    for logger in loggers:
+      for key, vals in logger.items():
+        if len(vals) > 0:
+          record[key] = float(vals[-1])
+    self.buffer.append(json.dumps(record))
+    if len(self.buffer) >= self.flush_every:
+      self.flush()
+
+  def flush(self):
+    if len(self.buffer) == 0:
+      return
+    with open(self.path, 'a') as f:
+      f.write('\n'.join(self.buffer) + '\n')
+    self.buffer = []
+
+  def close(self):
+    self.flush()
+
+
+def read_metrics(path, keys=None):
+  '''Read metric file into dict of key -> array ordered by epoch.
+
+  Records are deduplicated by epoch, later records win. This happens when a
+  run resumes from a checkpoint older than its last written record.
+
+  Args:
+    path: Path to jsonl file
+    keys: Keys to load, defaults to all
+  '''
+  records = {}
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        record = json.loads(line)
+      except ValueError:
+        # Partial last line from an interrupted write
+        continue
+      records[record['epoch']] = record
+
+  epochs = sorted(records.keys())
+  if keys is None:
+    keys = sorted(set(k for r in records.values() for k in r.keys()) - {'epoch'})
+  metrics = {'epoch': np.array(epochs)}
+  for key in keys:
+    metrics[key] = np.array([records[e].get(key, np.nan) for e in epochs], dtype=float)
+  return metrics
+
+def load_runs(run_dirs, keys=None):
+  '''Load metrics of many runs for comparison.
+
+  Args:
+    run_dirs: List of run directories
+    keys: Keys to load, defaults to all
+
+  Returns:
+    Dict of run_dir -> dict of key -> array. Runs without metrics are skipped.
+  '''
+  runs = {}
+  for run_dir in run_dirs:
+    path = os.path.join(run_dir, 'metrics', METRICS_FILE)
+    if os.path.exists(path):
+      runs[run_dir] = read_metrics(path, keys)
+  return runs
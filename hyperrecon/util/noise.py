@@ -1,40 +1,91 @@
-import numpy as np
 import torch
 
-class AdditiveGaussianNoise(object):
-  def __init__(self, image_dims, mean=0., std=1., fixed=False):
+class BaseNoise(object):
+  '''Noise generated on the device of its input, from a seeded generator per device.
+
+  Args:
+    seed: Seed of the generators, default torch.initial_seed()
+  '''
+  def __init__(self, seed=None):
+    self.seed = torch.initial_seed() if seed is None else seed
+    self.generators = {}
+
+  def generator(self, device):
+    if device not in self.generators:
+      generator = torch.Generator(device=device)
+      generator.manual_seed(self.seed)
+      self.generators[device] = generator
+    return self.generators[device]
+
+  def normal(self, shape, like, mean=0., std=1.):
+    '''Normal noise of shape, with the device and dtype of like, generated in place.'''
+    out = torch.empty(shape, dtype=like.dtype, device=like.device)
+    return out.normal_(mean, std, generator=self.generator(like.device))
+
+  def uniform(self, shape, like, low=0., high=1.):
+    out = torch.empty(shape, dtype=like.dtype, device=like.device)
+    return out.uniform_(low, high, generator=self.generator(like.device))
+
+class AdditiveGaussianNoise(BaseNoise):
+  '''Additive Gaussian noise.
+
+  With fixed, a single noise image of image_dims is drawn once per device
+  and added to every image.
+  '''
+  def __init__(self, image_dims, mean=0., std=1., fixed=False, seed=None):
+    super(AdditiveGaussianNoise, self).__init__(seed)
+    self.image_dims = tuple(image_dims)
     self.std = std
     self.mean = mean
     self.fixed = fixed
-    if fixed:
-      self.noise = torch.normal(mean, std, size=image_dims).cuda()
+    self.fixed_noise = {}
 
   def __call__(self, img):
+    if self.std == 0 and self.mean == 0:
+      return img
     if self.fixed:
-      noise = self.noise
-    else:
-      noise = torch.normal(self.mean, self.std, size=img.shape).cuda()
-    return img + noise
-    
-class RicianNoise(object):
-  def __init__(self, img_dims, snr=5, mean=0., std=1., fixed=False):
+      if img.device not in self.fixed_noise:
+        self.fixed_noise[img.device] = self.normal(self.image_dims, img, self.mean, self.std)
+      return img + self.fixed_noise[img.device]
+    noise = self.normal(img.shape, img, self.mean, self.std)
+    return noise.add_(img)
+
+class RicianNoise(BaseNoise):
+  '''Rician noise on a batch of magnitude images (N, n_ch, l, w).
+
+  Real and imaginary Gaussian noise with std level = snr * max(img) / 100 per
+  sample is added to the image, and the magnitude is returned.
+
+  Args:
+    snr: Noise level in percent of the maximum intensity, or a range
+      (low, high) from which the level of each sample is drawn uniformly
+    fixed: Whether to draw one pair of noise images of img_dims once per
+      device, added to every image
+  '''
+  def __init__(self, img_dims, snr=5, mean=0., std=1., fixed=False, seed=None):
+    super(RicianNoise, self).__init__(seed)
+    self.img_dims = tuple(img_dims)
     self.snr = snr
     self.mean = mean
     self.std = std
     self.fixed = fixed
-    if fixed:
-      self.x_noise = np.random.normal(self.mean, self.std, size=img_dims)
-      self.y_noise = np.random.normal(self.mean, self.std, size=img_dims)
-  
+    self.fixed_noise = {}
+
+  def sample_snr(self, img):
+    if isinstance(self.snr, (list, tuple)):
+      return self.uniform((len(img),), img, *self.snr)
+    return self.snr
+
   def __call__(self, img):
-    level = self.snr * np.max(img) / 100
+    level = self.sample_snr(img) * img.flatten(1).max(dim=1)[0] / 100
+    level = level.view(-1, *([1] * (img.dim() - 1)))
     if self.fixed:
-      x_noise = self.x_noise
-      y_noise = self.y_noise
+      if img.device not in self.fixed_noise:
+        self.fixed_noise[img.device] = self.normal((2,) + self.img_dims, img, self.mean, self.std)
+      x_noise, y_noise = self.fixed_noise[img.device]
+      x = img + level * x_noise
+      y = level * y_noise
     else:
-      x_noise = np.random.normal(self.mean, self.std, size=img.shape)
-      y_noise = np.random.normal(self.mean, self.std, size=img.shape)
-
-    x = level * x_noise + img
-    y = level * y_noise
-    return np.sqrt(x**2 + y**2)
\ No newline at end of file
+      x = self.normal(img.shape, img, self.mean, self.std).mul_(level).add_(img)
+      y = self.normal(img.shape, img, self.mean, self.std).mul_(level)
+    return x.pow_(2).add_(y.pow_(2)).sqrt_()
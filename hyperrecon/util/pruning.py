@@ -0,0 +1,91 @@
+"""
+Early stopping of underperforming runs in a sweep.
+
+Runs report a validation score at fixed epoch milestones to a state file shared
+by all runs of a sweep. The policy decides from the scores reported so far at
+the same milestone whether the run continues. Decisions are asynchronous, so
+runs never wait for each other and a stopped run immediately frees its worker
+for the next queued configuration.
+"""
+import os
+import json
+import fcntl
+import math
+import numpy as np
+
+
+def score_from_metrics(val_metrics, prefix='psnr:val:'):
+  '''Mean of the latest value of every val metric starting with prefix.'''
+  vals = [v[-1] for k, v in val_metrics.items() if k.startswith(prefix) and len(v) > 0]
+  if len(vals) == 0:
+    return None
+  return float(np.mean(vals))
+
+
+class BasePruner(object):
+  '''Base pruning policy.
+
+  Args:
+    state_dir: Directory shared by all runs of a sweep
+    milestones: Epochs at which runs are compared
+  '''
+  def __init__(self, state_dir, milestones):
+    self.state_path = os.path.join(state_dir, 'pruner.json')
+    self.milestones = sorted(int(m) for m in milestones)
+
+  def report(self, trial_id, epoch, score):
+    '''Record score of run trial_id at epoch. Returns True if the run should stop.'''
+    if epoch not in self.milestones or score is None:
+      return False
+    with open(self.state_path + '.lock', 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        state = self._load()
+        rung = state.setdefault(str(epoch), {})
+        rung[trial_id] = score
+        self._save(state)
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return self.should_stop(score, [s for r, s in rung.items() if r != trial_id])
+
+  def should_stop(self, score, others):
+    '''Decide from score of this run and scores of other runs at the same milestone.'''
+    raise NotImplementedError
+
+  def _load(self):
+    if os.path.exists(self.state_path):
+      with open(self.state_path) as f:
+        return json.load(f)
+    return {}
+
+  def _save(self, state):
+    tmp = self.state_path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(state, f, indent=4)
+    os.replace(tmp, self.state_path)
+
+class SuccessiveHalving(BasePruner):
+  '''Asynchronous successive halving.
+
+  At each milestone, a run continues only if it is in the top 1/eta of all
+  runs which have reached that milestone so far.
+  '''
+  def __init__(self, state_dir, milestones, eta=2):
+    super(SuccessiveHalving, self).__init__(state_dir, milestones)
+    self.eta = eta
+
+  def should_stop(self, score, others):
+    num_keep = int(math.ceil((len(others) + 1) / self.eta))
+    rank = sum(s > score for s in others)
+    return rank >= num_keep
+
+class MedianStopping(BasePruner):
+  '''Stop a run if its score is below the median of other runs at a milestone.'''
+  def __init__(self, state_dir, milestones, min_runs=3):
+    super(MedianStopping, self).__init__(state_dir, milestones)
+    self.min_runs = min_runs
+
+  def should_stop(self, score, others):
+    if len(others) < self.min_runs:
+      return False
+    return score < np.median(others)
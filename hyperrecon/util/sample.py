@@ -1,6 +1,5 @@
 import torch
-import random
-import numpy as np
+from hyperrecon.util import distributed
 
 class Uniform():
   def __init__(self, r1=0, r2=1):
@@ -10,20 +9,128 @@ class Uniform():
     return torch.FloatTensor(*size).uniform_(self.r1, self.r2)
 
 class UniformOversample():
-  '''Sample a random hyperparameter. Over-samples 0 and 1.
-  Only supports 1d hyperparameter sampling.
+  '''Sample random hyperparameters. Over-samples 0 and 1.
+
+  Each hyperparameter is independently 0 or 1 with probability p_end each,
+  and uniform in [r1, r2] otherwise.
   '''
   def __init__(self, r1=0, r2=1, p_end=0):
     self.r1 = r1
     self.r2 = r2
     self.p_end = p_end
-    
-  def random_hyperparam(self):
-    rand = random.uniform(self.r1, self.r2)
-    return np.random.choice([0.0, 1.0, rand], p=[self.p_end, self.p_end, 1-2*self.p_end])
+
+  def __call__(self, size):
+    choice = torch.rand(*size)
+    samples = torch.FloatTensor(*size).uniform_(self.r1, self.r2)
+    samples[choice < 2 * self.p_end] = 1.
+    samples[choice < self.p_end] = 0.
+    return samples
+
+class Sobol():
+  '''Scrambled Sobol sequence in [r1, r2]^d.
+
+  The sequence continues across calls, so hyperparameters of consecutive
+  batches together cover the space evenly.
+  '''
+  def __init__(self, r1=0, r2=1, seed=None):
+    self.r1 = r1
+    self.r2 = r2
+    self.seed = seed
+    self.engine = None
+
+  def __call__(self, size):
+    if self.engine is None:
+      self.engine = torch.quasirandom.SobolEngine(size[1], scramble=True, seed=self.seed)
+    return self.r1 + (self.r2 - self.r1) * self.engine.draw(size[0]).float()
+
+class Stratified():
+  '''Latin hypercube sample per batch in [r1, r2]^d.
+
+  Along each hyperparameter, every one of size[0] equal strata holds
+  exactly one sample of the batch.
+  '''
+  def __init__(self, r1=0, r2=1):
+    self.r1 = r1
+    self.r2 = r2
+
+  def __call__(self, size):
+    n, d = size
+    strata = torch.stack([torch.randperm(n) for _ in range(d)], dim=1).float()
+    unit = (strata + torch.rand(n, d)) / n
+    return self.r1 + (self.r2 - self.r1) * unit
+
+class Adaptive():
+  '''Importance sampling of hyperparameters towards regions of high loss.
+
+  [r1, r2]^d is split into bins^d regions, each with a running estimate
+  (exponential moving average) of the per-sample training loss. Regions are
+  drawn with probability proportional to their estimate, mixed with a
+  uniform floor, and samples are uniform within a region. weights() returns
+  the importance weights u(h) / p(h), so weighted losses are unbiased
+  estimates of the loss under uniform sampling.
+
+  Args:
+    bins: Number of bins per hyperparameter
+    smoothing: Weight of the newest batch in the running estimates
+    floor: Weight of the uniform distribution in the mixture, in (0, 1]
+  '''
+  def __init__(self, r1=0, r2=1, bins=8, smoothing=0.1, floor=0.2):
+    self.r1 = r1
+    self.r2 = r2
+    self.bins = bins
+    self.smoothing = smoothing
+    self.floor = floor
+    self.estimate = None
+    self.initialized = False
+
+  def probs(self):
+    p = self.estimate / self.estimate.sum()
+    return (1 - self.floor) * p + self.floor / len(self.estimate)
+
+  def region(self, samples):
+    unit = ((samples - self.r1) / (self.r2 - self.r1)).clamp(0, 1 - 1e-6)
+    idx = (unit * self.bins).long()
+    strides = self.bins ** torch.arange(samples.shape[1])
+    return (idx * strides).sum(dim=1)
+
   def __call__(self, size):
-    batch_samp = [self.random_hyperparam() for _ in range(size[0])]
-    return torch.tensor(batch_samp).reshape(*size).float()
+    n, d = size
+    if self.estimate is None:
+      self.estimate = torch.ones(self.bins ** d)
+    regions = torch.multinomial(self.probs(), n, replacement=True)
+    idx = torch.stack([(regions // self.bins ** k) % self.bins for k in range(d)], dim=1)
+    unit = (idx.float() + torch.rand(n, d)) / self.bins
+    return self.r1 + (self.r2 - self.r1) * unit
+
+  def weights(self, samples):
+    '''Importance weights of samples, with mean 1 under the current distribution.'''
+    return 1. / (len(self.estimate) * self.probs()[self.region(samples)])
+
+  def update(self, samples, losses):
+    '''Update running loss estimates of the regions of samples.
+
+    In distributed training, per-region sums and counts are reduced over all
+    ranks, so that every rank keeps the same estimates.
+    '''
+    regions = self.region(samples.cpu())
+    losses = losses.detach().float().cpu().clamp(min=1e-8)
+    total = torch.zeros_like(self.estimate).index_add_(0, regions, losses)
+    count = torch.zeros_like(self.estimate).index_add_(0, regions, torch.ones_like(losses))
+    total, count = distributed.all_reduce_sum(torch.stack([total, count]))
+    if not self.initialized:
+      # Unvisited regions start from the mean loss, so they are neither favoured nor avoided
+      self.estimate.fill_((total.sum() / count.sum()).item())
+      self.initialized = True
+    seen = count > 0
+    self.estimate[seen] = (1 - self.smoothing) * self.estimate[seen] \
+      + self.smoothing * total[seen] / count[seen]
+
+  def state_dict(self):
+    return {'estimate': self.estimate}
+
+  def load_state_dict(self, state):
+    self.estimate = state['estimate']
+    self.initialized = True
 
 class Constant():
   def __init__(self, value):
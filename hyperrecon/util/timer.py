@@ -0,0 +1,57 @@
+"""
+Low-overhead per-stage timers for training and evaluation.
+
+Durations of each named stage are collected over an epoch and summarized as
+percentiles. Without synchronization, CUDA stages measure host-side launch
+time only; pass sync=True for device time at the cost of a sync per stage.
+"""
+import time
+import contextlib
+import numpy as np
+import torch
+
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer(object):
+  '''Collects durations of named stages.
+
+  Args:
+    enabled: If False, timing contexts are no-ops
+    sync: Synchronize CUDA before reading the clock
+  '''
+  def __init__(self, enabled=True, sync=False):
+    self.enabled = enabled
+    self.sync = sync and torch.cuda.is_available()
+    self.times = {}
+
+  def _now(self):
+    if self.sync:
+      torch.cuda.synchronize()
+    return time.perf_counter()
+
+  @contextlib.contextmanager
+  def __call__(self, name):
+    if not self.enabled:
+      yield
+      return
+    start = self._now()
+    try:
+      yield
+    finally:
+      self.record(name, self._now() - start)
+
+  def record(self, name, seconds):
+    if self.enabled:
+      self.times.setdefault(name, []).append(seconds)
+
+  def reset(self):
+    self.times = {}
+
+  def summarize(self, prefix='time:'):
+    '''Percentiles of every stage, keyed as {prefix}{stage}:p{q}.'''
+    summary = {}
+    for name, vals in self.times.items():
+      for q, v in zip(PERCENTILES, np.percentile(vals, PERCENTILES)):
+        summary['{}{}:p{}'.format(prefix, name, q)] = float(v)
+    return summary
@@ -6,15 +6,23 @@ from tqdm import tqdm
 import random
 
 from hyperrecon.util import utils
+from hyperrecon.util import distributed
+from hyperrecon.util import checkpoint
+from hyperrecon.util.metric_store import MetricWriter, METRICS_FILE
+from hyperrecon.util.timer import StageTimer
 from hyperrecon.loss.losses import compose_loss_seq
 from hyperrecon.util.metric import bhfen
 from hyperrecon.loss import loss_ops
 from hyperrecon.model.unet import Unet, HyperUnet
-from hyperrecon.util.forward import CSMRIForward, DenoisingForward, SuperresolutionForward
-from hyperrecon.util.noise import AdditiveGaussianNoise
-from hyperrecon.data.mask import VDSPoisson
+from hyperrecon.model.layers import WeightCollector
+from hyperrecon.util.forward import num_input_channels, CSMRIForward, MultiCoilCSMRIForward, DenoisingForward, SuperresolutionForward
+from hyperrecon.util.noise import AdditiveGaussianNoise, RicianNoise
+from hyperrecon.data.mask import VDSPoisson, VDSRandom
 from hyperrecon.data.arr import Arr
-from hyperrecon.util.sample import Uniform, UniformOversample, Constant
+from hyperrecon.data.phantom import Phantom, sensitivity_maps
+from hyperrecon.data import shared
+from hyperrecon.util.sample import Uniform, UniformOversample, Sobol, Stratified, Adaptive, Constant
+from hyperrecon.util.pruning import SuccessiveHalving, MedianStopping, score_from_metrics
 
 
 class BaseTrain(object):
@@ -29,10 +37,22 @@ class BaseTrain(object):
     self.num_hparams = len(self.loss_list) - 1 if self.range_restrict else len(self.loss_list)
     self.num_coeffs = len(self.loss_list)
     self.additive_gauss_std = args.additive_gauss_std
+    self.noise_type = args.noise_type
+    self.rician_snr = args.rician_snr
     self.unet_residual = args.unet_residual
     self.forward_type = args.forward_type
+    self.num_coils = args.num_coils
+    self.sens_maps = args.sens_maps
+    self.coil_chunk = args.coil_chunk
     self.distribution = args.distribution
     self.uniform_bounds = args.uniform_bounds
+    self.adaptive_bins = args.adaptive_bins
+    self.adaptive_smoothing = args.adaptive_smoothing
+    self.adaptive_floor = args.adaptive_floor
+    self.train_path = args.train_path
+    self.test_path = args.test_path
+    self.dataset = args.dataset
+    self.num_phantoms = args.num_phantoms
     # ML
     self.image_dims = args.image_dims
     self.num_epochs = args.num_epochs
@@ -43,7 +63,7 @@ class BaseTrain(object):
     self.arch = args.arch
     self.hnet_hdim = args.hnet_hdim
     self.unet_hdim = args.unet_hdim
-    self.n_ch_in = 2
+    self.n_ch_in = num_input_channels(self.forward_type)
     self.n_ch_out = args.n_ch_out
     self.scheduler_step_size = args.scheduler_step_size
     self.scheduler_gamma = args.scheduler_gamma
@@ -53,8 +73,27 @@ class BaseTrain(object):
     # I/O
     self.run_dir = args.run_dir
     self.log_interval = args.log_interval
+    self.ckpt_keep_last = args.ckpt_keep_last
+    self.ckpt_best_metric = args.ckpt_best_metric
+    self.ckpt_best_mode = args.ckpt_best_mode
+    self.resume = args.resume
+    self.metrics_flush_every = args.metrics_flush_every
+    self.stage_timing = args.stage_timing
+    self.profile_steps = set(args.profile_steps)
+    self.prune_policy = args.prune_policy
+    self.prune_dir = args.prune_dir
+    self.prune_milestones = args.prune_milestones
+    self.prune_eta = args.prune_eta
+    self.trial_id = args.trial_id if args.trial_id is not None else args.run_dir
     self.fixed_noise = True if self.num_epochs == 0 else False
     self.device = args.device
+    # Distributed
+    self.world_size = args.world_size
+    self.rank = getattr(args, 'rank', 0)
+    self.is_main = self.rank == 0
+
+    self.timer = StageTimer(enabled=self.stage_timing != 'off',
+                            sync=self.stage_timing == 'sync')
 
     self.set_eval_hparams()
     self.set_monitor()
@@ -66,12 +105,8 @@ class BaseTrain(object):
       self.val_hparams = self.hyperparameters
       self.test_hparams = self.hyperparameters
     else:
-      if self.num_hparams == 1:
-        self.val_hparams = torch.tensor([0., 1.]).view(-1, 1)
-      elif self.num_hparams == 2:
-        self.val_hparams = torch.tensor([[0.,0.], [1.,1.]])
-      else:
-        raise NotImplementedError()
+      # Corners of the hyperparameter space; see landscape.py for dense evaluation
+      self.val_hparams = torch.stack([torch.zeros(self.num_hparams), torch.ones(self.num_hparams)])
 
   def set_monitor(self):
     self.list_of_monitor = [
@@ -91,7 +126,9 @@ class BaseTrain(object):
     ]
 
   def set_random_seed(self):
-    seed = self.seed
+    # Offset by rank so that each process samples different hyperparameters.
+    # Network weights are kept identical by broadcasting from rank 0.
+    seed = self.seed + self.rank if self.seed > 0 else 0
     if seed > 0:
       random.seed(seed)
       np.random.seed(seed)
@@ -108,9 +145,11 @@ class BaseTrain(object):
     self.noise_model = self.get_noise_model()
 
     self.network = self.get_model()
+    distributed.broadcast_parameters(self.network)
     self.optimizer = self.get_optimizer()
     self.scheduler = self.get_scheduler()
     self.losses = compose_loss_seq(self.loss_list, self.forward_model, self.mask_model, self.device)
+    self.pruner = self.get_pruner()
 
   def get_per_loss_scale_constants(self):
     # Constants for mean losses on test sets.
@@ -120,10 +159,18 @@ class BaseTrain(object):
     return scales
 
   def get_noise_model(self):
-    return AdditiveGaussianNoise(self.image_dims, std=self.additive_gauss_std, fixed=self.fixed_noise)
+    seed = self.seed + self.rank if self.seed > 0 else None
+    if self.noise_type == 'rician':
+      snr = self.rician_snr[0] if len(self.rician_snr) == 1 else tuple(self.rician_snr)
+      return RicianNoise(self.image_dims, snr=snr, fixed=self.fixed_noise, seed=seed)
+    return AdditiveGaussianNoise(self.image_dims, std=self.additive_gauss_std,
+                                 fixed=self.fixed_noise, seed=seed)
 
   def get_mask(self):
-    mask = VDSPoisson(self.image_dims, self.undersampling_rate)
+    if self.mask_type == 'vds':
+      mask = VDSRandom(self.image_dims, self.undersampling_rate, seed=self.seed)
+    else:
+      mask = VDSPoisson(self.image_dims, self.undersampling_rate)
     return mask
 
   def get_sampler(self):
@@ -131,12 +178,25 @@ class BaseTrain(object):
       sampler = Uniform(*self.uniform_bounds)
     elif self.distribution == 'uniform_oversample':
       sampler = UniformOversample(*self.uniform_bounds)
+    elif self.distribution == 'sobol':
+      # Distinct scrambles per rank
+      sampler = Sobol(*self.uniform_bounds, seed=self.seed + self.rank)
+    elif self.distribution == 'stratified':
+      sampler = Stratified(*self.uniform_bounds)
+    elif self.distribution == 'adaptive':
+      sampler = Adaptive(*self.uniform_bounds, bins=self.adaptive_bins,
+                         smoothing=self.adaptive_smoothing, floor=self.adaptive_floor)
     elif self.distribution == 'constant':
       sampler = Constant(self.hyperparameters)
     return sampler
 
   def get_dataloader(self):
-    dataset = Arr(self.batch_size)
+    if self.dataset == 'phantom':
+      dataset = Phantom(self.batch_size, self.image_dims, *self.num_phantoms,
+                        seed=self.seed, num_replicas=self.world_size, rank=self.rank)
+    else:
+      dataset = Arr(self.batch_size, self.train_path, self.test_path,
+                    num_replicas=self.world_size, rank=self.rank)
     self.train_loader, self.val_loader = dataset.load()
 
   def get_model(self):
@@ -156,11 +216,13 @@ class BaseTrain(object):
                         out_ch_main=self.n_ch_out,
                         h_ch_main=self.unet_hdim,
                         residual=self.unet_residual,
-                        use_batchnorm=self.use_batchnorm
+                        use_batchnorm=self.use_batchnorm,
+                        store_weights=False
                       ).to(self.device)
     else:
       raise ValueError('No architecture found')
-    utils.summary(self.network)
+    if self.is_main:
+      utils.summary(self.network)
     return self.network
 
   def get_optimizer(self):
@@ -174,8 +236,22 @@ class BaseTrain(object):
                          step_size=self.scheduler_step_size,
                          gamma=self.scheduler_gamma)
 
+  def get_pruner(self):
+    if self.prune_policy == 'successive_halving':
+      return SuccessiveHalving(self.prune_dir, self.prune_milestones, eta=self.prune_eta)
+    elif self.prune_policy == 'median':
+      return MedianStopping(self.prune_dir, self.prune_milestones)
+    return None
+
   def get_forward_model(self):
-    if self.forward_type == 'csmri':
+    if self.forward_type == 'csmri' and self.num_coils > 1:
+      if self.sens_maps is not None:
+        sens_maps = shared.load(self.sens_maps)
+      else:
+        sens_maps = sensitivity_maps(self.num_coils, self.image_dims, seed=self.seed)
+      assert len(sens_maps) == self.num_coils, 'Sensitivity maps must have num_coils coils'
+      self.forward_model = MultiCoilCSMRIForward(sens_maps, self.coil_chunk)
+    elif self.forward_type == 'csmri':
       self.forward_model = CSMRIForward()
     elif self.forward_type == 'superresolution':
       self.forward_model = SuperresolutionForward(self.undersampling_rate)
@@ -186,18 +262,36 @@ class BaseTrain(object):
   def train(self):
     self.train_begin()
     self.epoch = 0
+    self.global_step = 0
+    self.stopped_early = False
     if self.num_epochs == 0:
       self.train_epoch_begin()
       self.train_epoch_end(is_val=False, save_metrics=False, save_ckpt=False)
     else:
-      for epoch in range(0, self.num_epochs+1):
+      start_epoch = self.resume_from_checkpoint() + 1 if self.resume else 0
+      trained = False
+      for epoch in range(start_epoch, self.num_epochs+1):
         self.epoch = epoch
+        trained = True
 
         self.train_epoch_begin()
         self.train_epoch()
         self.train_epoch_end(is_val=True, save_metrics=True, save_ckpt=(
           self.epoch % self.log_interval == 0))
-      self.train_epoch_end(is_val=False, save_metrics=True, save_ckpt=True)
+        if self.should_stop():
+          print('Stopping early at epoch', self.epoch)
+          self.stopped_early = True
+          break
+      # Nothing to save if a finished run was resumed
+      if trained:
+        self.train_epoch_end(is_val=False, save_metrics=True, save_ckpt=True)
+    self.train_end()
+
+  def train_end(self):
+    if self.ckpt_writer is not None:
+      self.ckpt_writer.close()
+    if self.metric_writer is not None:
+      self.metric_writer.close()
 
   def train_begin(self):
     # Logging
@@ -219,31 +313,99 @@ class BaseTrain(object):
     self.metric_dir = os.path.join(self.run_dir, 'metrics')
     if not os.path.exists(self.metric_dir):
       os.makedirs(self.metric_dir)
-    self.monitor_dir = os.path.join(self.run_dir, 'monitor')
-    if not os.path.exists(self.monitor_dir):
-      os.makedirs(self.monitor_dir)
     self.img_dir = os.path.join(self.run_dir, 'img')
     if not os.path.exists(self.img_dir):
       os.makedirs(self.img_dir)
+    self.profile_dir = os.path.join(self.run_dir, 'profile')
+
+    self.ckpt_writer = None
+    self.metric_writer = None
+    if self.is_main:
+      self.ckpt_writer = checkpoint.CheckpointWriter(self.ckpt_dir,
+                            keep_last=self.ckpt_keep_last, mode=self.ckpt_best_mode)
+      self.metric_writer = MetricWriter(os.path.join(self.metric_dir, METRICS_FILE),
+                            flush_every=self.metrics_flush_every)
 
   def train_epoch_begin(self):
     print('\nEpoch %d/%d' % (self.epoch, self.num_epochs))
     print('Learning rate:', self.scheduler.get_last_lr())
 
   def train_epoch_end(self, is_val=True, save_metrics=False, save_ckpt=False):
-    '''Save loss and checkpoints. Evaluate if necessary.'''
+    '''Save loss and checkpoints. Evaluate if necessary.
+
+    In distributed mode, only rank 0 evaluates and writes to disk, with
+    BatchNorm statistics of rank 0 shared by all ranks.
+    '''
+    distributed.broadcast_buffers(self.network)
+    if not self.is_main:
+      return
     self.eval_epoch(is_val)
 
     if save_metrics:
-      utils.save_metrics(self.metric_dir, self.metrics, *self.list_of_metrics)
-      utils.save_metrics(self.metric_dir, self.val_metrics,
-                *self.list_of_val_metrics)
-      utils.save_metrics(self.monitor_dir, self.monitor, *self.list_of_monitor)
+      self.metric_writer.append(self.epoch, self.metrics, self.val_metrics, self.monitor)
     if save_ckpt:
-      utils.save_checkpoint(self.epoch, self.network, self.optimizer,
-                  self.ckpt_dir, self.scheduler)
+      self.save_checkpoint()
+
+  def get_checkpoint_state(self):
+    return {
+      'epoch': self.epoch,
+      'global_step': self.global_step,
+      'state_dict': self.network.state_dict(),
+      'optimizer': self.optimizer.state_dict(),
+      'scheduler': self.scheduler.state_dict(),
+      'rng': checkpoint.get_rng_state(),
+      'metrics': self.metrics,
+      'val_metrics': self.val_metrics,
+      'monitor': self.monitor,
+      'sampler': self.sampler.state_dict() if hasattr(self.sampler, 'state_dict') else None,
+    }
+
+  def save_checkpoint(self):
+    '''Queue checkpoint for the background writer.'''
+    if self.ckpt_best_metric in self.val_metrics:
+      vals = self.val_metrics[self.ckpt_best_metric]
+      score = vals[-1] if len(vals) > 0 else None
+    else:
+      score = score_from_metrics(self.val_metrics, prefix=self.ckpt_best_metric)
+    # Metrics on disk should be at least as recent as the checkpoint
+    self.metric_writer.flush()
+    self.ckpt_writer.save(self.epoch, self.get_checkpoint_state(), score=score)
 
-  def compute_loss(self, gt, pred, coeffs, scales):
+  def resume_from_checkpoint(self):
+    '''Restore training state from latest valid checkpoint in ckpt_dir.
+
+    Returns:
+      Epoch of the restored checkpoint, or -1 if none was found
+    '''
+    state = checkpoint.load_latest(self.ckpt_dir)
+    if state is None:
+      return -1
+    print('Resuming from epoch', state['epoch'])
+    self.global_step = state['global_step']
+    self.network.load_state_dict(state['state_dict'])
+    self.optimizer.load_state_dict(state['optimizer'])
+    self.scheduler.load_state_dict(state['scheduler'])
+    if state.get('sampler') is not None:
+      self.sampler.load_state_dict(state['sampler'])
+    for logger, key in [(self.metrics, 'metrics'), (self.val_metrics, 'val_metrics'), (self.monitor, 'monitor')]:
+      logger.update(state.get(key, {}))
+    # RNG state was saved by rank 0, other ranks keep their own streams
+    if self.is_main and 'rng' in state:
+      checkpoint.set_rng_state(state['rng'])
+    return state['epoch']
+
+  def should_stop(self):
+    '''Report validation PSNR to the pruner and decide whether to stop.'''
+    if self.pruner is None:
+      return False
+    stop = False
+    if self.is_main:
+      score = score_from_metrics(self.val_metrics, prefix='psnr:val:')
+      stop = self.pruner.report(self.trial_id, self.epoch, score)
+    # Only rank 0 has validation metrics, so share its decision
+    return distributed.all_reduce_mean(float(stop)) > 0
+
+  def compute_loss(self, gt, pred, coeffs, scales, weights=None):
     '''Compute loss.
 
     Args:
@@ -251,6 +413,7 @@ class BaseTrain(object):
       gt: Ground truths (bs, nch, n1, n2)
       y: Under-sampled k-space (bs, nch, n1, n2)
       coeffs: Loss coefficients (bs, num_losses)
+      weights: Generated weights of the forward pass, see collect_weights
 
     Returns:
       loss: Per-sample loss (bs)
@@ -262,7 +425,8 @@ class BaseTrain(object):
       c = coeffs[:, i]
       per_loss_scale = scales[i]
       l = self.losses[i]
-      loss_dict[self.loss_list[i]] = l(gt, pred, network=self.network)
+      with self.timer('loss:' + self.loss_list[i]):
+        loss_dict[self.loss_list[i]] = l(gt, pred, network=self.network, weights=weights)
       loss += c / per_loss_scale * loss_dict[self.loss_list[i]]
     return loss, loss_dict
 
@@ -278,8 +442,19 @@ class BaseTrain(object):
     '''
     return loss.mean()
 
+  def collect_weights(self):
+    '''Collects generated weights of forward passes, only if a loss reads them.'''
+    return WeightCollector(enabled='l1pen' in self.loss_list)
+
   def inference(self, zf, coeffs):
-    return self.network(zf, coeffs)
+    if self.arch == 'hyperunet':
+      # Equivalent to self.network(zf, coeffs), split to time each network
+      with self.timer('hnet'):
+        hyp_out = self.network.get_hyp_out(coeffs)
+      with self.timer('unet'):
+        return self.network.unet(zf, hyp_out)
+    with self.timer('unet'):
+      return self.network(zf, coeffs)
 
   def sample_hparams(self, num_samples):
     '''Samples hyperparameters from distribution.'''
@@ -287,19 +462,7 @@ class BaseTrain(object):
 
   def generate_coefficients(self, samples):
     '''Generates coefficients from samples.'''
-    if self.range_restrict and len(self.losses) == 2:
-      alpha = samples[:, 0]
-      coeffs = torch.stack((1-alpha, alpha), dim=1)
-
-    elif self.range_restrict and len(self.losses) == 3:
-      alpha = samples[:, 0]
-      beta = samples[:, 1]
-      coeffs = torch.stack(
-        (alpha, (1-alpha)*beta, (1-alpha)*(1-beta)), dim=1)
-
-    else:
-      coeffs = samples / torch.sum(samples, dim=1)
-
+    coeffs = utils.generate_coefficients(samples, len(self.losses), self.range_restrict)
     return coeffs.to(self.device)
 
   def train_epoch(self):
@@ -310,38 +473,71 @@ class BaseTrain(object):
     epoch_samples = 0
     epoch_psnr = 0
 
+    if hasattr(self.train_loader.sampler, 'set_epoch'):
+      self.train_loader.sampler.set_epoch(self.epoch)
+
+    self.timer.reset()
     start_time = time.time()
+    fetch_start = time.perf_counter()
     for i, batch in tqdm(enumerate(self.train_loader), 
-      total=min(len(self.train_loader), self.num_steps_per_epoch)):
-      loss, psnr, batch_size = self.train_step(batch)
+      total=min(len(self.train_loader), self.num_steps_per_epoch),
+      disable=not self.is_main):
+      self.timer.record('data', time.perf_counter() - fetch_start)
+      if self.global_step in self.profile_steps and self.is_main:
+        loss, psnr, batch_size = self.profile_train_step(batch)
+      else:
+        loss, psnr, batch_size = self.train_step(batch)
+      self.global_step += 1
       epoch_loss += loss * batch_size
       epoch_psnr += psnr * batch_size
       epoch_samples += batch_size
       if i == self.num_steps_per_epoch:
         break
+      fetch_start = time.perf_counter()
     self.scheduler.step()
 
     epoch_time = time.time() - start_time
-    epoch_loss /= epoch_samples
-    epoch_psnr /= epoch_samples
+    epoch_loss = distributed.all_reduce_mean(epoch_loss / epoch_samples)
+    epoch_psnr = distributed.all_reduce_mean(epoch_psnr / epoch_samples)
     self.metrics['loss:train'].append(epoch_loss)
     self.metrics['psnr:train'].append(epoch_psnr)
     self.monitor['learning_rate'].append(self.scheduler.get_last_lr()[0])
     self.monitor['time:train'].append(epoch_time)
+    self.log_stage_times(prefix='time:')
 
     print("train loss={:.6f}, train psnr={:.6f}, train time={:.6f}".format(
       epoch_loss, epoch_psnr, epoch_time))
 
+  def log_stage_times(self, prefix):
+    '''Append per-stage time percentiles since last reset to monitor.'''
+    for key, val in self.timer.summarize(prefix=prefix).items():
+      self.monitor.setdefault(key, []).append(val)
+
+  def profile_train_step(self, batch):
+    '''Train for one step under the autograd profiler and export a trace.'''
+    if not os.path.exists(self.profile_dir):
+      os.makedirs(self.profile_dir)
+    use_cuda = self.device.type == 'cuda'
+    with torch.autograd.profiler.profile(use_cuda=use_cuda) as prof:
+      out = self.train_step(batch)
+    path = os.path.join(self.profile_dir, 'step{:07d}.json'.format(self.global_step))
+    prof.export_chrome_trace(path)
+    print('Saved profiler trace to', path)
+    return out
+
   def prepare_batch(self, batch):
     targets = batch[0]
     targets = targets.view(-1, 1, *targets.shape[-2:]).float().to(self.device)
     bs = len(targets)
 
-    undersample_mask = self.mask_model(bs).to(self.device)
-    measurements = self.forward_model(targets, undersample_mask)
-    measurements = self.noise_model(measurements)
+    with self.timer('prepare:forward'):
+      undersample_mask = self.mask_model(bs).to(self.device)
+      measurements = self.forward_model(targets, undersample_mask)
+    with self.timer('prepare:noise'):
+      measurements = self.noise_model(measurements)
     if self.forward_type == 'csmri':
-      inputs = utils.ifft(measurements)
+      with self.timer('prepare:ifft'):
+        inputs = self.forward_model.adjoint(measurements)
     else:
       inputs = measurements
     return inputs, targets, bs
@@ -354,11 +550,21 @@ class BaseTrain(object):
 
     self.optimizer.zero_grad()
     with torch.set_grad_enabled(True):
-      pred = self.inference(inputs, coeffs)
-      loss, loss_dict = self.compute_loss(targets, pred, coeffs, scales=self.per_loss_scale_constants)
+      with self.collect_weights() as collector:
+        pred = self.inference(inputs, coeffs)
+      loss, loss_dict = self.compute_loss(targets, pred, coeffs, scales=self.per_loss_scale_constants,
+                                          weights=collector.weights)
+      if self.distribution == 'adaptive':
+        # Weights of the distribution the batch was drawn from, before updating it
+        weights = self.sampler.weights(hparams).to(loss.device)
+        self.sampler.update(hparams, loss)
+        loss = loss * weights
       loss = self.process_loss(loss, loss_dict)
-      loss.backward()
-      self.optimizer.step()
+      with self.timer('backward'):
+        loss.backward()
+        distributed.all_reduce_gradients(self.network)
+      with self.timer('optimizer'):
+        self.optimizer.step()
     psnr = loss_ops.PSNR()(targets, pred).mean().item()
     return loss.cpu().detach().numpy(), psnr, batch_size
 
@@ -369,7 +575,9 @@ class BaseTrain(object):
     hyperparameter in the test set. 
     '''
     self.network.eval()
+    self.timer.reset()
     self.validate()
+    self.log_stage_times(prefix='time:val:')
   
   def validate(self):
     for hparam in self.val_hparams:
@@ -426,9 +634,10 @@ class BaseTrain(object):
     hparams = hparams.repeat(batch_size, 1)
     coeffs = self.generate_coefficients(hparams)
     with torch.set_grad_enabled(False):
-      pred = self.inference(inputs, coeffs)
+      with self.collect_weights() as collector:
+        pred = self.inference(inputs, coeffs)
       scales = torch.ones(len(self.loss_list))
-      loss, loss_dict = self.compute_loss(targets, pred, coeffs, scales=scales)
+      loss, loss_dict = self.compute_loss(targets, pred, coeffs, scales=scales, weights=collector.weights)
       loss = self.process_loss(loss, loss_dict)
     return inputs, targets, pred, loss
 
@@ -15,28 +15,41 @@ def fft(x):
 
   x: input of shape (batch_size, n_ch, l, w)
   """
-  # complex_x = torch.view_as_complex(x)
-  # fft = torch.fft.fft2(complex_x,  norm='ortho')
-  # return torch.view_as_real(fft) 
-  x = x.permute(0, 2, 3, 1)
-  if x.shape[-1] == 1:
-    x = torch.cat((x, torch.zeros_like(x)), dim=3)
-  x = torch.fft(x, signal_ndim=2, normalized=True)
-  x = x.permute(0, 3, 1, 2)
-  return x
+  if x.shape[1] == 1:
+    # Real input, no need to allocate an all-zero imaginary channel
+    x = torch.fft.fft2(x[:, 0], norm='ortho')
+  else:
+    x = torch.fft.fft2(torch.view_as_complex(x.permute(0, 2, 3, 1).contiguous()), norm='ortho')
+  return torch.view_as_real(x).permute(0, 3, 1, 2)
 
 def ifft(x):
   """Normalized 2D Inverse Fast Fourier Transform
 
   x: input of shape (batch_size, n_ch, l, w)
   """
-  # complex_x = torch.view_as_complex(x)
-  # ifft = torch.fft.ifft2(complex_x, norm='ortho')
-  # return torch.view_as_real(ifft) 
-  x = x.permute(0, 2, 3, 1)
-  x = torch.ifft(x, signal_ndim=2, normalized=True)
-  x = x.permute(0, 3, 1, 2)
-  return x
+  x = torch.view_as_complex(x.permute(0, 2, 3, 1).contiguous())
+  x = torch.fft.ifft2(x, norm='ortho')
+  return torch.view_as_real(x).permute(0, 3, 1, 2)
+
+def generate_coefficients(samples, num_losses, range_restrict):
+  '''Generates loss coefficients from hyperparameter samples.
+
+  samples: (batch_size, num_hparams)
+  '''
+  if range_restrict and num_losses == 2:
+    alpha = samples[:, 0]
+    coeffs = torch.stack((1-alpha, alpha), dim=1)
+
+  elif range_restrict and num_losses == 3:
+    alpha = samples[:, 0]
+    beta = samples[:, 1]
+    coeffs = torch.stack(
+      (alpha, (1-alpha)*beta, (1-alpha)*(1-beta)), dim=1)
+
+  else:
+    coeffs = samples / torch.sum(samples, dim=1, keepdim=True)
+
+  return coeffs
 
 def linear_normalization(arr, new_range=(0, 1)):
   """Linearly normalizes a batch of images into new_range
@@ -86,7 +99,7 @@ def summary(network):
 def load_checkpoint(model, path, optimizer=None, scheduler=None, verbose=True):
   if verbose:
     print('Loading checkpoint from', path)
-  checkpoint = torch.load(path, map_location=torch.device('cpu'))
+  checkpoint = torch.load(path, map_location=torch.device('cpu'), weights_only=False)
   model.load_state_dict(checkpoint['state_dict'])
   if optimizer is not None and scheduler is not None:
     optimizer.load_state_dict(checkpoint['optimizer'])
@@ -110,7 +123,10 @@ def save_checkpoint(epoch, model, optimizer, model_folder, scheduler=None):
     state['scheduler'] = scheduler.state_dict()
 
   filename = os.path.join(model_folder, 'model.{epoch:04d}.h5')
-  torch.save(state, filename.format(epoch=epoch))
+  # Write to a temporary file and rename so that a checkpoint is never partial
+  tmp = filename.format(epoch=epoch) + '.tmp'
+  torch.save(state, tmp)
+  os.replace(tmp, filename.format(epoch=epoch))
   print('Saved checkpoint to', filename.format(epoch=epoch))
 
 def save_metrics(save_dir, logger, *metrics):
@@ -123,7 +139,8 @@ def save_metrics(save_dir, logger, *metrics):
 
 def get_args(path):
   args_txtfile = os.path.join(path, 'args.txt')
-  if os.path.exists(args_txtfile):
-    with open(args_txtfile) as json_file:
-      config = json.load(json_file)
+  if not os.path.exists(args_txtfile):
+    raise FileNotFoundError('No args.txt in {}'.format(path))
+  with open(args_txtfile) as json_file:
+    config = json.load(json_file)
   return config
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Slice-parallel reconstruction of 3D volumes on CPU.
+
+A volume is split into batches of consecutive slices, which are reconstructed
+by a pool of worker processes, each with its own model and a fixed number of
+intra-op threads. Workers write their slices straight into memory-mapped
+output volumes at the slices' positions, so the output is assembled in order
+and streamed to disk as batches complete, whatever order they complete in.
+"""
+import os
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from hyperrecon.util import utils
+from hyperrecon.inference import Reconstructor, stringify
+
+_worker = {}
+
+
+def load_slices(path, slice_axis=0):
+  '''Memory-mapped volume with slices along dim 0.'''
+  arr = np.load(path, mmap_mode='r')
+  if slice_axis != 0:
+    arr = np.moveaxis(arr, slice_axis, 0)
+  return arr
+
+def _init_worker(run_dir, ckpt, in_path, out_paths, slice_axis, num_threads, kwargs):
+  torch.set_num_threads(num_threads)
+  _worker['recon'] = Reconstructor(run_dir, ckpt=ckpt, device=torch.device('cpu'),
+                                   quantize=kwargs.pop('quantize', False))
+  _worker['arr'] = load_slices(in_path, slice_axis)
+  _worker['outs'] = [np.load(p, mmap_mode='r+') for p in out_paths]
+  _worker['kwargs'] = kwargs
+
+def _reconstruct_batch(task):
+  start, stop, list_of_hparams = task
+  arr, outs = _worker['arr'], _worker['outs']
+  # iter_reconstruct yields a single batch for the whole range
+  for _, recons in _worker['recon'].iter_reconstruct(
+      arr[start:stop], list_of_hparams, batch_size=stop - start, **_worker['kwargs']):
+    for out, recon in zip(outs, recons):
+      out[start:stop] = recon
+  for out in outs:
+    out.flush()
+  return start, stop
+
+
+def reconstruct_volume(run_dir, in_path, out_dir, list_of_hparams, ckpt='latest',
+                       batch_size=8, num_workers=None, threads_per_worker=None,
+                       slice_axis=0, is_measurement=False, tile_size=None,
+                       tile_overlap=32, quantize=False):
+  '''Reconstruct a volume slice-parallel, with one output volume per hparam.
+
+  Args:
+    run_dir: Run directory containing args.txt and checkpoints/
+    in_path: .npy volume of shape [D, l, w], [D, 1, l, w] or, for
+      measurements, [D, 2, l, w]
+    out_dir: Directory of output volumes of shape [D, n_ch_out, l, w]
+    list_of_hparams: Hyperparameter vectors
+    batch_size: Number of slices per task
+    num_workers: Number of worker processes, default 4 or fewer on small machines
+    threads_per_worker: Intra-op threads per worker, default cpus // num_workers
+    slice_axis: Axis of in_path along which to slice, for [D, l, w] volumes
+
+  Returns:
+    Paths of output volumes
+  '''
+  num_cpus = os.cpu_count() or 1
+  num_workers = num_workers or max(1, min(4, num_cpus))
+  threads_per_worker = threads_per_worker or max(1, num_cpus // num_workers)
+  if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+
+  arr = load_slices(in_path, slice_axis)
+  num_slices, image_dims = len(arr), tuple(arr.shape[-2:])
+  n_ch_out = utils.get_args(run_dir)['n_ch_out']
+  stem = os.path.splitext(os.path.basename(in_path))[0]
+  out_paths = []
+  for hp in list_of_hparams:
+    path = os.path.join(out_dir, '{}_hp{}.npy'.format(stem, stringify(hp)))
+    np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                              shape=(num_slices, n_ch_out) + image_dims).flush()
+    out_paths.append(path)
+
+  kwargs = {'is_measurement': is_measurement, 'tile_size': tile_size,
+            'tile_overlap': tile_overlap, 'quantize': quantize}
+  tasks = [(i, min(i + batch_size, num_slices), list_of_hparams)
+           for i in range(0, num_slices, batch_size)]
+  print('Volume {}: {} slices, {} workers x {} threads'.format(
+    in_path, num_slices, num_workers, threads_per_worker))
+
+  ctx = mp.get_context('spawn')
+  start_time = time.time()
+  done = 0
+  with ctx.Pool(num_workers, initializer=_init_worker,
+                initargs=(run_dir, ckpt, in_path, out_paths, slice_axis,
+                          threads_per_worker, kwargs)) as pool:
+    for start, stop in pool.imap_unordered(_reconstruct_batch, tasks):
+      done += stop - start
+      print('{}/{} slices, {:.1f} slices/s'.format(
+        done, num_slices, done / (time.time() - start_time)))
+  return out_paths
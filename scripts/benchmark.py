@@ -0,0 +1,35 @@
+import sys
+import argparse
+from hyperrecon.util import benchmark
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon CPU benchmarks')
+  parser.add_argument('--out', type=str, default='bench.json',
+            help='Path to save results')
+  parser.add_argument('--compare', type=str, default=None,
+            help='Path to baseline results to compare against')
+  parser.add_argument('--threshold', type=float, default=0.1,
+            help='Relative slowdown flagged as a regression')
+  parser.add_argument('--batch_sizes', nargs='+', type=int, default=(4, 16))
+  parser.add_argument('--unet_hdims', nargs='+', type=int, default=(32,))
+  parser.add_argument('--hnet_hdims', nargs='+', type=int, default=(64,))
+  parser.add_argument('--image_sizes', nargs='+', type=int, default=(64, 128))
+  parser.add_argument('--warmup', type=int, default=2)
+  parser.add_argument('--repeat', type=int, default=10)
+  parser.add_argument('--num_threads', type=int, default=None)
+  args = parser.parse_args()
+
+  results = benchmark.run(args.batch_sizes, args.unet_hdims, args.hnet_hdims,
+                          args.image_sizes, warmup=args.warmup, repeat=args.repeat,
+                          num_threads=args.num_threads)
+  benchmark.save(results, args.out)
+  print('Saved results to', args.out)
+
+  if args.compare is not None:
+    regressions = benchmark.compare(results, benchmark.load(args.compare), args.threshold)
+    for key, base_ms, cur_ms, ratio in regressions:
+      print('REGRESSION {}: {:.3f} ms -> {:.3f} ms ({:.2f}x)'.format(key, base_ms, cur_ms, ratio))
+    if len(regressions) > 0:
+      sys.exit(1)
+    print('No regressions against', args.compare)
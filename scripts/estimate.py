@@ -0,0 +1,36 @@
+import argparse
+import json
+import torch
+from hyperrecon.util import estimate
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Estimate HyperUnet FLOPs and memory')
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--image_dims', nargs=2, type=int, default=(256, 256))
+  parser.add_argument('--unet_hdim', type=int, default=32)
+  parser.add_argument('--hnet_hdim', type=int, default=128)
+  parser.add_argument('--num_losses', type=int, default=2)
+  parser.add_argument('--n_ch_in', type=int, default=2)
+  parser.add_argument('--no_batchnorm', action='store_true')
+  parser.add_argument('--budget_gb', type=float, default=None,
+            help='Recommend the largest batch size fitting this memory budget')
+  parser.add_argument('--measure', action='store_true',
+            help='Compare estimates against a measured training step')
+  parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+  args = parser.parse_args()
+
+  config = dict(image_dims=args.image_dims, unet_hdim=args.unet_hdim, hnet_hdim=args.hnet_hdim,
+                num_losses=args.num_losses, n_ch_in=args.n_ch_in,
+                use_batchnorm=not args.no_batchnorm)
+  if args.measure:
+    rows = estimate.compare(args.batch_size, device=torch.device(args.device), **config)
+    for key, row in rows.items():
+      print('{:<26s} {:>16} {:>16} {:>8}'.format(
+        key, *[('{:.4g}'.format(v) if v is not None else '-')
+               for v in [row['estimate'], row['measured'], row['ratio']]]))
+  else:
+    print(json.dumps(estimate.estimate(args.batch_size, **config), indent=2))
+  if args.budget_gb is not None:
+    bs = estimate.recommend_batch_size(args.budget_gb * 2 ** 30, **config)
+    print('Largest batch size for {} GB: {}'.format(args.budget_gb, bs))
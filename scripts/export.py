@@ -0,0 +1,40 @@
+import argparse
+import torch
+from hyperrecon.inference import Reconstructor
+from hyperrecon.model import export
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Export HyperUnet to TorchScript or ONNX')
+  parser.add_argument('--run_dir', type=str, required=True)
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--out', type=str, required=True)
+  parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'])
+  parser.add_argument('--freeze_hparams', nargs='+', type=float, default=None,
+            help='Export a graph of the image only, frozen at these hyperparameters')
+  parser.add_argument('--batch_size', type=int, default=1,
+            help='Batch size of example inputs for tracing and parity check')
+  parser.add_argument('--atol', type=float, default=1e-4)
+  args = parser.parse_args()
+
+  recon = Reconstructor(args.run_dir, ckpt=args.ckpt)
+  assert recon.config['arch'] == 'hyperunet', 'Only hyperunet models can be exported'
+  num_losses = len(recon.loss_list)
+  zf = torch.randn(args.batch_size, recon.n_ch_in, *recon.image_dims)
+  if args.freeze_hparams is not None:
+    hparams = torch.tensor(args.freeze_hparams).view(1, -1).repeat(args.batch_size, 1)
+    example_inputs = (zf,)
+  else:
+    hparams = torch.rand(args.batch_size, recon.num_hparams)
+    example_inputs = (zf, hparams)
+
+  module = export.export(recon.network, args.out, num_losses, recon.range_restrict,
+                         fmt=args.format, freeze_hparams=args.freeze_hparams,
+                         example_inputs=example_inputs)
+  if args.format == 'torchscript':
+    module = torch.jit.load(args.out)
+  err = export.check_parity(recon.network, module, zf, hparams, num_losses,
+                            recon.range_restrict, frozen=args.freeze_hparams is not None)
+  print('Max abs difference to HyperUnet: {:.3e}'.format(err))
+  assert err < args.atol, 'Exported model does not match HyperUnet'
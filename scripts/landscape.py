@@ -0,0 +1,46 @@
+import argparse
+import os
+import numpy as np
+import torch
+from hyperrecon.inference import Reconstructor
+from hyperrecon.landscape import Landscape
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon hyperparameter landscape')
+  parser.add_argument('--run_dir', type=str, required=True,
+            help='Run directory containing args.txt and checkpoints/')
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--data', type=str, required=True,
+            help='.npy of ground-truth slices of shape [N, 1, l, w] or [N, l, w]')
+  parser.add_argument('--slices', nargs='+', type=int, default=None,
+            help='Slice indices to evaluate, default all')
+  parser.add_argument('--cache_dir', type=str, required=True)
+  parser.add_argument('--res', type=int, default=5, help='Points per dimension of initial grid')
+  parser.add_argument('--simplex', action='store_true',
+            help='Evaluate a dense simplex grid instead of refining the cube')
+  parser.add_argument('--refine_steps', type=int, default=3)
+  parser.add_argument('--refine_cells', type=int, default=4)
+  parser.add_argument('--metric', choices=['psnr', 'ssim'], default='psnr')
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--save_recons', action='store_true')
+  parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+  args = parser.parse_args()
+
+  gt = np.load(args.data, mmap_mode='r')
+  if args.slices is not None:
+    gt = gt[args.slices]
+  gt = np.array(gt, dtype=np.float32)
+  if gt.ndim == 3:
+    gt = gt[:, None]
+
+  reconstructor = Reconstructor(args.run_dir, ckpt=args.ckpt, device=torch.device(args.device))
+  landscape = Landscape(reconstructor, gt, args.cache_dir, batch_size=args.batch_size,
+                        save_recons=args.save_recons)
+  if args.simplex:
+    landscape.dense(args.res, simplex=True)
+  else:
+    landscape.refine(args.res, args.refine_steps, args.refine_cells, metric=args.metric)
+  np.savez(os.path.join(args.cache_dir, 'landscape.npz'), **landscape.to_arrays())
+  print('Best {}: {} at {}'.format(args.metric, *reversed(landscape.best(args.metric))))
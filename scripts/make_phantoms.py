@@ -0,0 +1,28 @@
+import os
+import argparse
+import numpy as np
+from hyperrecon.data import phantom
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Generate synthetic phantom data')
+  parser.add_argument('--out_dir', type=str, required=True)
+  parser.add_argument('--image_dims', nargs=2, type=int, default=(256, 256))
+  parser.add_argument('--num_phantoms', nargs=2, type=int, default=(1024, 64),
+            help='Number of train and test phantoms')
+  parser.add_argument('--undersampling_rates', nargs='+', type=str, default=('4', '8'))
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  if not os.path.exists(args.out_dir):
+    os.makedirs(args.out_dir)
+  l, w = args.image_dims
+  num_train, num_test = args.num_phantoms
+  np.save(os.path.join(args.out_dir, 'phantom_train_{}_{}.npy'.format(l, w)),
+          phantom.phantom_dataset(num_train, args.image_dims, seed=args.seed))
+  np.save(os.path.join(args.out_dir, 'phantom_test_{}_{}.npy'.format(l, w)),
+          phantom.phantom_dataset(num_test, args.image_dims, seed=args.seed + 1))
+  for rate in args.undersampling_rates:
+    mask = phantom.variable_density_mask(args.image_dims, phantom.parse_rate(rate), seed=args.seed)
+    np.save(os.path.join(args.out_dir, 'vds_{}_{}_{}.npy'.format(rate, l, w)), mask)
+  print('Saved phantoms and masks to', args.out_dir)
@@ -0,0 +1,34 @@
+import argparse
+import json
+import numpy as np
+import torch
+from hyperrecon.inference import Reconstructor
+from hyperrecon.model import quantize
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Accuracy report of INT8 HyperUnet against fp32')
+  parser.add_argument('--run_dir', type=str, required=True)
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--data', type=str, required=True,
+            help='.npy of validation images of shape [N, 1, l, w] or [N, l, w]')
+  parser.add_argument('--hparams', nargs='+', type=float, action='append', required=True,
+            help='Hyperparameter vector, repeat flag for several')
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--no_kernel_quant', action='store_true',
+            help='Keep generated conv kernels in fp32')
+  parser.add_argument('--out', type=str, default=None, help='Path to save report as json')
+  args = parser.parse_args()
+
+  torch.manual_seed(0)
+  reconstructor = Reconstructor(args.run_dir, ckpt=args.ckpt)
+  qnetwork = quantize.quantize(reconstructor.network, quantize_kernels=not args.no_kernel_quant)
+  gt = np.load(args.data, mmap_mode='r')
+  if gt.ndim == 3:
+    gt = gt[:, None]
+  report = quantize.accuracy_report(reconstructor, qnetwork, gt, args.hparams, args.batch_size)
+  print(json.dumps(report, indent=2))
+  if args.out is not None:
+    with open(args.out, 'w') as f:
+      json.dump(report, f, indent=2)
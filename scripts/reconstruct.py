@@ -0,0 +1,32 @@
+import argparse
+import torch
+from hyperrecon.inference import Reconstructor, reconstruct_dir
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon batch reconstruction')
+  parser.add_argument('--run_dir', type=str, required=True,
+            help='Run directory containing args.txt and checkpoints/')
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--in_dir', type=str, required=True,
+            help='Directory of .npy inputs of shape [N, 1, l, w] or [N, l, w]')
+  parser.add_argument('--out_dir', type=str, required=True)
+  parser.add_argument('--hparams', nargs='+', type=float, action='append', required=True,
+            help='Hyperparameter vector, repeat flag for several')
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--measurements', action='store_true',
+            help='Inputs are already undersampled measurements')
+  parser.add_argument('--tile_size', type=int, default=None,
+            help='Reconstruct in overlapping tiles of this size, a multiple of 8')
+  parser.add_argument('--tile_overlap', type=int, default=32)
+  parser.add_argument('--quantize', action='store_true',
+            help='Quantize the network to INT8 for CPU inference')
+  parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+  args = parser.parse_args()
+
+  reconstructor = Reconstructor(args.run_dir, ckpt=args.ckpt, device=torch.device(args.device),
+                                quantize=args.quantize)
+  reconstruct_dir(reconstructor, args.in_dir, args.out_dir, args.hparams,
+                  batch_size=args.batch_size, is_measurement=args.measurements,
+                  tile_size=args.tile_size, tile_overlap=args.tile_overlap)
@@ -0,0 +1,31 @@
+import argparse
+from hyperrecon.volume import reconstruct_volume
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon slice-parallel volume reconstruction')
+  parser.add_argument('--run_dir', type=str, required=True,
+            help='Run directory containing args.txt and checkpoints/')
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--volume', type=str, required=True,
+            help='.npy volume of shape [D, l, w] or [D, n_ch, l, w]')
+  parser.add_argument('--out_dir', type=str, required=True)
+  parser.add_argument('--hparams', nargs='+', type=float, action='append', required=True,
+            help='Hyperparameter vector, repeat flag for several')
+  parser.add_argument('--slice_axis', type=int, default=0)
+  parser.add_argument('--batch_size', type=int, default=8, help='Slices per task')
+  parser.add_argument('--num_workers', type=int, default=None)
+  parser.add_argument('--threads_per_worker', type=int, default=None)
+  parser.add_argument('--measurements', action='store_true',
+            help='Volume holds undersampled measurements')
+  parser.add_argument('--tile_size', type=int, default=None)
+  parser.add_argument('--tile_overlap', type=int, default=32)
+  parser.add_argument('--quantize', action='store_true')
+  args = parser.parse_args()
+
+  reconstruct_volume(args.run_dir, args.volume, args.out_dir, args.hparams, ckpt=args.ckpt,
+                     batch_size=args.batch_size, num_workers=args.num_workers,
+                     threads_per_worker=args.threads_per_worker, slice_axis=args.slice_axis,
+                     is_measurement=args.measurements, tile_size=args.tile_size,
+                     tile_overlap=args.tile_overlap, quantize=args.quantize)
@@ -2,19 +2,28 @@ import torch
 import os
 from hyperrecon.argparser import Parser
 from hyperrecon import train_and_eval_lib
+from hyperrecon.util import distributed
+
+
+def main(args):
+  trainer = train_and_eval_lib.get_trainer(args)
+  trainer.config()
+  trainer.train()
 
 
 if __name__ == "__main__":
   args = Parser().parse()
 
-  # GPU Handling
-  if torch.cuda.is_available():
-    args.device = torch.device('cuda:0')
+  if args.world_size > 1:
+    # Each spawned process sets its own rank and device
+    distributed.launch(main, args)
   else:
-    args.device = torch.device('cpu')
-    print('WARNING: No GPU detected!')
-  os.environ["CUDA_VISIBLE_DEVICES"] = str(0)
-
-  trainer = train_and_eval_lib.get_trainer(args)
-  trainer.config()
-  trainer.train()
+    # GPU Handling
+    if torch.cuda.is_available():
+      args.device = torch.device('cuda:0')
+    else:
+      args.device = torch.device('cpu')
+      print('WARNING: No GPU detected!')
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(0)
+    args.rank = 0
+    main(args)
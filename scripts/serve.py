@@ -0,0 +1,26 @@
+import argparse
+import torch
+from hyperrecon.inference import Reconstructor
+from hyperrecon.serve import serve
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon reconstruction server')
+  parser.add_argument('--run_dir', type=str, required=True)
+  parser.add_argument('--ckpt', type=str, default='latest',
+            help='One of [latest, best], an epoch, or a checkpoint path')
+  parser.add_argument('--host', type=str, default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--max_batch_size', type=int, default=16)
+  parser.add_argument('--max_wait_ms', type=float, default=10.,
+            help='Latency budget for coalescing requests into a batch')
+  parser.add_argument('--max_queue', type=int, default=256,
+            help='Pending requests beyond which new requests are rejected with 503')
+  parser.add_argument('--quantize', action='store_true',
+            help='Quantize the network to INT8 for CPU inference')
+  parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+  args = parser.parse_args()
+
+  reconstructor = Reconstructor(args.run_dir, ckpt=args.ckpt, device=torch.device(args.device),
+                                quantize=args.quantize)
+  serve(reconstructor, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.max_queue)
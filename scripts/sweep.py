@@ -0,0 +1,19 @@
+import argparse
+from hyperrecon.sweep import Sweep, load_config
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='HyperRecon sweep')
+  parser.add_argument('config', type=str, help='Path to sweep config json')
+  parser.add_argument('--sweep_dir', type=str, required=True,
+            help='Directory to save sweep status')
+  parser.add_argument('--num_workers', type=int, default=None,
+            help='Override maximum number of concurrent runs')
+  parser.add_argument('--retry_failed', action='store_true')
+  args = parser.parse_args()
+
+  base, grid, num_workers, pruning = load_config(args.config)
+  if args.num_workers is not None:
+    num_workers = args.num_workers
+  sweep = Sweep(args.sweep_dir, base, grid, num_workers=num_workers, pruning=pruning)
+  sweep.run(retry_failed=args.retry_failed)
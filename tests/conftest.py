@@ -0,0 +1,28 @@
+import os
+import pytest
+
+
+@pytest.fixture
+def make_run(tmp_path):
+  '''Run directory with args.txt and a checkpoint of an untrained HyperUnet.'''
+  torch = pytest.importorskip('torch')
+  from hyperrecon.argparser import Parser
+  from hyperrecon.model.unet import HyperUnet
+  from hyperrecon.util.forward import num_input_channels
+
+  def make(forward_type='csmri', image_size=32, loss_list=('l1', 'tv')):
+    args = Parser().parse(['-fp', 'test', '--models_dir', str(tmp_path), '--date', 'test',
+                           '--method', 'base_train', '--dataset', 'phantom', '--loss_list'] + list(loss_list) + [
+                           '--forward_type', forward_type, '--mask_type', 'vds',
+                           '--undersampling_rate', '4', '--image_dims', str(image_size), str(image_size),
+                           '--unet_hdim', '8', '--hnet_hdim', '16'])
+    torch.manual_seed(0)
+    network = HyperUnet(len(loss_list), args.hnet_hdim, in_ch_main=num_input_channels(forward_type),
+                        out_ch_main=args.n_ch_out, h_ch_main=args.unet_hdim,
+                        residual=args.unet_residual, use_batchnorm=args.use_batchnorm).eval()
+    ckpt_dir = os.path.join(args.run_dir, 'checkpoints')
+    os.makedirs(ckpt_dir)
+    torch.save({'epoch': 0, 'state_dict': network.state_dict()},
+               os.path.join(ckpt_dir, 'model.0000.h5'))
+    return args.run_dir
+  return make
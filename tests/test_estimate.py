@@ -0,0 +1,26 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from hyperrecon.util import estimate
+
+
+@pytest.mark.parametrize('unet_hdim,hnet_hdim,num_losses,use_batchnorm', [
+  (8, 16, 2, True),
+  (4, 8, 3, False),
+])
+def test_estimate_matches_measured(unet_hdim, hnet_hdim, num_losses, use_batchnorm):
+  kwargs = dict(batch_size=2, image_dims=(32, 32), unet_hdim=unet_hdim, hnet_hdim=hnet_hdim,
+                num_losses=num_losses, use_batchnorm=use_batchnorm)
+  est = estimate.estimate(**kwargs)
+  meas = estimate.measure(**kwargs)
+  assert est['params'] == meas['params']
+  assert est['bytes:generated_weights'] == meas['bytes:generated_weights']
+
+def test_recommend_batch_size_fits_budget():
+  kwargs = dict(image_dims=(64, 64), unet_hdim=8, hnet_hdim=16, num_losses=2)
+  budget = 256 * 2 ** 20
+  bs = estimate.recommend_batch_size(budget, **kwargs)
+  assert bs > 0 and bs % 2 == 0
+  assert estimate.estimate(bs, **kwargs)['bytes:peak'] <= 0.9 * budget
+  assert estimate.estimate(bs + 2, **kwargs)['bytes:peak'] > 0.9 * budget
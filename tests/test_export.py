@@ -0,0 +1,45 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from hyperrecon.model import export
+from hyperrecon.model.unet import HyperUnet
+
+NUM_LOSSES = 2
+RANGE_RESTRICT = True
+
+
+@pytest.fixture
+def network():
+  torch.manual_seed(0)
+  return HyperUnet(NUM_LOSSES, 16, in_ch_main=2, out_ch_main=1, h_ch_main=8,
+                   use_batchnorm=True).eval()
+
+def test_torchscript_parity(network, tmp_path):
+  path = str(tmp_path / 'model.pt')
+  export.export(network, path, NUM_LOSSES, RANGE_RESTRICT, fmt='torchscript')
+  module = torch.jit.load(path)
+  zf = torch.randn(3, 2, 32, 32)
+  hparams = torch.rand(3, 1)
+  assert export.check_parity(network, module, zf, hparams, NUM_LOSSES, RANGE_RESTRICT) < 1e-4
+
+def test_torchscript_frozen_parity(network, tmp_path):
+  path = str(tmp_path / 'frozen.pt')
+  export.export(network, path, NUM_LOSSES, RANGE_RESTRICT, fmt='torchscript', freeze_hparams=[0.3])
+  module = torch.jit.load(path)
+  zf = torch.randn(3, 2, 32, 32)
+  hparams = torch.full((3, 1), 0.3)
+  assert export.check_parity(network, module, zf, hparams, NUM_LOSSES, RANGE_RESTRICT,
+                             frozen=True) < 1e-4
+
+def test_onnx_parity(network, tmp_path):
+  pytest.importorskip('onnx')
+  ort = pytest.importorskip('onnxruntime')
+  path = str(tmp_path / 'model.onnx')
+  zf = torch.randn(3, 2, 32, 32)
+  hparams = torch.rand(3, 1)
+  export.export(network, path, NUM_LOSSES, RANGE_RESTRICT, fmt='onnx', example_inputs=(zf, hparams))
+  session = ort.InferenceSession(path)
+  out = session.run(None, {'zf': zf.numpy(), 'hparams': hparams.numpy()})[0]
+  module = lambda zf, hparams: torch.as_tensor(out)
+  assert export.check_parity(network, module, zf, hparams, NUM_LOSSES, RANGE_RESTRICT) < 1e-4
@@ -0,0 +1,37 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+F = torch.nn.functional
+
+from hyperrecon.util.forward import SuperresolutionForward
+
+
+@pytest.mark.parametrize('factor', [2, 4])
+def test_superresolution_adjoint(factor):
+  forward = SuperresolutionForward(factor)
+  x = torch.randn(3, 1, 32, 48, dtype=torch.float64)
+  y = torch.randn(3, 1, 32, 48, dtype=torch.float64)
+  lhs = (forward(x) * y).sum()
+  rhs = (x * forward.adjoint(y)).sum()
+  assert torch.allclose(lhs, rhs, rtol=1e-10)
+
+@pytest.mark.parametrize('factor', [2, 4])
+def test_superresolution_matches_interpolation(factor):
+  forward = SuperresolutionForward(factor)
+  x = torch.rand(2, 1, 32, 32)
+  down = F.interpolate(x, scale_factor=1. / factor, mode='bicubic', align_corners=False)
+  expected = F.interpolate(down, scale_factor=factor, mode='nearest')
+  assert torch.allclose(forward(x), expected, atol=1e-5)
+
+def test_superresolution_data_consistency():
+  forward = SuperresolutionForward(4)
+  gt = torch.rand(2, 1, 32, 32)
+  y = forward(gt)
+  pred = gt + 0.1 * torch.randn_like(gt)
+  dc = forward.data_consistency(pred, y)
+  assert (forward(dc) - y).norm() < 0.5 * (forward(pred) - y).norm()
+
+def test_superresolution_cache_per_instance():
+  a, b = SuperresolutionForward(2), SuperresolutionForward(2)
+  a(torch.rand(1, 1, 16, 16))
+  assert len(a._cache) == 1 and len(b._cache) == 0
@@ -0,0 +1,25 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from hyperrecon.inference import Reconstructor
+
+
+@pytest.mark.parametrize('forward_type', ['csmri', 'superresolution'])
+def test_data_consistency(make_run, forward_type):
+  recon = Reconstructor(make_run(forward_type))
+  x = torch.rand(2, 1, 32, 32)
+  y, mask = recon.measure(x)
+  plain = recon.reconstruct(x, [0.5])
+  dc = recon.reconstruct(x, [0.5], data_consistency=True)
+  residual = lambda out: (recon.forward_model(out, mask) - y).norm()
+  assert residual(dc) < residual(plain)
+
+@pytest.mark.parametrize('forward_type', ['csmri', 'superresolution', 'denoising'])
+def test_reconstruct_other_size(make_run, forward_type):
+  recon = Reconstructor(make_run(forward_type, image_size=32))
+  x = torch.rand(2, 1, 48, 48)
+  out = recon.reconstruct(x, [0.5])
+  assert out.shape == (2, 1, 48, 48)
+  out = recon.reconstruct_per_sample(x, torch.rand(2, 1))
+  assert out.shape == (2, 1, 48, 48)
@@ -0,0 +1,45 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+
+from hyperrecon.inference import Reconstructor
+from hyperrecon.serve import DynamicBatcher, ThreadingHTTPServer, make_handler, encode_array, decode_array
+
+
+@pytest.fixture
+def server(make_run):
+  batcher = DynamicBatcher(Reconstructor(make_run('csmri', image_size=32)), max_wait_ms=1.)
+  httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(batcher))
+  thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+  thread.start()
+  yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+  httpd.shutdown()
+
+def post(url, body):
+  req = urllib.request.Request(url + '/reconstruct', data=json.dumps(body).encode('utf-8'),
+                               headers={'Content-Type': 'application/json'})
+  try:
+    with urllib.request.urlopen(req) as resp:
+      return resp.status, json.loads(resp.read())
+  except urllib.error.HTTPError as e:
+    return e.code, json.loads(e.read())
+
+def test_serve_other_size(server):
+  status, body = post(server, {'data': encode_array(np.random.rand(48, 48)), 'hparams': [0.5]})
+  assert status == 200
+  assert decode_array(body['recon']).shape == (1, 48, 48)
+
+@pytest.mark.parametrize('data, hparams', [
+  (np.random.rand(48, 48), [0.5, 0.5]),   # Wrong number of hyperparameters
+  (np.random.rand(50, 50), [0.5]),        # Not a multiple of 8
+  (np.random.rand(3, 48, 48), [0.5]),     # Wrong number of channels
+])
+def test_serve_bad_input(server, data, hparams):
+  status, body = post(server, {'data': encode_array(data), 'hparams': hparams})
+  assert status == 400
+  assert 'error' in body